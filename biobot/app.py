@@ -11,7 +11,11 @@ import psycopg2
 import psycopg2.extras
 import psycopg2.errors
 
-from engine import process_user_query
+from engine import process_user_query, RAG_MODE
+from index_manager import INDEX_MANAGER
+from stage_timings import TIMINGS
+from response_cache import get_response_cache
+from rag_events import TimingEvent
 from config import get_api_key, get_db_connection
 from crypt import generate_salt, derive_key, encrypt, decrypt
 
@@ -32,6 +36,32 @@ app.config["PERMANENT_SESSION_LIFETIME"] = 86400  # 24 hours in seconds
 
 MODEL_NAME = "gpt-5"
 
+
+# ---------------------
+# Index preloading
+# ---------------------
+def preload_indexes():
+    """
+    Load all handler indexes once at import time, so that with
+    `gunicorn --preload` they are loaded before the workers fork and their
+    pages are shared copy-on-write. gc.freeze() then keeps the garbage
+    collector from touching (and so un-sharing) the preloaded objects.
+    Only the in-process RAG mode uses indexes in this process.
+    """
+    if RAG_MODE != "inprocess":
+        return
+    import gc
+    import main_rag
+    start = time.perf_counter()
+    loaded = main_rag.preload_indexes()
+    gc.freeze()
+    print(f"Preloaded {len(loaded)} handler index(es) in {time.perf_counter() - start:.1f}s: "
+          f"{', '.join(loaded) or 'none'}", flush=True)
+
+
+if os.environ.get("BIOBOT_PRELOAD_INDEXES"):
+    preload_indexes()
+
 # ---------------------
 # Encryption helpers
 # ---------------------
@@ -357,7 +387,8 @@ def chat(chat_id):
     messages = [{"role": r["role"], "content": decrypt_text(r["content"])} for r in rows]
 
     # call your engine
-    bot_reply = process_user_query(user_message, messages, MODEL_NAME, api_key=user_api_key)
+    bot_reply = process_user_query(user_message, messages, MODEL_NAME, api_key=user_api_key,
+                                   enc_key=get_encryption_key())
 
     # save bot response (encrypted)
     conn = None
@@ -489,14 +520,18 @@ def chat_stream(chat_id):
         is_rag = False
         detected_format = "text"
 
-        from engine import RAG_STATUS_PREFIX, FAILED_CODE_MARKER, FORMAT_MARKER
+        from engine import RAG_STATUS_PREFIX, FAILED_CODE_MARKER, FORMAT_MARKER, TIMING_MARKER
         
+        request_start = time.perf_counter()
         try:
-            result = process_user_query(user_message, messages, MODEL_NAME, api_key=user_api_key)
+            result = process_user_query(user_message, messages, MODEL_NAME, api_key=user_api_key, enc_key=enc_key)
             if result is None:
                 yield "Sorry, I couldn't process your request. Please try again."
                 return
             for chunk in result:
+                if chunk.startswith(TIMING_MARKER):
+                    TIMINGS.record(TimingEvent.from_json(chunk[len(TIMING_MARKER):]))
+                    continue
                 if chunk.startswith(RAG_STATUS_PREFIX):
                     is_rag = True
                     status_text = chunk[len(RAG_STATUS_PREFIX):]
@@ -527,6 +562,7 @@ def chat_stream(chat_id):
             else:
                 yield f"An error occurred: {str(e)}"
             return
+        TIMINGS.record(TimingEvent("request", round(time.perf_counter() - request_start, 4)))
 
         # --- Save to DB (after streaming is complete) ---
         try:
@@ -775,5 +811,93 @@ def update_user_profile():
     return jsonify({"success": True})
 
 
+# ---------------------
+# Ops
+# ---------------------
+# Users allowed to read and reset the ops counters, by email (comma-separated)
+OPS_ADMINS = {e.strip().lower() for e in os.environ.get("BIOBOT_OPS_ADMINS", "").split(",") if e.strip()}
+
+
+def is_ops_admin(user_id):
+    """Whether the logged-in user is listed in BIOBOT_OPS_ADMINS."""
+    if not user_id or not OPS_ADMINS:
+        return False
+    conn = None
+    try:
+        conn = get_db_connection()
+        user = fetchone_dict(conn, "SELECT email FROM users WHERE id = %s", (user_id,))
+    finally:
+        if conn:
+            conn.close()
+    return bool(user) and (user["email"] or "").lower() in OPS_ADMINS
+
+
+def ops_response(stats):
+    """
+    Ops stats are kept in memory by each process: say which process answered,
+    since with several gunicorn workers every worker has its own counters.
+    """
+    return jsonify(dict(
+        stats,
+        rag_mode=RAG_MODE,
+        pid=os.getpid(),
+        scope="process",
+        note="Counters of the gunicorn worker process that served this request only.",
+    ))
+
+
+@app.route("/ops/indexes", methods=["GET"])
+def ops_indexes():
+    """Handler indexes loaded by this process, with hit/miss/load-time stats."""
+    if not is_ops_admin(session.get("user")):
+        return jsonify({"error": "Not allowed"}), 403
+
+    # In worker/subprocess mode the indexes live in other processes
+    return ops_response(INDEX_MANAGER.stats())
+
+
+@app.route("/ops/timings", methods=["GET"])
+def ops_timings():
+    """
+    Per-stage wall time (p50/p95/max) and model tokens of the requests served
+    by this process, since it started or since the last reset.
+    """
+    if not is_ops_admin(session.get("user")):
+        return jsonify({"error": "Not allowed"}), 403
+
+    return ops_response(TIMINGS.stats())
+
+
+@app.route("/ops/timings/reset", methods=["POST"])
+def ops_timings_reset():
+    """Start a new timing window in this process."""
+    if not is_ops_admin(session.get("user")):
+        return jsonify({"error": "Not allowed"}), 403
+
+    stats = TIMINGS.stats()
+    TIMINGS.reset()
+    return ops_response(stats)
+
+
+@app.route("/ops/cache", methods=["GET"])
+def ops_cache():
+    """
+    Hit rates of the response cache (per stage) and of the question-embedding
+    cache, for the lookups made by this process.
+    """
+    if not is_ops_admin(session.get("user")):
+        return jsonify({"error": "Not allowed"}), 403
+
+    # Imported lazily: numpy is only needed once a code request comes in
+    from embedding_cache import get_query_cache
+    query_cache = get_query_cache()
+
+    # In worker/subprocess mode the pipeline's lookups happen in other processes
+    return ops_response(dict(
+        get_response_cache().stats(),
+        query_embeddings=query_cache.stats() if query_cache is not None else None,
+    ))
+
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5000)
\ No newline at end of file
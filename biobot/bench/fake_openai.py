@@ -0,0 +1,437 @@
+"""
+Local stand-in for the OpenAI API, for profiling the pipeline offline.
+
+Implements the two endpoints BioBot uses:
+    POST /v1/responses     plain and streamed (SSE) responses
+    POST /v1/embeddings    float or base64 vectors
+plus GET /stats, the number of calls and seconds spent per pipeline stage.
+
+Each request is matched to a pipeline stage (triage, classify, sufficiency,
+consolidate, detect, generate, review, reverse_check, ...) by keywords of
+its prompt, answered with a canned output for that stage after a configurable
+latency, so a code request runs end to end: it is classified as code, judged
+sufficient, detected as --platform, generated and passes review. Embeddings
+are deterministic hashed bag-of-words vectors (hash_embeddings), so retrieval
+returns related chunks, as long as the handler stores were built with the
+same stub: vectors from the real API live in another space, and a question
+embedded here would be compared with unrelated chunk vectors.
+
+Benchmark a scratch copy of biobot/, whose stores --build-stores rebuilds
+with hash_embeddings before serving, and point it at this server through the
+OpenAI SDK's environment variable (a separate cache dir keeps real cached
+embeddings out):
+    cp -r biobot /tmp/biobot-bench
+    python biobot/bench/fake_openai.py --port 8900 --latency 0.5 --stage-latency generate=6,review=3 \
+        --build-stores /tmp/biobot-bench
+    cd /tmp/biobot-bench && OPENAI_BASE_URL=http://127.0.0.1:8900/v1 BIOBOT_CACHE_DIR=/tmp/biobot-bench/cache \
+        gunicorn ... app:app
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import zlib
+import base64
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+BIOBOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BIOBOT_DIR)
+
+from lexical_index import tokenize
+
+
+# Not text-embedding-3-small's 1536, so a store built with the real API fails loudly on the first search
+DEFAULT_EMBEDDING_DIM = 256
+
+CANNED_PROTOCOL = '''from opentrons import protocol_api
+
+metadata = {"protocolName": "Benchmark transfer", "apiLevel": "2.15"}
+
+
+def run(protocol: protocol_api.ProtocolContext):
+    tips = protocol.load_labware("opentrons_96_tiprack_300ul", 1)
+    plate = protocol.load_labware("corning_96_wellplate_360ul_flat", 2)
+    p300 = protocol.load_instrument("p300_single_gen2", "right", tip_racks=[tips])
+    p300.transfer(50, plate["A1"], plate.columns()[1], mix_after=(3, 25))
+'''
+
+CANNED_CHAT = (
+    "Acoustic liquid handlers move nanoliter droplets with sound energy, so there are no tips to "
+    "change and no contact with the sample. Pipetting robots are more flexible for larger volumes "
+    "and for steps such as mixing, heating or moving labware between modules."
+)
+
+# (stage, keyword of its prompt) in match order; the first keyword found in the request wins
+STAGES = [
+    ("triage", "fill in every field of the JSON answer"),
+    ("classify", "You are a classifier assistant"),
+    ("sufficiency", "contains enough information to generate"),
+    ("consolidate", "consolidates"),
+    ("detect", "identify which liquid handling PLATFORM"),
+    ("platform_name", "official full name of this liquid handling"),
+    ("doc_discovery", "documentation for the given liquid handling platform"),
+    ("review", "specialized reviewer"),
+    ("reverse_check", "Does this script match what the user requested"),
+    ("fix", "Please correct ALL the issues"),
+    ("generate", "Generate a complete, functional"),
+]
+CODE_WORDS = ("protocol", "script", "code", "transfer", "pipette", "plate", "generate", "write")
+
+
+def hash_embeddings(texts, dim):
+    """
+    Deterministic stand-in for an embedding model: signed feature hashing of
+    BM25 tokens with log term frequency, L2-normalized. float32 (len(texts), dim).
+    """
+    matrix = np.zeros((len(texts), dim), dtype=np.float32)
+    for row, text in enumerate(texts):
+        for token in tokenize(text):
+            h = zlib.crc32(token.encode("utf-8"))
+            matrix[row, h % dim] += 1.0 if h & 0x80000000 else -1.0
+    matrix = np.sign(matrix) * np.log1p(np.abs(matrix))
+    matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+    return matrix
+
+
+def _message_text(content):
+    if isinstance(content, str):
+        return content
+    # Content parts: [{"type": "input_text", "text": ...}, ...]
+    return " ".join(part.get("text", "") for part in content or [] if isinstance(part, dict))
+
+
+def _messages(body):
+    items = body.get("input")
+    if isinstance(items, str):
+        return [{"role": "user", "content": items}]
+    return [{"role": m.get("role", "user"), "content": _message_text(m.get("content"))}
+            for m in items or [] if isinstance(m, dict)]
+
+
+def match_stage(messages):
+    prompt = "\n".join(m["content"] for m in messages)
+    for stage, keyword in STAGES:
+        if keyword in prompt:
+            return stage
+    return "chat"
+
+
+def _latest_user_message(messages):
+    text = next((m["content"] for m in reversed(messages) if m["role"] == "user"), "")
+    match = re.search(r"Latest (?:message|request): (.*)", text, re.DOTALL)
+    return (match.group(1) if match else text).split("\n\nRecent conversation:")[0].strip()
+
+
+def canned_output(stage, messages, platform):
+    latest = _latest_user_message(messages)
+    if stage == "triage":
+        return json.dumps({"sufficient": True, "follow_up_question": None,
+                           "consolidated_request": canned_output("consolidate", messages, platform),
+                           "platform": platform})
+    if stage == "classify":
+        return "code" if any(w in latest.lower() for w in CODE_WORDS) else "general"
+    if stage == "sufficiency":
+        return "SUFFICIENT"
+    if stage == "consolidate":
+        return f"The user wants to {latest[0].lower() + latest[1:] if latest else 'run a protocol'}"
+    if stage == "detect":
+        return platform
+    if stage == "platform_name":
+        return platform.replace("_", " ").title()
+    if stage == "doc_discovery":
+        return "[]"
+    if stage == "review":
+        return "PASS"
+    if stage == "reverse_check":
+        return "Yes, the script performs the requested transfer."
+    if stage in ("generate", "fix"):
+        return CANNED_PROTOCOL
+    return CANNED_CHAT
+
+
+def _usage_tokens(text):
+    # Close enough to BPE counts for throughput numbers
+    return max(1, len(text) // 4)
+
+
+class FakeOpenAI:
+    """Canned responses, latency model and per-stage counters shared by all request threads."""
+
+    def __init__(self, latency=0.5, jitter=0.2, stage_latency=None, embedding_latency=0.05,
+                 token_delay=0.01, platform="opentrons", embedding_dim=DEFAULT_EMBEDDING_DIM, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.stage_latency = stage_latency or {}
+        self.embedding_latency = embedding_latency
+        self.token_delay = token_delay
+        self.platform = platform
+        self.embedding_dim = embedding_dim
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._in_flight = 0
+        self.max_in_flight = 0
+
+    def delay(self, stage):
+        base = self.embedding_latency if stage == "embeddings" else self.stage_latency.get(stage, self.latency)
+        with self._lock:
+            spread = self._random.uniform(-self.jitter, self.jitter)
+        return max(0.0, base * (1 + spread))
+
+    def begin(self):
+        with self._lock:
+            self._in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self._in_flight)
+
+    def record(self, stage, seconds, input_tokens, output_tokens):
+        with self._lock:
+            self._in_flight -= 1
+            stats = self._stats.setdefault(stage, {"calls": 0, "seconds": 0.0,
+                                                   "input_tokens": 0, "output_tokens": 0})
+            stats["calls"] += 1
+            stats["seconds"] += seconds
+            stats["input_tokens"] += input_tokens
+            stats["output_tokens"] += output_tokens
+
+    def stats(self):
+        with self._lock:
+            stages = {stage: dict(s, seconds=round(s["seconds"], 3)) for stage, s in self._stats.items()}
+            return {"max_in_flight": self.max_in_flight, "stages": stages}
+
+
+def response_object(model, text, input_tokens, status="completed"):
+    """A Responses API object with a single output_text message."""
+    output_tokens = _usage_tokens(text)
+    return {
+        "id": f"resp_{uuid.uuid4().hex}",
+        "object": "response",
+        "created_at": int(time.time()),
+        "status": status,
+        "model": model,
+        "output": [{
+            "type": "message",
+            "id": f"msg_{uuid.uuid4().hex}",
+            "status": "completed",
+            "role": "assistant",
+            "content": [{"type": "output_text", "text": text, "annotations": []}],
+        }],
+        "parallel_tool_calls": True,
+        "tool_choice": "auto",
+        "tools": [],
+        "usage": {
+            "input_tokens": input_tokens,
+            "input_tokens_details": {"cached_tokens": 0},
+            "output_tokens": output_tokens,
+            "output_tokens_details": {"reasoning_tokens": 0},
+            "total_tokens": input_tokens + output_tokens,
+        },
+    }
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    fake = None  # FakeOpenAI, set by serve()
+
+    def log_message(self, format, *args):
+        pass  # One line per call would drown the benchmark output
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/stats":
+            self._send_json(self.fake.stats())
+        else:
+            self._send_json({"error": {"message": f"Unknown path {self.path}"}}, 404)
+
+    def do_POST(self):
+        path = self.path.split("?")[0].rstrip("/")
+        if path.endswith("/responses"):
+            self._responses(self._read_json())
+        elif path.endswith("/embeddings"):
+            self._embeddings(self._read_json())
+        else:
+            self._send_json({"error": {"message": f"Unknown path {self.path}"}}, 404)
+
+    def _responses(self, body):
+        fake = self.fake
+        messages = _messages(body)
+        stage = match_stage(messages)
+        text = canned_output(stage, messages, fake.platform)
+        model = body.get("model", "gpt-5.4")
+        input_tokens = sum(_usage_tokens(m["content"]) for m in messages)
+
+        fake.begin()
+        start = time.perf_counter()
+        try:
+            time.sleep(fake.delay(stage))
+            if body.get("stream"):
+                self._stream_response(model, text, input_tokens)
+            else:
+                self._send_json(response_object(model, text, input_tokens))
+        finally:
+            fake.record(stage, time.perf_counter() - start, input_tokens, _usage_tokens(text))
+
+    def _stream_response(self, model, text, input_tokens):
+        """Server-sent events in the order the SDK expects: created, deltas, completed."""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        sequence = 0
+
+        def send(event):
+            nonlocal sequence
+            event["sequence_number"] = sequence
+            sequence += 1
+            self.wfile.write(f"event: {event['type']}\ndata: {json.dumps(event)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        final = response_object(model, text, input_tokens)
+        item_id = final["output"][0]["id"]
+        send({"type": "response.created", "response": dict(final, status="in_progress", output=[])})
+        for delta in re.findall(r"\S+\s*|\s+", text):
+            send({"type": "response.output_text.delta", "item_id": item_id,
+                  "output_index": 0, "content_index": 0, "delta": delta, "logprobs": []})
+            if self.fake.token_delay:
+                time.sleep(self.fake.token_delay)
+        send({"type": "response.output_text.done", "item_id": item_id,
+              "output_index": 0, "content_index": 0, "text": text, "logprobs": []})
+        send({"type": "response.completed", "response": final})
+
+    def _embeddings(self, body):
+        fake = self.fake
+        inputs = body.get("input", [])
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        dim = body.get("dimensions") or fake.embedding_dim
+        input_tokens = sum(_usage_tokens(t) for t in inputs)
+
+        fake.begin()
+        start = time.perf_counter()
+        try:
+            time.sleep(fake.delay("embeddings"))
+            vectors = hash_embeddings(inputs, dim)
+            as_base64 = body.get("encoding_format") == "base64"
+            data = [{
+                "object": "embedding",
+                "index": i,
+                "embedding": base64.b64encode(v.tobytes()).decode("ascii") if as_base64 else v.tolist(),
+            } for i, v in enumerate(vectors)]
+            self._send_json({
+                "object": "list",
+                "data": data,
+                "model": body.get("model", "text-embedding-3-small"),
+                "usage": {"prompt_tokens": input_tokens, "total_tokens": input_tokens},
+            })
+        finally:
+            fake.record("embeddings", time.perf_counter() - start, input_tokens, 0)
+
+
+def serve(fake, host="127.0.0.1", port=8900):
+    """Start the server on a background thread and return it (call .shutdown() to stop)."""
+    handler = type("FakeOpenAIHandler", (Handler,), {"fake": fake})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="fake-openai", daemon=True).start()
+    return server
+
+
+def build_stores(app_dir, dim):
+    """
+    Rebuild every handler store of app_dir (a copy of biobot/) from its docs
+    with hash_embeddings, the vectors this server returns for questions.
+    """
+    from indexer import refresh_store
+    from index_store import store_dir_for
+    from rag_events import event_sink
+
+    if os.path.realpath(app_dir) == os.path.realpath(BIOBOT_DIR):
+        raise SystemExit("--build-stores would overwrite the real stores: point it at a copy of biobot/")
+    with open(os.path.join(app_dir, "handlers.json"), "r") as f:
+        handlers = json.load(f)
+
+    def stub_embed(texts, api_key=None):
+        return hash_embeddings(texts, dim)
+
+    for handler_id, config in handlers.items():
+        docs_path = os.path.join(app_dir, config["docs_path"])
+        if not os.path.isdir(docs_path):
+            continue
+        start = time.perf_counter()
+        with event_sink(lambda event: None):
+            store, _ = refresh_store(store_dir_for(docs_path, config["store_path"]), docs_path, None,
+                                     rebuild=True, embed_fn=stub_embed, index_spec=config.get("index"))
+        print(f"Built {handler_id} store with stub embeddings: {len(store) if store else 0} chunks "
+              f"in {time.perf_counter() - start:.1f}s", flush=True)
+
+
+def parse_stage_latency(value):
+    """'generate=6,review=3' -> {"generate": 6.0, "review": 3.0}"""
+    result = {}
+    for item in filter(None, (v.strip() for v in (value or "").split(","))):
+        stage, _, seconds = item.partition("=")
+        result[stage.strip()] = float(seconds)
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fake OpenAI responses/embeddings server for benchmarks.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency", type=float, default=0.5, help="Seconds per responses call")
+    parser.add_argument("--jitter", type=float, default=0.2, help="Relative latency spread (0.2 = ±20%%)")
+    parser.add_argument("--stage-latency", default="",
+                        help="Per-stage overrides, e.g. generate=6,review=3 "
+                             f"(stages: {', '.join(s for s, _ in STAGES)}, chat)")
+    parser.add_argument("--embedding-latency", type=float, default=0.05, help="Seconds per embeddings call")
+    parser.add_argument("--token-delay", type=float, default=0.01, help="Seconds between streamed deltas")
+    parser.add_argument("--platform", default="opentrons", help="Handler id returned by platform detection")
+    parser.add_argument("--embedding-dim", type=int, default=DEFAULT_EMBEDDING_DIM)
+    parser.add_argument("--build-stores", metavar="APP_DIR",
+                        help="First rebuild the handler stores of this copy of biobot/ with stub embeddings")
+    args = parser.parse_args(argv)
+
+    if args.build_stores:
+        build_stores(args.build_stores, args.embedding_dim)
+
+    fake = FakeOpenAI(
+        latency=args.latency, jitter=args.jitter, stage_latency=parse_stage_latency(args.stage_latency),
+        embedding_latency=args.embedding_latency, token_delay=args.token_delay,
+        platform=args.platform, embedding_dim=args.embedding_dim,
+    )
+    server = serve(fake, args.host, args.port)
+    print(f"Fake OpenAI API on http://{args.host}:{args.port}/v1 "
+          f"(set OPENAI_BASE_URL to this); stats at /stats", flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        print(json.dumps(fake.stats(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
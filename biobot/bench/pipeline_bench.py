@@ -0,0 +1,235 @@
+"""
+End-to-end latency benchmark: pushes concurrent chats through a running
+BioBot app and reports per-stage time and throughput.
+
+Every simulated user registers (once) with a fake API key, logs in, creates
+a chat and posts its message to /chat/<id>/stream, timestamping each
+"__STATUS__:" line of the stream. A stage lasts from its status line to the
+next one, so the report shows where a request spends its time as the user
+sees it; "(before first status)" covers everything up to the first status
+line (classification, sufficiency, consolidation, platform detection) and
+"(result)" the final answer.
+
+Run it against an app whose OpenAI traffic goes to fake_openai.py, so no
+real tokens are spent and model latency is under control. The app runs from
+a copy of biobot/ whose stores fake_openai.py rebuilt with its stub
+embeddings, so questions and chunks are embedded alike:
+
+    cp -r biobot /tmp/biobot-bench
+    python biobot/bench/fake_openai.py --latency 0.5 --stage-latency generate=6 --build-stores /tmp/biobot-bench &
+    cd /tmp/biobot-bench && OPENAI_BASE_URL=http://127.0.0.1:8900/v1 BIOBOT_CACHE_DIR=/tmp/biobot-bench/cache \
+        python app.py
+    python biobot/bench/pipeline_bench.py --url http://127.0.0.1:5000 --chats 8 --rounds 2 \\
+        --fake-openai http://127.0.0.1:8900
+
+With --fake-openai, the number of model calls and their server-side time per
+pipeline stage are reported as well.
+"""
+
+import re
+import sys
+import json
+import time
+import argparse
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+
+
+STATUS_PREFIX = "__STATUS__:"
+DEFAULT_MESSAGE = ("Write an Opentrons protocol that transfers 50 uL from well A1 of a 96-well plate "
+                   "to every well of column 2, using a P300 single-channel pipette and mixing after.")
+DEFAULT_EMAIL = "bench@biobot.local"
+DEFAULT_PASSWORD = "bench-password"
+DEFAULT_API_KEY = "sk-bench"  # The app only checks the "sk-" prefix
+
+
+def stage_name(status):
+    """Collapse numbers so 'Attempt 2 — validating...' and 'Attempt 1 — ...' are one stage."""
+    return re.sub(r"\d+(\.\d+)?", "N", status.strip())
+
+
+def login(url, email, password, api_key):
+    """Return a logged-in requests.Session, registering the account on first use."""
+    session = requests.Session()
+    form = {"email": email, "password": password}
+    resp = session.post(f"{url}/login", data=form, allow_redirects=False)
+    if resp.status_code == 302 and not resp.headers.get("Location", "").endswith("/login"):
+        return session
+    session.post(f"{url}/register", data=dict(form, first_name="Bench", last_name="User", api_key=api_key),
+                 allow_redirects=False)
+    resp = session.post(f"{url}/login", data=form, allow_redirects=False)
+    if resp.status_code != 302 or resp.headers.get("Location", "").endswith("/login"):
+        raise RuntimeError(f"Could not log in as {email} (HTTP {resp.status_code})")
+    return session
+
+
+def run_chat(session, url, message):
+    """
+    Create a chat, stream one message through it and return its timeline:
+    {"total": s, "first_byte": s, "stages": [(stage, seconds), ...], "reply_chars": n}
+    """
+    resp = session.post(f"{url}/chat")
+    resp.raise_for_status()
+    chat_id = resp.json()["chat_id"]
+
+    start = time.perf_counter()
+    first_byte = None
+    marks = [("(before first status)", start)]
+    reply_chars = 0
+    buffer = ""
+    with session.post(f"{url}/chat/{chat_id}/stream", json={"message": message}, stream=True) as resp:
+        resp.raise_for_status()
+        for piece in resp.iter_content(chunk_size=None, decode_unicode=True):
+            now = time.perf_counter()
+            if first_byte is None:
+                first_byte = now - start
+            buffer += piece
+            # Status lines are newline-terminated; anything else is reply text
+            while buffer:
+                if buffer.startswith(STATUS_PREFIX):
+                    end = buffer.find("\n")
+                    if end < 0:
+                        break
+                    marks.append((stage_name(buffer[len(STATUS_PREFIX):end]), now))
+                    buffer = buffer[end + 1:]
+                elif STATUS_PREFIX.startswith(buffer):
+                    break  # Could be the start of a status line
+                else:
+                    if marks[-1][0] != "(result)":
+                        marks.append(("(result)", now))
+                    cut = buffer.find(STATUS_PREFIX)
+                    text, buffer = (buffer, "") if cut < 0 else (buffer[:cut], buffer[cut:])
+                    reply_chars += len(text)
+    end = time.perf_counter()
+
+    stages = [(name, (marks[i + 1][1] if i + 1 < len(marks) else end) - at)
+              for i, (name, at) in enumerate(marks)]
+    return {"total": end - start, "first_byte": first_byte or 0.0, "stages": stages, "reply_chars": reply_chars}
+
+
+def fetch_fake_stats(fake_url):
+    try:
+        return requests.get(f"{fake_url}/stats", timeout=5).json()
+    except (requests.RequestException, ValueError) as e:
+        print(f"WARNING: Could not read fake OpenAI stats: {e}", file=sys.stderr)
+        return None
+
+
+def diff_fake_stats(before, after):
+    """Per-stage calls/seconds/tokens made during the run."""
+    stages = {}
+    for stage, stats in after["stages"].items():
+        prev = before["stages"].get(stage, {}) if before else {}
+        delta = {key: value - prev.get(key, 0) for key, value in stats.items()}
+        if delta["calls"]:
+            stages[stage] = delta
+    return stages
+
+
+def _ms(seconds):
+    return f"{seconds * 1000:8.0f}ms"
+
+
+def summarize(results, wall_seconds, chats):
+    totals = [r["total"] for r in results]
+    per_stage = defaultdict(list)
+    for r in results:
+        for name, seconds in r["stages"]:
+            per_stage[name].append(seconds)
+
+    summary = {
+        "chats": chats,
+        "completed": len(results),
+        "wall_seconds": round(wall_seconds, 3),
+        "throughput_per_min": round(len(results) / wall_seconds * 60, 2) if wall_seconds else 0.0,
+        "total_p50": float(np.percentile(totals, 50)) if totals else 0.0,
+        "total_p99": float(np.percentile(totals, 99)) if totals else 0.0,
+        "first_byte_p50": float(np.percentile([r["first_byte"] for r in results], 50)) if results else 0.0,
+        "stages": {
+            name: {"count": len(s), "mean": float(np.mean(s)), "p50": float(np.percentile(s, 50)),
+                   "max": float(np.max(s))}
+            for name, s in per_stage.items()
+        },
+    }
+    return summary
+
+
+def print_summary(summary, fake_stages=None):
+    print(f"\n{summary['completed']}/{summary['chats']} chats in {summary['wall_seconds']:.1f}s "
+          f"— {summary['throughput_per_min']:.1f} requests/min")
+    print(f"total p50 {_ms(summary['total_p50']).strip()}  p99 {_ms(summary['total_p99']).strip()}  "
+          f"first byte p50 {_ms(summary['first_byte_p50']).strip()}\n")
+    print(f"{'stage (as streamed)':<60} {'n':>4} {'mean':>10} {'p50':>10} {'max':>10}")
+    for name, s in sorted(summary["stages"].items(), key=lambda item: -item[1]["mean"]):
+        print(f"{name[:60]:<60} {s['count']:>4} {_ms(s['mean'])} {_ms(s['p50'])} {_ms(s['max'])}")
+
+    if fake_stages:
+        print(f"\n{'model calls (fake OpenAI)':<30} {'calls':>6} {'seconds':>9} {'in tok':>8} {'out tok':>8}")
+        for stage, s in sorted(fake_stages.items(), key=lambda item: -item[1]["seconds"]):
+            print(f"{stage:<30} {s['calls']:>6} {s['seconds']:>9.2f} {s['input_tokens']:>8} {s['output_tokens']:>8}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Push concurrent chats through /chat/<id>/stream.")
+    parser.add_argument("--url", default="http://127.0.0.1:5000", help="Base URL of the BioBot app")
+    parser.add_argument("--chats", type=int, default=4, help="Concurrent chats")
+    parser.add_argument("--rounds", type=int, default=1, help="Requests sent by each concurrent chat")
+    parser.add_argument("--message", default=DEFAULT_MESSAGE)
+    parser.add_argument("--email", default=DEFAULT_EMAIL)
+    parser.add_argument("--password", default=DEFAULT_PASSWORD)
+    parser.add_argument("--api-key", default=DEFAULT_API_KEY, help="Stored on the bench account at registration")
+    parser.add_argument("--fake-openai", metavar="URL", help="fake_openai.py base URL, for per-call stats")
+    parser.add_argument("--json", metavar="PATH", help="Also write the summary and raw timelines as JSON")
+    args = parser.parse_args(argv)
+    url = args.url.rstrip("/")
+
+    # Register once up front so concurrent logins don't race to create the account
+    login(url, args.email, args.password, args.api_key)
+    fake_before = fetch_fake_stats(args.fake_openai) if args.fake_openai else None
+
+    results, errors = [], []
+    lock = threading.Lock()
+
+    def user(n):
+        session = login(url, args.email, args.password, args.api_key)
+        for _ in range(args.rounds):
+            try:
+                result = run_chat(session, url, args.message)
+            except (requests.RequestException, KeyError, ValueError) as e:
+                with lock:
+                    errors.append(f"chat {n}: {e}")
+                continue
+            with lock:
+                results.append(result)
+                print(f"chat {n}: {result['total']:.2f}s, {len(result['stages'])} stages, "
+                      f"{result['reply_chars']} chars", flush=True)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.chats) as pool:
+        list(pool.map(user, range(args.chats)))
+    wall = time.perf_counter() - start
+
+    for error in errors:
+        print(f"ERROR: {error}", file=sys.stderr)
+    summary = summarize(results, wall, args.chats * args.rounds)
+    fake_stages = None
+    if args.fake_openai:
+        fake_after = fetch_fake_stats(args.fake_openai)
+        if fake_after is not None:
+            fake_stages = diff_fake_stats(fake_before, fake_after)
+            summary["model_calls"] = fake_stages
+            summary["max_model_calls_in_flight"] = fake_after["max_in_flight"]
+    print_summary(summary, fake_stages)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"summary": summary, "chats": results}, f, indent=4)
+    return summary
+
+
+if __name__ == "__main__":
+    main()
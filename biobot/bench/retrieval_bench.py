@@ -0,0 +1,193 @@
+"""
+Offline retrieval benchmark over the real documentation folders.
+
+For every (handler, chunk size, index type) combination this builds a store
+from biobot/docs/<handler> with indexer.refresh_store, then runs the
+checked-in questions of bench/queries.json through the pipeline's retrieval
+(retrieval.py) and reports:
+    build time     parse + embed + index + write (index-only rebuild for the
+                   second and later index types of a chunk size)
+    index size     index.faiss on disk
+    p50/p99        search latency over all queries, repeated --repeat times
+    recall@k       share of queries with an expected source file in the top k
+
+Both retrieval paths are measured: "vector" (FAISS only) and "hybrid"
+(FAISS + BM25 fusion + diversification, as served).
+
+Embeddings come from a deterministic feature-hashing stub (no API key or
+network needed), so the vector numbers compare index types and chunk sizes
+with each other; they say nothing about text-embedding-3-small itself.
+
+Usage:
+    python biobot/bench/retrieval_bench.py
+    python biobot/bench/retrieval_bench.py --handlers opentrons --index-types flat,hnsw --chunk-sizes 1500,3000
+    python biobot/bench/retrieval_bench.py --vectors float32,sq8 -k 5 --json results.json
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import tempfile
+from contextlib import nullcontext
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BIOBOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BIOBOT_DIR)
+
+from fake_openai import hash_embeddings
+from index_store import INDEX_FILE, INDEX_TYPES
+from indexer import refresh_store
+from rag_events import event_sink
+from retrieval import RETRIEVAL_K, retrieve, retrieve_chunk_ids
+
+
+QUERIES_FILE = os.path.join(BENCH_DIR, "queries.json")
+STUB_DIM = 256
+
+
+def stub_embed(texts, api_key=None):
+    """Deterministic stand-in for the embeddings API (same vectors as fake_openai.py)."""
+    return hash_embeddings(texts, STUB_DIM)
+
+
+def source_file(source):
+    """'liquids.rst (section 3), chunk 1' -> 'liquids.rst'"""
+    return re.split(r" \(|, chunk ", source)[0]
+
+
+def percentile_ms(samples, q):
+    return float(np.percentile(samples, q) * 1000) if samples else 0.0
+
+
+def dir_size(path):
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+
+def run_queries(store, queries, k, repeat, hybrid):
+    """Return (latencies in seconds, recall@k) for one retrieval path."""
+    lexical = store.lexical if hybrid else None
+    embedded = [stub_embed([q["query"]]) for q in queries]
+    latencies, recalled = [], 0
+    for _ in range(repeat):
+        recalled = 0
+        for q, embedding in zip(queries, embedded):
+            embedding = embedding.copy()  # retrieve() normalizes in place
+            start = time.perf_counter()
+            if hybrid:
+                hits = retrieve(q["query"], embedding, store.index, lexical, store.chunks, store.vectors, k=k)
+            else:
+                hits = retrieve_chunk_ids(q["query"], embedding, store.index, k=k)
+            latencies.append(time.perf_counter() - start)
+            found = {source_file(store.chunk_sources[chunk_id]) for chunk_id, _ in hits}
+            recalled += bool(found & set(q["expected"]))
+    return latencies, recalled / len(queries) if queries else 0.0
+
+
+def bench_handler(handler, queries, chunk_sizes, index_types, vectors, k, repeat, parse_workers):
+    docs_path = os.path.join(BIOBOT_DIR, "docs", handler)
+    results = []
+    for chunk_size in chunk_sizes:
+        with tempfile.TemporaryDirectory(prefix=f"bench_{handler}_") as tmp:
+            store_dir = os.path.join(tmp, "store")
+            for index_type in index_types:
+                for codec in vectors:
+                    spec = {"type": index_type, "vectors": codec}
+                    start = time.perf_counter()
+                    store, stats = refresh_store(store_dir, docs_path, None, chunk_size, embed_fn=stub_embed,
+                                                 index_spec=spec, parse_workers=parse_workers)
+                    build_seconds = time.perf_counter() - start
+                    if store is None:
+                        print(f"{handler}: no documents in {docs_path}", file=sys.stderr)
+                        return results
+
+                    row = {
+                        "handler": handler,
+                        "chunk_size": chunk_size,
+                        "index_type": index_type,
+                        "resolved_type": store.index_spec["type"],
+                        "vectors": codec,
+                        "chunks": len(store.ids),
+                        "build_seconds": round(build_seconds, 3),
+                        "timings": {name: round(s, 3) for name, s in stats["timings"].items()},
+                        "index_bytes": os.path.getsize(os.path.join(store_dir, INDEX_FILE)),
+                        "store_bytes": dir_size(store_dir),
+                        "index_recall_at_5": store.meta.get("recall_at_5"),
+                    }
+                    for mode, hybrid in (("vector", False), ("hybrid", True)):
+                        latencies, recall = run_queries(store, queries, k, repeat, hybrid)
+                        row[mode] = {
+                            "p50_ms": round(percentile_ms(latencies, 50), 3),
+                            "p99_ms": round(percentile_ms(latencies, 99), 3),
+                            f"recall_at_{k}": round(recall, 3),
+                        }
+                    results.append(row)
+                    print_row(row, k)
+    return results
+
+
+def print_header(k):
+    print(f"{'handler':<10} {'chunk':>5} {'index':<18} {'chunks':>6} {'build s':>8} {'index MB':>8} "
+          f"{'vec p50':>8} {'vec p99':>8} {'vec R@' + str(k):>8} "
+          f"{'hyb p50':>8} {'hyb p99':>8} {'hyb R@' + str(k):>8}")
+
+
+def print_row(row, k):
+    index = row["resolved_type"] + ("" if row["vectors"] == "float32" else f"/{row['vectors']}")
+    if row["resolved_type"] != row["index_type"]:
+        index += "*"
+    vec, hyb = row["vector"], row["hybrid"]
+    print(f"{row['handler']:<10} {row['chunk_size']:>5} {index:<18} {row['chunks']:>6} "
+          f"{row['build_seconds']:>8.2f} {row['index_bytes'] / 2**20:>8.2f} "
+          f"{vec['p50_ms']:>6.2f}ms {vec['p99_ms']:>6.2f}ms {vec[f'recall_at_{k}']:>8.2f} "
+          f"{hyb['p50_ms']:>6.2f}ms {hyb['p99_ms']:>6.2f}ms {hyb[f'recall_at_{k}']:>8.2f}", flush=True)
+
+
+def _csv(value):
+    return [v.strip() for v in value.split(",") if v.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark retrieval across index types and chunk sizes.")
+    parser.add_argument("--handlers", default="opentrons,echo", help="Comma-separated handlers (docs/<name>)")
+    parser.add_argument("--index-types", default="flat,hnsw,ivf_flat,ivf_pq",
+                        help=f"Comma-separated, from {', '.join(INDEX_TYPES)}")
+    parser.add_argument("--vectors", default="float32", help="Comma-separated: float32, float16, sq8")
+    parser.add_argument("--chunk-sizes", default="1500,3000", help="Comma-separated chunk sizes (characters)")
+    parser.add_argument("-k", type=int, default=RETRIEVAL_K, help="Chunks retrieved per query")
+    parser.add_argument("--repeat", type=int, default=5, help="Times each query is run for latency")
+    parser.add_argument("--workers", type=int, default=1, help="Parse processes")
+    parser.add_argument("--queries", default=QUERIES_FILE, help="Queries file")
+    parser.add_argument("--json", metavar="PATH", help="Also write the results as JSON")
+    parser.add_argument("--verbose", action="store_true", help="Show indexing steps")
+    args = parser.parse_args(argv)
+
+    with open(args.queries, "r") as f:
+        all_queries = json.load(f)
+
+    results = []
+    print("* = too few chunks for the requested type, built as the resolved one", file=sys.stderr)
+    print_header(args.k)
+    with nullcontext() if args.verbose else event_sink(lambda event: None):
+        for handler in _csv(args.handlers):
+            queries = all_queries.get(handler)
+            if not queries:
+                print(f"{handler}: no queries in {args.queries}, skipping", file=sys.stderr)
+                continue
+            results += bench_handler(
+                handler, queries, [int(c) for c in _csv(args.chunk_sizes)], _csv(args.index_types),
+                _csv(args.vectors), args.k, args.repeat, args.workers,
+            )
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"k": args.k, "repeat": args.repeat, "results": results}, f, indent=4)
+    return results
+
+
+if __name__ == "__main__":
+    main()
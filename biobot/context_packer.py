@@ -0,0 +1,91 @@
+"""
+Token-budgeted context assembly for generation and fix prompts.
+
+Instead of pasting the top-k chunks whole, whatever their size or relevance,
+the packer walks the ranked chunks best-first and:
+1. Skips exact duplicates (same text after whitespace normalization)
+2. Skips chunks scoring below `min_score_ratio` of the best chunk
+3. Adds chunks while they fit the handler's token budget
+4. Trims the first chunk that doesn't fit to the remaining budget, then stops
+
+The budget comes from "context_token_budget" in handlers.json. Tokens are
+counted with tiktoken.
+
+Usage:
+    packed = pack_context(chunks, sources, scores, budget=2500)
+    packed.text, packed.tokens, packed.chunks, packed.dropped
+"""
+
+import re
+from dataclasses import dataclass, field
+from functools import lru_cache
+
+import tiktoken
+
+
+DEFAULT_CONTEXT_TOKEN_BUDGET = 2500
+MIN_TRIMMED_TOKENS = 100    # Don't bother adding a trimmed tail shorter than this
+CHUNK_SEPARATOR = "\n\n"
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    # Tokenizer of the gpt-4o / gpt-5 family used for generation
+    return tiktoken.get_encoding("o200k_base")
+
+
+def count_tokens(text):
+    return len(_encoding().encode(text, disallowed_special=()))
+
+
+@dataclass
+class PackedContext:
+    """Chunks kept for the prompt (possibly with the last one trimmed) and their token count."""
+    text: str = ""
+    tokens: int = 0
+    chunks: list = field(default_factory=list)
+    sources: list = field(default_factory=list)
+    dropped: int = 0
+    trimmed: bool = False
+
+
+def pack_context(chunks, sources, scores, budget=DEFAULT_CONTEXT_TOKEN_BUDGET, min_score_ratio=0.0):
+    """
+    Fit ranked chunks (best first, with their retrieval scores) into `budget`
+    tokens. Returns a PackedContext.
+    """
+    enc = _encoding()
+    packed = PackedContext()
+    seen = set()
+    separator_tokens = len(enc.encode(CHUNK_SEPARATOR))
+    best = max(scores) if scores else 0.0
+
+    for i, (chunk, source, score) in enumerate(zip(chunks, sources, scores)):
+        key = re.sub(r"\s+", " ", chunk).strip()
+        if key in seen or (best > 0 and score < best * min_score_ratio):
+            packed.dropped += 1
+            continue
+        seen.add(key)
+
+        remaining = budget - packed.tokens - (separator_tokens if packed.chunks else 0)
+        tokens = enc.encode(chunk, disallowed_special=())
+        if len(tokens) > remaining:
+            if remaining >= MIN_TRIMMED_TOKENS:
+                chunk = enc.decode(tokens[:remaining])
+                tokens = tokens[:remaining]
+                packed.trimmed = True
+            else:
+                packed.dropped += len(chunks) - i
+                break
+
+        if packed.chunks:
+            packed.tokens += separator_tokens
+        packed.chunks.append(chunk)
+        packed.sources.append(source)
+        packed.tokens += len(tokens)
+        if packed.trimmed:
+            packed.dropped += len(chunks) - i - 1
+            break
+
+    packed.text = CHUNK_SEPARATOR.join(packed.chunks)
+    return packed
@@ -0,0 +1,80 @@
+"""
+Diversification of retrieved chunks before they are packed into a prompt.
+
+Many documentation sets hold several versions of the same page (Opentrons
+ot1 `_sources` txt, v1 rst, v2 rst), so the top hits are often one passage
+repeated. Given an over-fetched, ranked candidate list, this stage:
+1. Drops near-duplicates: chunks whose word 5-gram shingle sets overlap a
+   better-ranked chunk by more than DUPLICATE_JACCARD
+2. Picks k of the rest by maximal marginal relevance (MMR), trading
+   retrieval score against cosine similarity to the passages already picked
+
+Usage:
+    hits = diversify(candidates, chunks, vectors, k=5)   # [(chunk_id, score), ...]
+"""
+
+import re
+import zlib
+
+import numpy as np
+
+
+SHINGLE_SIZE = 5
+DUPLICATE_JACCARD = 0.8
+MMR_LAMBDA = 0.7  # 1.0 = pure relevance, 0.0 = pure diversity
+
+
+def shingles(text, size=SHINGLE_SIZE):
+    """Set of hashed word n-grams of the text (whitespace and case insensitive)."""
+    words = re.findall(r"\w+", text.lower())
+    if len(words) <= size:
+        return {zlib.crc32(" ".join(words).encode("utf-8"))}
+    return {zlib.crc32(" ".join(words[i:i + size]).encode("utf-8")) for i in range(len(words) - size + 1)}
+
+
+def drop_near_duplicates(candidates, chunks, threshold=DUPLICATE_JACCARD):
+    """Keep the best-ranked chunk of each group of near-identical chunks."""
+    kept, kept_shingles = [], []
+    for chunk_id, score in candidates:
+        sh = shingles(chunks[chunk_id])
+        if any(len(sh & other) / len(sh | other) > threshold for other in kept_shingles):
+            continue
+        kept.append((chunk_id, score))
+        kept_shingles.append(sh)
+    return kept
+
+
+def mmr(candidates, vectors, k, lambda_=MMR_LAMBDA):
+    """
+    Select k candidates by maximal marginal relevance.
+    Relevance is the retrieval score scaled to [0, 1]; similarity is cosine.
+    """
+    if len(candidates) <= k:
+        return list(candidates)
+    scores = np.array([score for _, score in candidates], dtype=np.float32)
+    relevance = scores / scores.max() if scores.max() > 0 else scores
+    matrix = np.array([np.asarray(vectors[chunk_id], dtype=np.float32) for chunk_id, _ in candidates])
+    matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+    similarity = matrix @ matrix.T
+
+    selected = [0]  # The best-scored candidate always goes first
+    max_sim = similarity[0].copy()
+    while len(selected) < k:
+        gain = lambda_ * relevance - (1 - lambda_) * max_sim
+        gain[selected] = -np.inf
+        best = int(np.argmax(gain))
+        selected.append(best)
+        max_sim = np.maximum(max_sim, similarity[best])
+    return [candidates[i] for i in selected]
+
+
+def diversify(candidates, chunks, vectors, k):
+    """
+    Reduce ranked (chunk_id, score) candidates to k distinct passages.
+    `chunks` and `vectors` are addressed by chunk id; without vectors only
+    near-duplicate removal is applied.
+    """
+    distinct = drop_near_duplicates(candidates, chunks)
+    if vectors is None:
+        return distinct[:k]
+    return mmr(distinct, vectors, k)
@@ -16,8 +16,9 @@ import time
 import json
 import requests
 from urllib.parse import urlparse, urljoin
-from openai import OpenAI
 from bs4 import BeautifulSoup
+from openai_clients import get_openai_client
+from rag_events import step, timed_call
 
 
 # Max pages to crawl per source to avoid runaway fetching
@@ -27,9 +28,6 @@ REQUEST_TIMEOUT = 15
 CRAWL_DELAY = 0.5  # seconds between requests
 
 
-def get_openai_client(api_key):
-    return OpenAI(api_key=api_key)
-
 def _log(msg):
     """Log to stderr so it doesn't pollute stdout (which engine.py reads as code output)."""
     print(msg, file=sys.stderr, flush=True)
@@ -43,7 +41,7 @@ def discover_doc_urls(handler_name, handler_keywords, api_key):
     """
     client = get_openai_client(api_key)
 
-    response = client.responses.create(
+    response = timed_call("doc_discovery", client.responses.create,
         model="gpt-5.4",
         tools=[{"type": "web_search"}],
         input=[
@@ -84,7 +82,7 @@ Return 3-10 sources."""
     try:
         sources = json.loads(raw)
         if isinstance(sources, list):
-            print(f"STEP:DISCOVERED DOCUMENTATION SOURCES FOR: {handler_name}", flush=True)
+            step(f"DISCOVERED DOCUMENTATION SOURCES FOR: {handler_name}")
             for i, src in enumerate(sources, 1):
                 _log(f"  [{i}] {src.get('type', '?').upper()}: {src.get('url', 'N/A')}")
                 _log(f"      {src.get('description', 'No description')}")
@@ -380,18 +378,17 @@ def fetch_documentation(handler_name, handler_keywords, docs_path, api_key):
     3. If still nothing, report what was attempted
     Returns True if docs were successfully fetched and saved.
     """
-    print(f"STEP:No local docs found — searching for {handler_name} official documentation...", flush=True)
-    time.sleep(2)
+    step(f"No local docs found — searching for {handler_name} official documentation...")
 
     all_fetched = []
     failed_urls = []
 
     # --- Strategy 1: LLM-suggested URLs ---
-    print(f"STEP:Searching official documentation sources in the web...", flush=True)
+    step("Searching official documentation sources in the web...")
     sources = discover_doc_urls(handler_name, handler_keywords, api_key)
 
     if sources:
-        print(f"STEP:Found {len(sources)} sources — verifying accessibility...", flush=True)
+        step(f"Found {len(sources)} sources — verifying accessibility...")
 
         # Filter to only accessible URLs
         verified_sources = []
@@ -407,15 +404,13 @@ def fetch_documentation(handler_name, handler_keywords, docs_path, api_key):
                 _log(f"  ✗ Not accessible: {url}")
 
         if verified_sources:
-            print(f"STEP:Fetching from {len(verified_sources)} accessible sources...", flush=True)
-            time.sleep(2)
+            step(f"Fetching from {len(verified_sources)} accessible sources...")
             for source in verified_sources:
                 url = source.get("url", "")
                 source_type = source.get("type", "page")
                 desc = source.get("description", "")
 
-                print(f"STEP:Fetching from {urlparse(url).netloc}: {desc}...", flush=True)
-                time.sleep(2)
+                step(f"Fetching from {urlparse(url).netloc}: {desc}...")
 
                 if source_type in ("docs_site", "repo"):
                     pages = crawl_docs_site(url, max_pages=MAX_PAGES_PER_SOURCE)
@@ -434,8 +429,7 @@ def fetch_documentation(handler_name, handler_keywords, docs_path, api_key):
 
     # --- Strategy 2: GitHub search fallback ---
     if not all_fetched:
-        print(f"STEP:LLM sources unavailable — searching GitHub...", flush=True)
-        time.sleep(2)
+        step("LLM sources unavailable — searching GitHub...")
         github_sources = search_github_repos(handler_name, handler_keywords)
 
         for source in github_sources:
@@ -457,21 +451,21 @@ def fetch_documentation(handler_name, handler_keywords, docs_path, api_key):
 
     # --- No docs found at all ---
     if not all_fetched:
-        print(f"STEP:Could not fetch documentation for {handler_name}", flush=True)
+        step(f"Could not fetch documentation for {handler_name}")
         if failed_urls:
             _log(f"  Attempted URLs that were not accessible:")
             for url in failed_urls:
                 _log(f"    - {url}")
-        print(f"STEP:You can manually add documentation files to {docs_path}/", flush=True)
+        step(f"You can manually add documentation files to {docs_path}/")
         return False
 
     # --- Save fetched docs ---
-    print(f"STEP:Saving {len(all_fetched)} documents to {docs_path}...", flush=True)
+    step(f"Saving {len(all_fetched)} documents to {docs_path}...")
     saved_count = save_fetched_docs(docs_path, all_fetched)
 
     if saved_count == 0:
-        print(f"STEP:Failed to save any documents", flush=True)
+        step("Failed to save any documents")
         return False
 
-    print(f"STEP:Successfully saved {saved_count} documentation files for {handler_name}", flush=True)
+    step(f"Successfully saved {saved_count} documentation files for {handler_name}")
     return True
\ No newline at end of file
@@ -127,49 +127,50 @@ PARSERS = {
 }
 
 
-def load_and_chunk_docs(base_path: str, chunk_size: int = 3000) -> tuple[list[str], list[str]]:
+def iter_doc_files(base_path: str):
     """
-    Walk a documentation folder, parse all supported files,
-    and return (chunks, chunk_sources) ready for embedding.
-
-    Supported formats: .rst, .pdf, .txt
+    Yield the full path of every supported documentation file under base_path,
+    in a stable order (directories and files sorted).
     """
-    all_sections = []
-
     for root, dirs, files in os.walk(base_path):
+        dirs.sort()
         for file in sorted(files):
             ext = os.path.splitext(file)[1].lower()
-            parser_type = PARSERS.get(ext)
+            if ext in PARSERS:
+                yield os.path.join(root, file)
+
+
+def parse_file(full_path: str) -> list[dict]:
+    """Parse one supported file into {"text": ..., "source": ...} sections."""
+    file = os.path.basename(full_path)
+    parser_type = PARSERS.get(os.path.splitext(file)[1].lower())
 
-            if parser_type is None:
-                continue  # Skip unsupported files
+    if parser_type is None:
+        return []  # Skip unsupported files
 
-            full_path = os.path.join(root, file)
+    if parser_type == "pdf":
+        return _parse_pdf(full_path, file)
 
-            if parser_type == "pdf":
-                sections = _parse_pdf(full_path, file)
-            else:
-                try:
-                    with open(full_path, "r", encoding="utf-8", errors="ignore") as f:
-                        content = f.read()
-                except Exception as e:
-                    print(f"WARNING: Could not read {file}: {e}", file=sys.stderr, flush=True)
-                    continue
+    try:
+        with open(full_path, "r", encoding="utf-8", errors="ignore") as f:
+            content = f.read()
+    except Exception as e:
+        print(f"WARNING: Could not read {file}: {e}", file=sys.stderr, flush=True)
+        return []
 
-                if parser_type == "rst":
-                    sections = _parse_rst(content, file)
-                elif parser_type == "txt":
-                    sections = _parse_txt(content, file)
-                else:
-                    continue
+    if parser_type == "rst":
+        return _parse_rst(content, file)
+    elif parser_type == "txt":
+        return _parse_txt(content, file)
+    return []
 
-            all_sections.extend(sections)
 
-    # Now chunk each section to the target size
+def chunk_sections(sections: list[dict], chunk_size: int = 3000) -> tuple[list[str], list[str]]:
+    """Split parsed sections into chunks of at most chunk_size characters."""
     chunks = []
     chunk_sources = []
 
-    for section in all_sections:
+    for section in sections:
         text = section["text"]
         source = section["source"]
 
@@ -187,6 +188,25 @@ def load_and_chunk_docs(base_path: str, chunk_size: int = 3000) -> tuple[list[st
     return chunks, chunk_sources
 
 
+def load_and_chunk_file(full_path: str, chunk_size: int = 3000) -> tuple[list[str], list[str]]:
+    """Parse and chunk a single file. Used for incremental re-indexing."""
+    return chunk_sections(parse_file(full_path), chunk_size)
+
+
+def load_and_chunk_docs(base_path: str, chunk_size: int = 3000) -> tuple[list[str], list[str]]:
+    """
+    Walk a documentation folder, parse all supported files,
+    and return (chunks, chunk_sources) ready for embedding.
+
+    Supported formats: .rst, .pdf, .txt
+    """
+    all_sections = []
+    for full_path in iter_doc_files(base_path):
+        all_sections.extend(parse_file(full_path))
+
+    return chunk_sections(all_sections, chunk_size)
+
+
 def get_supported_extensions() -> list[str]:
     """Return list of supported file extensions."""
     return list(PARSERS.keys())
\ No newline at end of file
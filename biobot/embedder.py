@@ -0,0 +1,197 @@
+"""
+Batched, concurrent embedding builder for BioBot RAG indexes.
+
+Embedding a handler's documentation one chunk per request means thousands of
+sequential HTTP round trips. This module instead:
+1. Packs chunks into token-bounded batches (counted with tiktoken)
+2. Sends several batches at once from a small thread pool
+3. Shares rate-limit backoff across all threads, so one 429 pauses everyone
+4. Reports progress and throughput as pipeline steps
+
+Texts already embedded with the same model (by any handler, chunk size or
+earlier build) are served from the disk cache in embedding_cache.py, and
+duplicate texts within a call are only sent once.
+
+Usage:
+    embeddings = embed_texts(chunks, api_key)   # float32 array, one row per chunk
+"""
+
+import sys
+import time
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
+
+import numpy as np
+import tiktoken
+
+from embedding_cache import get_embedding_cache
+from openai_clients import get_openai_client
+from rag_events import step, emit, event_sink, timed_call
+
+
+EMBEDDING_MODEL = "text-embedding-3-small"
+MAX_INPUT_TOKENS = 8191       # API limit for a single input
+MAX_BATCH_TOKENS = 100_000    # Stay well under the per-request token limit
+MAX_BATCH_INPUTS = 2048       # API limit on inputs per request
+EMBEDDING_WORKERS = 4         # Batches in flight at once
+
+
+def _log(msg):
+    print(msg, file=sys.stderr, flush=True)
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    # text-embedding-3-* models use the cl100k_base tokenizer
+    return tiktoken.get_encoding("cl100k_base")
+
+
+def make_batches(texts, max_batch_tokens=MAX_BATCH_TOKENS, max_batch_inputs=MAX_BATCH_INPUTS):
+    """
+    Group texts into batches bounded by total tokens and number of inputs.
+    Inputs longer than MAX_INPUT_TOKENS are truncated so the API accepts them.
+    Returns a list of (indices, inputs) pairs covering every text once, in order.
+    """
+    enc = _encoding()
+    batches = []
+    indices, inputs, batch_tokens = [], [], 0
+
+    for i, text in enumerate(texts):
+        tokens = enc.encode(text, disallowed_special=())
+        if len(tokens) > MAX_INPUT_TOKENS:
+            tokens = tokens[:MAX_INPUT_TOKENS]
+            text = enc.decode(tokens)
+        n_tokens = max(len(tokens), 1)
+
+        if inputs and (batch_tokens + n_tokens > max_batch_tokens or len(inputs) >= max_batch_inputs):
+            batches.append((indices, inputs))
+            indices, inputs, batch_tokens = [], [], 0
+
+        indices.append(i)
+        inputs.append(text)
+        batch_tokens += n_tokens
+
+    if inputs:
+        batches.append((indices, inputs))
+    return batches
+
+
+class RateLimitGate:
+    """
+    Backoff shared by all embedding threads: when any request is rate limited,
+    every thread waits until the pause is over before sending its next batch.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._resume_at = 0.0
+
+    def wait(self):
+        while True:
+            with self._lock:
+                delay = self._resume_at - time.monotonic()
+            if delay <= 0:
+                return
+            time.sleep(delay)
+
+    def back_off(self, delay):
+        with self._lock:
+            self._resume_at = max(self._resume_at, time.monotonic() + delay)
+
+
+def _is_rate_limit(error):
+    msg = str(error).lower()
+    return "rate limit" in msg or "429" in msg
+
+
+def _embed_batch(client, model, inputs, gate, retries, delay):
+    """
+    Embed one batch on a pool thread. Returns (vectors, timings): the
+    TimingEvents of its API calls, for the caller's thread to emit.
+    """
+    timings = []
+    for attempt in range(retries):
+        gate.wait()
+        try:
+            with event_sink(timings.append):
+                response = timed_call("embed", client.embeddings.create, model=model, input=inputs)
+            return [item.embedding for item in sorted(response.data, key=lambda d: d.index)], timings
+        except Exception as e:
+            if not _is_rate_limit(e):
+                raise
+            wait = delay * (2 ** attempt)
+            _log(f"Rate limit hit. Retry {attempt + 1}/{retries} in {wait} sec...")
+            gate.back_off(wait)
+    raise RuntimeError("Failed to get embeddings after retries.")
+
+
+def embed_texts(texts, api_key, model=EMBEDDING_MODEL, max_batch_tokens=MAX_BATCH_TOKENS,
+                workers=EMBEDDING_WORKERS, retries=5, delay=2, use_cache=True):
+    """
+    Embed a list of texts with batched, concurrent API calls, skipping texts
+    found in the embedding cache.
+    Returns a float32 array of shape (len(texts), dim), rows in input order.
+    """
+    if not texts:
+        return np.zeros((0, 0), dtype=np.float32)
+
+    cache = get_embedding_cache() if use_cache else None
+    cached = [None] * len(texts)
+    if cache is not None:
+        try:
+            cached = cache.get_many(model, texts)
+        except sqlite3.Error as e:
+            _log(f"WARNING: Embedding cache read failed: {e}")
+
+    # Only texts missing from the cache go to the API, each distinct text once
+    missing = list(dict.fromkeys(t for t, v in zip(texts, cached) if v is None))
+    hits = len(texts) - sum(v is None for v in cached)
+    if hits:
+        step(f"Reusing {hits}/{len(texts)} cached embeddings")
+    if missing:
+        fetched = dict(zip(missing, _embed_uncached(missing, api_key, model, max_batch_tokens,
+                                                    workers, retries, delay)))
+        if cache is not None:
+            try:
+                cache.put_many(model, missing, [fetched[t] for t in missing])
+            except sqlite3.Error as e:
+                _log(f"WARNING: Embedding cache write failed: {e}")
+        cached = [fetched[t] if v is None else v for t, v in zip(texts, cached)]
+
+    return np.array(cached, dtype=np.float32)
+
+
+def _embed_uncached(texts, api_key, model, max_batch_tokens, workers, retries, delay):
+    """Embed texts through the API; returns a list of vectors in input order."""
+    client = get_openai_client(api_key)
+    batches = make_batches(texts, max_batch_tokens)
+    gate = RateLimitGate()
+    results = [None] * len(texts)
+    done = 0
+    start = time.perf_counter()
+
+    step(f"Embedding {len(texts)} chunks in {len(batches)} batches...")
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = {
+            pool.submit(_embed_batch, client, model, inputs, gate, retries, delay): indices
+            for indices, inputs in batches
+        }
+        for future in as_completed(futures):
+            indices = futures[future]
+            vectors, timings = future.result()
+            for event in timings:
+                emit(event)
+            for i, vector in zip(indices, vectors):
+                results[i] = vector
+            done += len(indices)
+            if len(batches) > 1:
+                step(f"Embedded {done}/{len(texts)} chunks...")
+
+    elapsed = time.perf_counter() - start
+    rate = len(texts) / elapsed if elapsed > 0 else float("inf")
+    step(f"Embedded {len(texts)} chunks in {elapsed:.1f}s ({rate:.0f} chunks/s)")
+
+    return results
@@ -0,0 +1,319 @@
+"""
+Content-addressed, disk-backed cache of chunk embeddings.
+
+Vectors are stored in a SQLite database keyed by (embedding model, SHA-256 of
+the text), so identical text is embedded once no matter which handler, chunk
+size or rebuild produced it. embedder.embed_texts consults the cache before
+calling the API and stores whatever it had to fetch.
+
+The database lives in $BIOBOT_CACHE_DIR (default: biobot/data) and is kept
+under $BIOBOT_EMBEDDING_CACHE_MB megabytes by evicting the least recently used
+vectors. Lookups don't write: the last-used times of hits are collected in
+memory and written in one batch every TOUCH_BATCH hits or TOUCH_SECONDS
+seconds, and before any eviction. The cache size is tracked by a running
+counter, re-measured every SIZE_RESYNC_SECONDS (other processes write to the
+same file) and before evicting.
+
+Question embeddings used for retrieval get their own cache (QueryEmbeddingCache):
+an in-memory LRU in front of a table in the same database, with entries
+expiring after $BIOBOT_QUERY_CACHE_TTL seconds. Questions are normalized
+(case, whitespace, trailing punctuation) before hashing, so a retried or
+regenerated request reuses its embedding.
+
+Usage:
+    cache = get_embedding_cache()
+    vectors = cache.get_many(model, texts)     # list of arrays or None
+    cache.put_many(model, texts, embeddings)
+
+    queries = get_query_cache()
+    vector = queries.get(model, question)      # array or None
+    queries.put(model, question, vector)
+    queries.stats()                            # {"memory_hits": ..., "disk_hits": ..., "misses": ...}
+"""
+
+import os
+import re
+import sys
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.environ.get("BIOBOT_CACHE_DIR", os.path.join(SCRIPT_DIR, "data"))
+EMBEDDING_CACHE_FILE = "embeddings.sqlite"
+EMBEDDING_CACHE_MB = int(os.environ.get("BIOBOT_EMBEDDING_CACHE_MB", "1024"))
+SQL_BATCH = 500  # Keep IN (...) lists under SQLite's variable limit
+TOUCH_BATCH = 1000  # Pending last_used updates written at once
+TOUCH_SECONDS = 60
+SIZE_RESYNC_SECONDS = 300
+QUERY_CACHE_TTL = int(os.environ.get("BIOBOT_QUERY_CACHE_TTL", str(7 * 24 * 3600)))
+QUERY_CACHE_SIZE = int(os.environ.get("BIOBOT_QUERY_CACHE_SIZE", "512"))  # In-memory entries
+
+
+def _log(msg):
+    print(msg, file=sys.stderr, flush=True)
+
+
+def text_digest(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def normalize_question(text):
+    """Lowercase, collapse whitespace and drop trailing punctuation."""
+    return re.sub(r"\s+", " ", text).strip().rstrip(".?!").strip().lower()
+
+
+class EmbeddingCache:
+    """SQLite-backed (model, text hash) -> float32 vector cache with LRU eviction."""
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._touched = {}  # (model, digest) -> last hit time, not written yet
+        self._touched_flushed = time.time()
+        self._size = None  # Bytes of vectors stored, measured on the first put
+        self._size_measured = 0.0
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS embeddings (
+                    model TEXT NOT NULL,
+                    digest TEXT NOT NULL,
+                    vector BLOB NOT NULL,
+                    last_used REAL NOT NULL,
+                    PRIMARY KEY (model, digest)
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+
+    def _connect(self):
+        # One short-lived connection per call: safe across threads and forked workers
+        return sqlite3.connect(self.path, timeout=30)
+
+    def get_many(self, model, texts):
+        """Return a list aligned with texts: cached float32 vector, or None on a miss."""
+        digests = [text_digest(t) for t in texts]
+        found = {}
+        with self._connect() as conn:
+            unique = list(dict.fromkeys(digests))
+            for start in range(0, len(unique), SQL_BATCH):
+                batch = unique[start:start + SQL_BATCH]
+                marks = ",".join("?" * len(batch))
+                rows = conn.execute(
+                    f"SELECT digest, vector FROM embeddings WHERE model = ? AND digest IN ({marks})",
+                    [model, *batch],
+                ).fetchall()
+                for digest, blob in rows:
+                    found[digest] = np.frombuffer(blob, dtype=np.float32)
+        if found:
+            self._touch(model, found)
+        return [found.get(d) for d in digests]
+
+    def _touch(self, model, digests):
+        """Record hits; their last_used times are written in batches."""
+        now = time.time()
+        with self._lock:
+            for digest in digests:
+                self._touched[(model, digest)] = now
+            due = len(self._touched) >= TOUCH_BATCH or now - self._touched_flushed >= TOUCH_SECONDS
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Write the pending last_used updates."""
+        with self._lock:
+            touched, self._touched = self._touched, {}
+            self._touched_flushed = time.time()
+        if not touched:
+            return
+        with self._connect() as conn:
+            conn.executemany(
+                "UPDATE embeddings SET last_used = ? WHERE model = ? AND digest = ?",
+                [(used, model, digest) for (model, digest), used in touched.items()],
+            )
+
+    def put_many(self, model, texts, vectors):
+        """Store one vector per text, then evict old entries if over the size limit."""
+        now = time.time()
+        rows = [
+            (model, text_digest(t), np.asarray(v, dtype=np.float32).tobytes(), now)
+            for t, v in zip(texts, vectors)
+        ]
+        if not rows:
+            return
+        with self._connect() as conn:
+            # A digest already stored holds the same text, so the same vector
+            inserted = conn.executemany("INSERT OR IGNORE INTO embeddings VALUES (?, ?, ?, ?)", rows).rowcount
+        with self._lock:
+            if self._size is not None:
+                self._size += max(inserted, 0) * len(rows[0][2])
+            stale = self._size is None or now - self._size_measured >= SIZE_RESYNC_SECONDS
+        if stale or self._size > self.max_bytes:
+            self._evict()
+
+    def size_bytes(self):
+        with self._connect() as conn:
+            return conn.execute("SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()[0]
+
+    def _measure(self):
+        total = self.size_bytes()
+        with self._lock:
+            self._size = total
+            self._size_measured = time.time()
+        return total
+
+    def _evict(self):
+        """Drop least recently used vectors until the cache is back under 90% of max_bytes."""
+        total = self._measure()
+        if total <= self.max_bytes:
+            return
+        self.flush()
+        target = int(self.max_bytes * 0.9)
+        with self._connect() as conn:
+            cursor = conn.execute("SELECT rowid, LENGTH(vector) FROM embeddings ORDER BY last_used")
+            doomed = []
+            for rowid, size in cursor:
+                if total <= target:
+                    break
+                doomed.append((rowid,))
+                total -= size
+            conn.executemany("DELETE FROM embeddings WHERE rowid = ?", doomed)
+        with self._lock:
+            self._size = total
+        _log(f"Embedding cache: evicted {len(doomed)} vectors")
+
+
+class QueryEmbeddingCache:
+    """
+    Question -> embedding cache: an in-memory LRU backed by a SQLite table
+    that survives worker restarts. Entries older than `ttl` seconds are ignored
+    and purged. Hit/miss counters are kept per process.
+    """
+
+    def __init__(self, path, ttl=QUERY_CACHE_TTL, max_entries=QUERY_CACHE_SIZE):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._memory = OrderedDict()  # key -> (created, vector)
+        self._lock = threading.Lock()
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS query_embeddings (
+                    key TEXT PRIMARY KEY,
+                    vector BLOB NOT NULL,
+                    created REAL NOT NULL
+                )
+            """)
+            conn.execute("DELETE FROM query_embeddings WHERE created < ?", (time.time() - ttl,))
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    @staticmethod
+    def _key(model, question):
+        return text_digest(f"{model}\n{normalize_question(question)}")
+
+    def _remember(self, key, created, vector):
+        self._memory[key] = (created, vector)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, model, question):
+        """Cached float32 vector for the question, or None."""
+        key = self._key(model, question)
+        expired_before = time.time() - self.ttl
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and entry[0] >= expired_before:
+                self._memory.move_to_end(key)
+                self.counters["memory_hits"] += 1
+                return entry[1]
+            self._memory.pop(key, None)
+
+        try:
+            with self._connect() as conn:
+                row = conn.execute(
+                    "SELECT vector, created FROM query_embeddings WHERE key = ? AND created >= ?",
+                    (key, expired_before),
+                ).fetchone()
+        except sqlite3.Error as e:
+            _log(f"WARNING: Query embedding cache read failed: {e}")
+            row = None
+
+        with self._lock:
+            if row is None:
+                self.counters["misses"] += 1
+                return None
+            vector = np.frombuffer(row[0], dtype=np.float32)
+            self._remember(key, row[1], vector)
+            self.counters["disk_hits"] += 1
+            return vector
+
+    def put(self, model, question, vector):
+        key = self._key(model, question)
+        vector = np.asarray(vector, dtype=np.float32)
+        now = time.time()
+        with self._lock:
+            self._remember(key, now, vector)
+        try:
+            with self._connect() as conn:
+                conn.execute("INSERT OR REPLACE INTO query_embeddings VALUES (?, ?, ?)",
+                             (key, vector.tobytes(), now))
+        except sqlite3.Error as e:
+            _log(f"WARNING: Query embedding cache write failed: {e}")
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self.counters)
+        lookups = sum(counters.values())
+        hits = counters["memory_hits"] + counters["disk_hits"]
+        counters["hit_rate"] = hits / lookups if lookups else 0.0
+        return counters
+
+
+_cache = None
+_query_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_embedding_cache():
+    """
+    Shared cache instance, or None if the cache directory isn't writable
+    (embedding then simply goes to the API every time).
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            try:
+                _cache = EmbeddingCache(
+                    os.path.join(CACHE_DIR, EMBEDDING_CACHE_FILE),
+                    EMBEDDING_CACHE_MB * 1024 * 1024,
+                )
+            except (OSError, sqlite3.Error) as e:
+                _log(f"WARNING: Embedding cache disabled: {e}")
+                _cache = False
+        return _cache or None
+
+
+def get_query_cache():
+    """Shared question-embedding cache, or None if the cache directory isn't writable."""
+    global _query_cache
+    with _cache_lock:
+        if _query_cache is None:
+            try:
+                _query_cache = QueryEmbeddingCache(os.path.join(CACHE_DIR, EMBEDDING_CACHE_FILE))
+            except (OSError, sqlite3.Error) as e:
+                _log(f"WARNING: Query embedding cache disabled: {e}")
+                _query_cache = False
+        return _query_cache or None
@@ -1,14 +1,19 @@
 import subprocess
+import socket
 import json
-from openai import OpenAI
 import os
+import time
 from config import get_api_key
+from openai_clients import get_openai_client as _shared_client
+from rag_events import TimingEvent, event_sink
+from response_cache import cache_scope, cached_call
+from triage import triage_request
     
 MODEL_NAME_CLASS = "gpt-4o-mini"
 MODEL_NAME = "gpt-5.4"
 
 def get_openai_client(api_key=None):
-    return OpenAI(api_key=api_key or get_api_key())
+    return _shared_client(api_key or get_api_key())
 
 def classify_prompt(prompt, chat_history=None, model_name=MODEL_NAME_CLASS, api_key=None):
     client = get_openai_client(api_key)
@@ -45,11 +50,11 @@ Return ONLY one word: code, general, or out. No explanation, no punctuation."""
         }
     ]
 
-    response = client.responses.create(
+    answer = cached_call("classify", client.responses.create,
         model=model_name,
         input=classification_prompt
     )
-    return response.output_text.strip().lower()
+    return answer.lower()
 
 def run_gpt(chat_history, model=MODEL_NAME, api_key=None):
     client = get_openai_client(api_key)
@@ -80,6 +85,9 @@ def run_gpt_stream(chat_history, model=MODEL_NAME, api_key=None):
     non_system_msgs = non_system_msgs[-9:]
     messages = [system_msg] + non_system_msgs if system_msg else non_system_msgs
 
+    # Timed by hand: a TIMING chunk follows the streamed reply (see process_user_query)
+    timing = TimingEvent("chat", model=model)
+    start = time.perf_counter()
     response = client.responses.create(
         model=model,
         input=messages,
@@ -93,11 +101,15 @@ def run_gpt_stream(chat_history, model=MODEL_NAME, api_key=None):
             token = event.delta
             assistant_text += token
             yield token
+        elif event.type == "response.completed":
+            timing.add_usage(event.response.usage)
 
     chat_history.append({
         "role": "assistant",
         "content": assistant_text
     })
+    timing.seconds = round(time.perf_counter() - start, 4)
+    yield TIMING_MARKER + timing.to_json()
 
 
 
@@ -105,37 +117,135 @@ RAG_STATUS_PREFIX = "__RAG_STATUS__:"
 RAG_STEP_PREFIX = "STEP:"
 RAG_FAILED_PREFIX = "FAILED_CODE:"
 RAG_FORMAT_PREFIX = "FORMAT:"
+RAG_TIMING_PREFIX = "TIMING:"
 FAILED_CODE_MARKER = "__FAILED_CODE__:"
 FORMAT_MARKER = "__FORMAT__:"
+# Stage/model-call timings (a JSON TimingEvent): aggregated by app.py, never shown to the user
+TIMING_MARKER = "__TIMING__:"
+
+RAG_WORKER_SOCKET = os.environ.get("BIOBOT_RAG_SOCKET", "/tmp/biobot_rag.sock")
+
+# How code requests run the RAG pipeline:
+#   "inprocess"  — main_rag.iter_pipeline on a thread of this process (default, used by the Docker image)
+#   "worker"     — the persistent rag_worker.py daemon, falling back to "subprocess" when it isn't
+#                  running; the daemon must be started and supervised separately (see README)
+#   "subprocess" — a fresh `python3 main_rag.py` per request
+RAG_MODE = os.environ.get("BIOBOT_RAG_MODE", "inprocess")
+
+
+def _connect_rag_worker():
+    """
+    Connect to the persistent RAG worker (rag_worker.py).
+    Returns the connected socket, or None if no worker is listening.
+    """
+    if not os.path.exists(RAG_WORKER_SOCKET):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(RAG_WORKER_SOCKET)
+    except OSError:
+        sock.close()
+        return None
+    return sock
+
+
+def _inprocess_rag_generator(user_query, history, api_key, triage=None, enc_key=None):
+    """
+    Run the pipeline in this process and translate its typed events into the
+    same chunks _rag_generator yields for the worker/subprocess modes.
+    """
+    # Imported lazily: faiss/numpy are only needed once a code request comes in
+    import main_rag
+    from rag_events import StepEvent, ReplyEvent, ResultEvent, FailedEvent, CODE_SEPARATOR
+
+    skip_check = bool(os.environ.get("BIOBOT_SKIP_SUFFICIENT_CHECK"))
+    for event in main_rag.iter_pipeline(user_query, history, api_key, skip_sufficient_check=skip_check,
+                                        triage=triage, enc_key=enc_key):
+        if isinstance(event, StepEvent):
+            yield RAG_STATUS_PREFIX + event.message
+        elif isinstance(event, ResultEvent):
+            yield FORMAT_MARKER + event.format + "\n" + event.content.strip()
+        elif isinstance(event, FailedEvent):
+            yield FORMAT_MARKER + "python\n" + FAILED_CODE_MARKER + event.message + CODE_SEPARATOR + event.code
+        elif isinstance(event, ReplyEvent):
+            # Same shape as plain stdout text from main_rag.py
+            yield FORMAT_MARKER + "python\n" + event.text.strip()
+        elif isinstance(event, TimingEvent):
+            yield TIMING_MARKER + event.to_json()
 
-def process_user_query(user_query, chat_history, model, api_key=None):
+
+def _with_timings(timings, chunks):
+    """Yield the TIMING chunks of stages that ran before the generator was created, then chunks."""
+    for event in timings:
+        yield TIMING_MARKER + event.to_json()
+    yield from chunks
+
+
+def process_user_query(user_query, chat_history, model, api_key=None, enc_key=None):
+    """
+    Answer a user message: a reply stream for general questions, or the RAG
+    pipeline's status and result chunks for code requests. `enc_key` (the
+    session encryption key) scopes and encrypts this user's entries in the
+    response cache. It never leaves this process: the worker and subprocess
+    modes run the pipeline without it, and so without the response cache.
+    """
     history = [msg for msg in chat_history]
-    classification = classify_prompt(user_query, chat_history=history, api_key=api_key)
+    timings = []
+    with event_sink(timings.append), cache_scope(enc_key):
+        classification = classify_prompt(user_query, chat_history=history, api_key=api_key)
+        # One structured call answers the pipeline's sufficiency/consolidation/detection steps (see triage.py)
+        triage = triage_request(user_query, history, api_key or get_api_key()) if classification == "code" else None
 
     if classification == "code":
+        skip_check = bool(os.environ.get("BIOBOT_SKIP_SUFFICIENT_CHECK"))
+        if triage is not None and triage.follow_up and not skip_check:
+            # Same chunk the pipeline yields for its follow-up question, without starting it
+            return _with_timings(timings, iter([FORMAT_MARKER + "python\n" + triage.follow_up]))
+
+        if RAG_MODE == "inprocess":
+            return _with_timings(timings, _inprocess_rag_generator(user_query, history, api_key or get_api_key(),
+                                                                   triage, enc_key))
+
         def _rag_generator():
-            env = os.environ.copy()
-            env["API_KEY"] = api_key or get_api_key()
-
-            proc = subprocess.Popen(
-                [
-                    "python3", "main_rag.py",
-                    user_query,
-                    json.dumps(history)
-                ],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-                bufsize=1,
-                env=env
-            )
+            resolved_key = api_key or get_api_key()
+
+            # Prefer the resident worker; fall back to a one-shot main_rag.py process
+            sock = _connect_rag_worker() if RAG_MODE == "worker" else None
+            proc = None
+            if sock is not None:
+                job = {
+                    "query": user_query,
+                    "history": history,
+                    "api_key": resolved_key,
+                    "skip_sufficient_check": skip_check,
+                    "triage": triage.to_dict() if triage is not None else None,
+                }
+                sock.sendall((json.dumps(job) + "\n").encode("utf-8"))
+                sock.shutdown(socket.SHUT_WR)
+                lines = sock.makefile("r", encoding="utf-8")
+            else:
+                env = os.environ.copy()
+                env["API_KEY"] = resolved_key
+
+                args = ["python3", "main_rag.py", user_query, json.dumps(history)]
+                if triage is not None:
+                    args.append(json.dumps(triage.to_dict()))
+                proc = subprocess.Popen(
+                    args,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE,
+                    text=True,
+                    bufsize=1,
+                    env=env
+                )
+                lines = proc.stdout
 
             final_code_lines = []
             failed_code_content = None
             is_failed = False
             detected_format = "python"
 
-            for raw_line in proc.stdout:
+            for raw_line in lines:
                 trimmed = raw_line.strip()
                 if not trimmed:
                     if is_failed:
@@ -145,6 +255,8 @@ def process_user_query(user_query, chat_history, model, api_key=None):
                     continue
                 if trimmed.startswith(RAG_STEP_PREFIX):
                     yield RAG_STATUS_PREFIX + trimmed[len(RAG_STEP_PREFIX):]
+                elif trimmed.startswith(RAG_TIMING_PREFIX):
+                    yield TIMING_MARKER + trimmed[len(RAG_TIMING_PREFIX):]
                 elif trimmed.startswith(RAG_FORMAT_PREFIX):
                     detected_format = trimmed[len(RAG_FORMAT_PREFIX):]
                 elif trimmed.startswith(RAG_FAILED_PREFIX):
@@ -157,10 +269,14 @@ def process_user_query(user_query, chat_history, model, api_key=None):
                 else:
                     final_code_lines.append(raw_line.rstrip() + "\n")
 
-            proc.wait()
-            if proc.returncode != 0:
-                stderr_out = proc.stderr.read()
-                print("main_rag.py error:", stderr_out)
+            if proc is not None:
+                proc.wait()
+                if proc.returncode != 0:
+                    stderr_out = proc.stderr.read()
+                    print("main_rag.py error:", stderr_out)
+            else:
+                lines.close()
+                sock.close()
 
             # Send format + content as a single yield
             if is_failed and failed_code_content:
@@ -169,10 +285,10 @@ def process_user_query(user_query, chat_history, model, api_key=None):
                 content = "".join(final_code_lines).strip()
                 yield FORMAT_MARKER + detected_format + "\n" + content
 
-        return _rag_generator()
+        return _with_timings(timings, _rag_generator())
 
     elif classification in {"general", "out"}:
-        return run_gpt_stream(history, model, api_key=api_key)
+        return _with_timings(timings, run_gpt_stream(history, model, api_key=api_key))
     
     else:
-        return run_gpt_stream(history, model, api_key=api_key)
\ No newline at end of file
+        return _with_timings(timings, run_gpt_stream(history, model, api_key=api_key))
\ No newline at end of file
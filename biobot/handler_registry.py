@@ -0,0 +1,62 @@
+"""
+Handler registry (handlers.json): one entry per liquid handling platform,
+with its docs folder, store path, validation settings and keywords.
+
+Kept free of faiss/numpy imports so the web process can read it before a
+code request reaches the pipeline (see triage.py).
+"""
+
+import os
+import json
+import tempfile
+import threading
+
+
+HANDLERS_CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "handlers.json")
+
+_write_lock = threading.Lock()
+
+
+def load_handlers_config():
+    """Load the handler registry from handlers.json."""
+    if not os.path.exists(HANDLERS_CONFIG_PATH):
+        return {
+            "opentrons": {
+                "name": "Opentrons",
+                "docs_path": "docs/opentrons",
+                "store_path": "rag_store_opentrons",
+                "simulate_cmd": ["opentrons_simulate"],
+                "keywords": ["opentrons", "ot-2", "ot2", "ot-3", "ot3", "flex"],
+                "index": {"type": "auto"},
+                "context_token_budget": 3000
+            }
+        }
+    with open(HANDLERS_CONFIG_PATH, "r") as f:
+        return json.load(f)
+
+
+def register_handler(handler_id, handler_config):
+    """
+    Add a handler to handlers.json so it persists across sessions. The file
+    is re-read first, so entries added meanwhile by another request are kept,
+    and replaced atomically, so concurrent readers never see it half written.
+    Where it can't be replaced (a bind-mounted file), it is rewritten in place.
+    Returns the updated registry.
+    """
+    with _write_lock:
+        handlers = load_handlers_config()
+        handlers.setdefault(handler_id, handler_config)
+        payload = json.dumps(handlers, indent=4)
+
+        directory = os.path.dirname(HANDLERS_CONFIG_PATH)
+        fd, tmp_path = tempfile.mkstemp(prefix=".handlers-", suffix=".json", dir=directory)
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(payload)
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, HANDLERS_CONFIG_PATH)
+        except OSError:
+            os.unlink(tmp_path)
+            with open(HANDLERS_CONFIG_PATH, "w") as f:
+                f.write(payload)
+    return handlers
@@ -0,0 +1,296 @@
+"""
+Process-wide registry of loaded handler indexes.
+
+Handler stores are opened on first use and kept in an LRU. A store checked
+against its docs folder less than $BIOBOT_INDEX_CHECK_SECONDS ago is handed
+out under the registry lock alone, without calling the loader (which stats
+the docs tree) or waiting for another handler's load. After every load, the
+least recently used stores are dropped while the process RSS is above
+$BIOBOT_INDEX_MEMORY_MB (no limit when unset). A dropped or replaced store is
+closed (Store.close) as soon as no request holds a lease on it. Per-handler
+hit/miss/load-time stats are kept for the /ops/indexes endpoint.
+
+This module only does bookkeeping; opening and refreshing stores is left to
+the loader passed in by main_rag.load_or_build_index.
+
+Usage:
+    result = INDEX_MANAGER.get(handler_id, load)   # load(cached_store) -> (result, store)
+    result, release = INDEX_MANAGER.acquire(handler_id, load)
+    ...
+    release()
+    INDEX_MANAGER.stats()
+"""
+
+import os
+import sys
+import time
+import threading
+from collections import OrderedDict
+
+
+INDEX_MEMORY_MB = int(os.environ.get("BIOBOT_INDEX_MEMORY_MB", "0"))  # 0 = unlimited
+# A loaded store is checked against its docs folder at most this often
+INDEX_CHECK_SECONDS = float(os.environ.get("BIOBOT_INDEX_CHECK_SECONDS", "10"))
+# Store files that are (mostly) paged in by searches; chunk texts are read a few at a time
+RESIDENT_SUFFIXES = (".faiss", ".npy", ".json")
+
+
+def _log(msg):
+    print(msg, file=sys.stderr, flush=True)
+
+
+def current_rss():
+    """Resident set size of this process in bytes, or None where /proc isn't available."""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def store_footprint(store_dir):
+    """Estimated memory of a loaded store: size of the index, vector and BM25 files."""
+    total = 0
+    try:
+        for name in os.listdir(store_dir):
+            if name.endswith(RESIDENT_SUFFIXES):
+                total += os.path.getsize(os.path.join(store_dir, name))
+    except OSError:
+        pass
+    return total
+
+
+class _Entry:
+    """A loaded store, the result its loader returned for it, and when that was last checked."""
+
+    def __init__(self, store, result=None, checked_at=0.0):
+        self.store = store
+        self.result = result  # None: opened by preload(), not checked yet
+        self.checked_at = checked_at
+
+
+class IndexManager:
+    """LRU of loaded stores keyed by handler id, bounded by a process RSS budget."""
+
+    def __init__(self, memory_budget_mb=INDEX_MEMORY_MB, check_seconds=INDEX_CHECK_SECONDS):
+        self.memory_budget = memory_budget_mb * 1024 * 1024
+        self.check_seconds = check_seconds
+        self._stores = OrderedDict()  # handler_id -> _Entry
+        self._stats = {}
+        self._lock = threading.RLock()
+        self._load_locks = {}  # handler_id -> Lock held while its store is loaded or built
+        self._users = {}  # Store -> number of acquire() leases not released yet
+        self._retired = set()  # Stores dropped from the LRU, closed once their last lease is released
+
+    def _handler_stats(self, handler_id):
+        return self._stats.setdefault(handler_id, {
+            "hits": 0, "misses": 0, "evictions": 0,
+            "load_seconds_total": 0.0, "last_load_seconds": None, "bytes": 0, "resident": False,
+        })
+
+    def _fresh(self, entry):
+        return (entry is not None and entry.result is not None
+                and time.monotonic() - entry.checked_at < self.check_seconds)
+
+    def get(self, handler_id, load):
+        """
+        Return the handler's retrieval index. `load(cached_store)` receives the
+        store loaded earlier (or None) and returns (result, store): the same
+        store object means it was reused, a new one replaces it, None means
+        nothing is cached (no docs, or an in-memory index). A store checked by
+        `load` less than `check_seconds` ago is returned without calling it.
+
+        The result stays usable until the store is evicted; use acquire() to
+        keep it open for as long as a request needs it.
+        """
+        return self._get(handler_id, load, lease=False)[0]
+
+    def acquire(self, handler_id, load):
+        """
+        get(), plus a lease on the store: if it is evicted or replaced while
+        leased, it is only closed once every lease is released. Returns
+        (result, release); call release() once done with the result.
+        """
+        result, store = self._get(handler_id, load, lease=True)
+        if store is None:
+            return result, lambda: None
+        released = []
+
+        def release():
+            if not released:
+                released.append(True)
+                self._release(store)
+        return result, release
+
+    def _get(self, handler_id, load, lease):
+        with self._lock:
+            entry = self._stores.get(handler_id)
+            if self._fresh(entry):
+                return self._hit(handler_id, entry, lease)
+            handler_lock = self._load_locks.setdefault(handler_id, threading.Lock())
+
+        # One load per handler at a time: concurrent first requests wait for
+        # the build in progress instead of each building the same store
+        with handler_lock:
+            with self._lock:
+                entry = self._stores.get(handler_id)
+                if self._fresh(entry):
+                    # Checked by the request we waited for
+                    return self._hit(handler_id, entry, lease)
+                cached = entry.store if entry is not None else None
+                if cached is not None:
+                    # Keep it open while the loader reads it, even if evicted meanwhile
+                    self._lease(cached)
+            start = time.perf_counter()
+            try:
+                result, store = load(cached)
+            except BaseException:
+                if cached is not None:
+                    self._release(cached)
+                raise
+            elapsed = time.perf_counter() - start
+
+            with self._lock:
+                current = self._stores.get(handler_id)
+                if store is not None and store is cached and current is entry:
+                    entry.result = result
+                    entry.checked_at = time.monotonic()
+                    self._release(cached)
+                    return self._hit(handler_id, entry, lease)
+
+                stats = self._handler_stats(handler_id)
+                stats["misses"] += 1
+                stats["load_seconds_total"] += elapsed
+                stats["last_load_seconds"] = round(elapsed, 3)
+                if current is not None:
+                    del self._stores[handler_id]
+                    if current.store is not store:
+                        self._retire(current.store)
+                # A store evicted during its check is back in use
+                self._retired.discard(store)
+                if cached is not None:
+                    self._release(cached)
+                if store is None:
+                    stats["resident"] = False
+                    return result, None
+                self._stores[handler_id] = _Entry(store, result, time.monotonic())
+                stats["bytes"] = store_footprint(store.store_dir)
+                stats["resident"] = True
+                if lease:
+                    self._lease(store)
+                self._evict(keep=handler_id)
+                return result, store
+
+    def _hit(self, handler_id, entry, lease):
+        self._handler_stats(handler_id)["hits"] += 1
+        self._stores.move_to_end(handler_id)
+        if lease:
+            self._lease(entry.store)
+        return entry.result, entry.store
+
+    def preload(self, handler_id, open_store):
+        """
+        Load a store ahead of the request that will need it: `open_store()`
+        returns it as it is on disk. Nothing happens if the handler already has
+        one. The store is not checked, so the next get() still runs its loader.
+        """
+        with self._lock:
+            if handler_id in self._stores:
+                return
+            handler_lock = self._load_locks.setdefault(handler_id, threading.Lock())
+        with handler_lock:
+            with self._lock:
+                if handler_id in self._stores:
+                    return
+            start = time.perf_counter()
+            store = open_store()
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                stats = self._handler_stats(handler_id)
+                stats["misses"] += 1
+                stats["load_seconds_total"] += elapsed
+                stats["last_load_seconds"] = round(elapsed, 3)
+                stats["bytes"] = store_footprint(store.store_dir)
+                stats["resident"] = True
+                self._stores[handler_id] = _Entry(store)
+                self._evict(keep=handler_id)
+
+    def _lease(self, store):
+        self._users[store] = self._users.get(store, 0) + 1
+
+    def _release(self, store):
+        with self._lock:
+            users = self._users[store] - 1
+            if users:
+                self._users[store] = users
+                return
+            del self._users[store]
+            if store in self._retired:
+                self._retired.discard(store)
+                store.close()
+
+    def _retire(self, store):
+        """Close a store dropped from the LRU now, or after the requests using it."""
+        if store in self._users:
+            self._retired.add(store)
+        else:
+            store.close()
+
+    def _resident_bytes(self):
+        rss = current_rss()
+        if rss is not None:
+            return rss
+        return sum(self._stats[h]["bytes"] for h in self._stores)
+
+    def _evict(self, keep):
+        """Drop least recently used stores (never `keep`) while over the memory budget."""
+        if not self.memory_budget:
+            return
+        resident = self._resident_bytes()
+        while len(self._stores) > 1 and resident > self.memory_budget:
+            handler_id = next(h for h in self._stores if h != keep)
+            self._retire(self._stores.pop(handler_id).store)
+            stats = self._stats[handler_id]
+            stats["evictions"] += 1
+            stats["resident"] = False
+            # RSS only drops once requests still using the store finish,
+            # so count its estimated size as freed right away
+            resident -= stats["bytes"]
+            _log(f"Evicted {handler_id} index ({stats['bytes'] / 2**20:.0f} MB) to stay under "
+                 f"{self.memory_budget / 2**20:.0f} MB")
+
+    def evict(self, handler_id):
+        with self._lock:
+            entry = self._stores.pop(handler_id, None)
+            if entry is not None:
+                self._retire(entry.store)
+                self._stats[handler_id]["evictions"] += 1
+                self._stats[handler_id]["resident"] = False
+
+    def loaded(self):
+        with self._lock:
+            return list(self._stores)
+
+    def stats(self):
+        """Per-handler counters plus process memory, as a JSON-serializable dict."""
+        with self._lock:
+            handlers = {}
+            for handler_id, stats in self._stats.items():
+                lookups = stats["hits"] + stats["misses"]
+                handlers[handler_id] = dict(
+                    stats,
+                    load_seconds_total=round(stats["load_seconds_total"], 3),
+                    hit_rate=stats["hits"] / lookups if lookups else 0.0,
+                )
+            rss = current_rss()
+            return {
+                "memory_budget_mb": self.memory_budget // 2**20 or None,
+                "check_seconds": self.check_seconds,
+                "rss_mb": round(rss / 2**20, 1) if rss is not None else None,
+                "loaded": list(self._stores),
+                "leased": sum(self._users.values()),
+                "handlers": handlers,
+            }
+
+
+INDEX_MANAGER = IndexManager()
@@ -0,0 +1,527 @@
+"""
+On-disk store for a handler's RAG index.
+
+A store is a directory (next to the handler's docs) holding:
+    meta.json              model, dimension, chunk count, chunk size, index spec, recall@5
+    manifest.json          per-file content hash and chunk ids (see indexer.py)
+    ids.npy                int64 chunk id of each row, ascending
+    embeddings.npy         float32 matrix (float16 for compact stores), opened with np.load(mmap_mode="r")
+    texts.bin              chunk texts, UTF-8, concatenated
+    texts.offsets.npy      int64 offsets into texts.bin (count + 1 entries)
+    sources.bin            chunk sources, same layout
+    sources.offsets.npy
+    index.faiss            ID-mapped FAISS index (faiss.write_index), of the type
+                           given by the handler's "index" spec (flat, hnsw, ivf_flat, ivf_pq)
+    bm25.*                 BM25 inverted index over the chunk texts (see lexical_index.py)
+
+Nothing is deserialized up front: the FAISS index and the embedding matrix
+are memory-mapped, and chunk texts/sources are decoded one at a time on
+access, so only the retrieved top-k chunks are ever read. Load time and RSS
+stay flat as the docs folders grow, and repeat queries skip rebuilding the
+index.
+
+With "vectors": "float16" or "sq8" in the index spec, vectors are
+L2-normalized, searched by inner product and held by the index as float16 or
+8-bit scalar-quantized codes (2x / 4x smaller than float32, on top of the
+float16 embeddings.npy). Any non-exact index gets its recall@5 measured
+against exact float32 search when it is written (meta["recall_at_5"]).
+
+Chunk ids are stable across incremental refreshes: the index returns ids,
+and `store.chunks[chunk_id]` / `store.chunk_sources[chunk_id]` resolve them.
+
+Legacy `rag_store_*.pkl` files are converted on first load.
+
+Usage:
+    store_dir = store_dir_for(docs_path, handler_config["store_path"])
+    write_store(store_dir, chunks, sources, embeddings, model="text-embedding-3-small")
+    store = load_store(store_dir)
+    D, I = store.index.search(query, 5)
+    store.chunks[I[0][0]], store.chunk_sources[I[0][0]]
+"""
+
+import os
+import sys
+import json
+import mmap
+import shutil
+import pickle
+import tempfile
+
+import numpy as np
+import faiss
+
+from lexical_index import LexicalIndex
+
+
+STORE_VERSION = 1
+META_FILE = "meta.json"
+EMBEDDINGS_FILE = "embeddings.npy"
+IDS_FILE = "ids.npy"
+MANIFEST_FILE = "manifest.json"
+INDEX_FILE = "index.faiss"
+
+
+def _log(msg):
+    print(msg, file=sys.stderr, flush=True)
+
+
+def store_dir_for(docs_path, store_path):
+    """Directory of a handler store. Accepts legacy '.pkl' names from handlers.json."""
+    return os.path.join(docs_path, os.path.splitext(store_path)[0])
+
+
+def store_exists(store_dir):
+    """True if a complete store (or a legacy pickle to migrate) exists."""
+    return os.path.exists(os.path.join(store_dir, META_FILE)) or os.path.exists(store_dir + ".pkl")
+
+
+def store_mtime(store_dir):
+    """Modification time of the store, used to detect rebuilds. meta.json is written last."""
+    return os.path.getmtime(os.path.join(store_dir, META_FILE))
+
+
+# ============================================================
+# Lazily decoded string table
+# ============================================================
+
+class StringTable:
+    """
+    Read-only sequence of strings backed by a UTF-8 blob and an offsets array.
+    Items are decoded on access; nothing else is read into memory.
+    """
+
+    def __init__(self, data_path, offsets_path):
+        self._offsets = np.load(offsets_path, mmap_mode="r")
+        self._file = open(data_path, "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        # mmap can't map empty files
+        self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        i = int(i)
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("string table index out of range")
+        start, end = int(self._offsets[i]), int(self._offsets[i + 1])
+        return self._data[start:end].decode("utf-8")
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def close(self):
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        self._file.close()
+        self._offsets = None
+
+
+class ChunkView:
+    """Sequence-like view of a StringTable (or array) addressed by chunk id instead of row."""
+
+    def __init__(self, table, ids):
+        self._table = table
+        self._ids = ids
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __getitem__(self, chunk_id):
+        row = int(np.searchsorted(self._ids, chunk_id))
+        if row >= len(self._ids) or self._ids[row] != chunk_id:
+            raise KeyError(f"unknown chunk id {chunk_id}")
+        return self._table[row]
+
+
+def _write_string_table(data_path, offsets_path, strings):
+    offsets = np.zeros(len(strings) + 1, dtype=np.int64)
+    with open(data_path, "wb") as f:
+        pos = 0
+        for i, s in enumerate(strings):
+            encoded = s.encode("utf-8")
+            f.write(encoded)
+            pos += len(encoded)
+            offsets[i + 1] = pos
+    np.save(offsets_path, offsets)
+
+
+# ============================================================
+# FAISS index
+# ============================================================
+
+# Index spec from handlers.json, e.g. {"type": "hnsw", "m": 32, "ef_search": 64}.
+# "auto" (the default) picks a type from the chunk count:
+AUTO_FLAT_MAX = 20_000        # exact search is fast enough below this
+AUTO_HNSW_MAX = 100_000       # graph index up to here, then IVF
+AUTO_IVF_FLAT_MAX = 1_000_000
+INDEX_TYPES = ("flat", "hnsw", "ivf_flat", "ivf_pq")
+# Vector encodings: exact float32 (L2), or normalized float16 / 8-bit scalar quantized (inner product)
+VECTOR_CODECS = {"float32": None, "float16": "SQfp16", "sq8": "SQ8"}
+RECALL_K = 5
+RECALL_SAMPLE = 100  # Stored vectors used as queries for the recall check
+MIN_POINTS_PER_CENTROID = 39  # FAISS k-means needs ~39 training points per list
+
+
+def resolve_index_spec(spec, count, dim):
+    """
+    Turn a handler's index spec into a complete, concrete one (type and all
+    parameters filled in) for a corpus of `count` vectors of dimension `dim`.
+    Falls back to "flat" when there are too few vectors to train an IVF index.
+    """
+    spec = dict(spec or {"type": "auto"})
+    index_type = spec.get("type", "auto")
+    if index_type == "auto":
+        if count <= AUTO_FLAT_MAX:
+            index_type = "flat"
+        elif count <= AUTO_HNSW_MAX:
+            index_type = "hnsw"
+        elif count <= AUTO_IVF_FLAT_MAX:
+            index_type = "ivf_flat"
+        else:
+            index_type = "ivf_pq"
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type '{index_type}', expected one of {INDEX_TYPES} or 'auto'")
+    vectors = spec.get("vectors", "float32")
+    if vectors not in VECTOR_CODECS:
+        raise ValueError(f"Unknown vectors '{vectors}', expected one of {tuple(VECTOR_CODECS)}")
+
+    if index_type in ("ivf_flat", "ivf_pq"):
+        nlist = spec.get("nlist") or int(4 * np.sqrt(max(count, 1)))
+        nlist = min(nlist, count // MIN_POINTS_PER_CENTROID)
+        if nlist < 1 or (index_type == "ivf_pq" and count < MIN_POINTS_PER_CENTROID * 16):
+            index_type = "flat"
+
+    # The spec as configured is kept too, to tell config changes from corpus growth
+    resolved = {
+        "type": index_type,
+        "vectors": vectors,
+        "metric": "l2" if vectors == "float32" else "ip",
+        "requested": spec,
+    }
+    if index_type == "hnsw":
+        resolved.update({
+            "m": spec.get("m", 32),
+            "ef_construction": spec.get("ef_construction", 80),
+            "ef_search": spec.get("ef_search", 64),
+        })
+    elif index_type in ("ivf_flat", "ivf_pq"):
+        resolved.update({"nlist": nlist, "nprobe": min(spec.get("nprobe", 16), nlist)})
+    if index_type == "ivf_pq":
+        # Number of sub-quantizers must divide the dimension
+        m = spec.get("m", 64)
+        while dim % m:
+            m -= 1
+        # Each sub-quantizer has 2**nbits centroids to train, too
+        nbits = spec.get("nbits", 8)
+        while nbits > 4 and count < MIN_POINTS_PER_CENTROID * (1 << nbits):
+            nbits -= 1
+        resolved.update({"m": m, "nbits": nbits})
+    return resolved
+
+
+def index_spec_changed(stored, spec, count, dim):
+    """
+    True if an index built with the `stored` (resolved) spec no longer matches
+    the configured `spec`: the config was edited, or "auto" now picks another
+    type for the corpus size. Stores predating index specs always differ.
+    """
+    if not stored:
+        return True
+    if stored.get("requested") != dict(spec or {"type": "auto"}):
+        return True
+    return resolve_index_spec(spec, count, dim)["type"] != stored["type"]
+
+
+def _prepare_vectors(embeddings, spec):
+    """float32 copy of the vectors, L2-normalized when the index searches by inner product."""
+    embeddings = np.array(embeddings, dtype=np.float32, order="C")
+    if spec.get("metric") == "ip" and len(embeddings):
+        faiss.normalize_L2(embeddings)
+    return embeddings
+
+
+def apply_search_params(index, spec):
+    """Set query-time parameters (efSearch, nprobe) that aren't part of the factory string."""
+    if spec["type"] == "hnsw":
+        faiss.downcast_index(index.index).hnsw.efSearch = spec["ef_search"]
+    elif spec["type"] in ("ivf_flat", "ivf_pq"):
+        faiss.extract_index_ivf(index).nprobe = spec["nprobe"]
+
+
+def build_faiss_index(embeddings, ids=None, spec=None):
+    """
+    Build (and train, for IVF types) the index searched at query time.
+    `spec` must be resolved (see resolve_index_spec); defaults to exact flat L2.
+    Flat and HNSW are wrapped in an IndexIDMap2; IVF indexes store ids natively.
+    Either way, search returns chunk ids and vectors can be removed by id
+    (HNSW can't remove: callers rebuild it instead, see update_faiss_index).
+    """
+    spec = spec or {"type": "flat"}
+    embeddings = _prepare_vectors(embeddings, spec)
+    dim = embeddings.shape[1]
+    if ids is None:
+        ids = np.arange(len(embeddings), dtype=np.int64)
+    ids = np.ascontiguousarray(ids, dtype=np.int64)
+
+    codec = VECTOR_CODECS[spec.get("vectors", "float32")]
+    metric = faiss.METRIC_INNER_PRODUCT if spec.get("metric") == "ip" else faiss.METRIC_L2
+    if spec["type"] == "flat":
+        factory = f"IDMap2,{codec or 'Flat'}"
+    elif spec["type"] == "hnsw":
+        factory = f"IDMap2,HNSW{spec['m']}" + (f"_{codec}" if codec else "")
+    elif spec["type"] == "ivf_flat":
+        factory = f"IVF{spec['nlist']},{codec or 'Flat'}"
+    else:
+        # PQ codes are already compressed; `vectors` only selects the metric
+        factory = f"IVF{spec['nlist']},PQ{spec['m']}x{spec['nbits']}"
+    index = faiss.index_factory(dim, factory, metric)
+    if spec["type"] == "hnsw":
+        faiss.downcast_index(index.index).hnsw.efConstruction = spec["ef_construction"]
+
+    if not index.is_trained:
+        index.train(embeddings)
+    if len(embeddings):
+        index.add_with_ids(embeddings, ids)
+    apply_search_params(index, spec)
+    return index
+
+
+def update_faiss_index(index, spec, stale_ids, new_embeddings, new_ids):
+    """
+    Remove stale chunk ids from an index and add new vectors in place.
+    Returns the updated index, or None if this index type can't remove
+    vectors and must be rebuilt.
+    """
+    try:
+        if len(stale_ids):
+            index.remove_ids(np.asarray(stale_ids, dtype=np.int64))
+    except RuntimeError:
+        return None
+    if new_embeddings is not None and len(new_embeddings):
+        index.add_with_ids(_prepare_vectors(new_embeddings, spec), np.asarray(new_ids, dtype=np.int64))
+    apply_search_params(index, spec)
+    return index
+
+
+def measure_recall(index, embeddings, ids, spec, k=RECALL_K, sample=RECALL_SAMPLE):
+    """
+    Recall@k of `index` against exact float32 search over the same vectors,
+    using a fixed sample of stored vectors as queries (each query's own row
+    is left out of both result lists). Returns None if the corpus is too small.
+    """
+    embeddings = _prepare_vectors(embeddings, spec)
+    if len(embeddings) <= k:
+        return None
+    rows = np.random.default_rng(0).choice(len(embeddings), min(sample, len(embeddings)), replace=False)
+    queries = embeddings[rows]
+
+    exact = faiss.IndexFlatIP(embeddings.shape[1]) if spec.get("metric") == "ip" \
+        else faiss.IndexFlatL2(embeddings.shape[1])
+    exact.add(embeddings)
+    _, expected = exact.search(queries, k + 1)
+    _, found = index.search(queries, k + 1)
+
+    ids = np.asarray(ids)
+    hits = 0
+    for row, want, got in zip(rows, expected, found):
+        want = [ids[r] for r in want if r >= 0 and r != row][:k]
+        got = [i for i in got if i >= 0 and i != ids[row]][:k]
+        hits += len(set(want) & set(got))
+    return hits / (k * len(rows))
+
+
+def write_faiss_index(index, path):
+    """Write an index next to the store, replacing any previous one atomically."""
+    tmp_path = path + ".tmp"
+    faiss.write_index(index, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def read_faiss_index(path):
+    """
+    Open a persisted index memory-mapped, so its vectors are paged in from the
+    file instead of copied onto the heap. Falls back to a regular read for
+    index types that don't support IO_FLAG_MMAP.
+    """
+    try:
+        return faiss.read_index(path, faiss.IO_FLAG_MMAP)
+    except RuntimeError:
+        return faiss.read_index(path)
+
+
+# ============================================================
+# Store read / write
+# ============================================================
+
+class Store:
+    """A loaded store: memory-mapped index and embeddings plus lazy chunk texts and sources."""
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        # Identifies this version of the store: rewrites replace meta.json
+        self.mtime = store_mtime(store_dir)
+        with open(os.path.join(store_dir, META_FILE), "r") as f:
+            self.meta = json.load(f)
+        self.embeddings = np.load(os.path.join(store_dir, EMBEDDINGS_FILE), mmap_mode="r")
+        ids_path = os.path.join(store_dir, IDS_FILE)
+        # Stores written before chunk ids existed use row numbers as ids
+        self.ids = np.load(ids_path, mmap_mode="r") if os.path.exists(ids_path) \
+            else np.arange(self.meta["count"], dtype=np.int64)
+        self.texts = StringTable(os.path.join(store_dir, "texts.bin"),
+                                 os.path.join(store_dir, "texts.offsets.npy"))
+        self.sources = StringTable(os.path.join(store_dir, "sources.bin"),
+                                   os.path.join(store_dir, "sources.offsets.npy"))
+
+        index_path = os.path.join(store_dir, INDEX_FILE)
+        if not os.path.exists(index_path):
+            # Stores written before the index was persisted: build it once
+            write_faiss_index(build_faiss_index(self.embeddings, self.ids), index_path)
+        self.index = read_faiss_index(index_path)
+        # Stores written before index specs existed hold a plain flat index
+        self.index_spec = self.meta.get("index")
+        if self.index_spec:
+            apply_search_params(self.index, self.index_spec)
+
+        self.chunks = ChunkView(self.texts, self.ids)
+        self.chunk_sources = ChunkView(self.sources, self.ids)
+        self.vectors = ChunkView(self.embeddings, self.ids)
+
+        self._lexical = None
+
+        manifest_path = os.path.join(store_dir, MANIFEST_FILE)
+        self.manifest = None
+        if os.path.exists(manifest_path):
+            with open(manifest_path, "r") as f:
+                self.manifest = json.load(f)
+
+    def __len__(self):
+        return len(self.texts)
+
+    @property
+    def lexical(self):
+        """BM25 index over the chunk texts, loaded on first use."""
+        if self._lexical is None:
+            if LexicalIndex.exists(self.store_dir):
+                self._lexical = LexicalIndex.load(self.store_dir, self.ids)
+            else:
+                # Stores written before the lexical index existed
+                self._lexical = LexicalIndex.build(self.texts, self.ids)
+        return self._lexical
+
+    def index_path(self):
+        return os.path.join(self.store_dir, INDEX_FILE)
+
+    def close(self):
+        """
+        Release the store's memory maps: the chunk text and source maps are
+        closed now, the FAISS index, embeddings and BM25 arrays as soon as
+        they are freed. The store can't be searched afterwards.
+        """
+        self.texts.close()
+        self.sources.close()
+        self.index = None
+        self._lexical = None
+        self.embeddings = self.ids = None
+        self.chunks = self.chunk_sources = self.vectors = None
+
+
+def write_store(store_dir, chunks, chunk_sources, embeddings, ids=None, index=None, manifest=None,
+                index_spec=None, **meta):
+    """
+    Write a store atomically: files go to a temp directory that replaces
+    store_dir only once complete, so readers never see a partial store.
+    `ids` must be ascending (defaults to row numbers). `index` is an already
+    updated index matching `index_spec`; if omitted one is built from the
+    embeddings. Extra keyword arguments are recorded in meta.json.
+    """
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    ids = np.arange(len(chunks), dtype=np.int64) if ids is None else np.asarray(ids, dtype=np.int64)
+    if index is None:
+        index_spec = resolve_index_spec(index_spec, len(chunks), embeddings.shape[1])
+        index = build_faiss_index(embeddings, ids, index_spec)
+    index_spec = index_spec or {"type": "flat"}
+    if index_spec.get("metric") == "ip":
+        embeddings = _prepare_vectors(embeddings, index_spec)
+    dtype = "float32" if index_spec.get("vectors", "float32") == "float32" else "float16"
+
+    recall = None
+    if index_spec["type"] != "flat" or dtype != "float32":
+        recall = measure_recall(index, embeddings, ids, index_spec)
+        if recall is not None:
+            _log(f"{os.path.basename(store_dir)}: recall@{RECALL_K} {recall:.3f} "
+                 f"({index_spec['type']}, {index_spec.get('vectors', 'float32')}) vs exact float32")
+
+    # Unique temp/old names: two processes may refresh the same store at once
+    parent = os.path.dirname(os.path.abspath(store_dir))
+    os.makedirs(parent, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(prefix=os.path.basename(store_dir) + ".tmp", dir=parent)
+
+    np.save(os.path.join(tmp_dir, EMBEDDINGS_FILE), embeddings.astype(dtype))
+    np.save(os.path.join(tmp_dir, IDS_FILE), ids)
+    _write_string_table(os.path.join(tmp_dir, "texts.bin"),
+                        os.path.join(tmp_dir, "texts.offsets.npy"), chunks)
+    _write_string_table(os.path.join(tmp_dir, "sources.bin"),
+                        os.path.join(tmp_dir, "sources.offsets.npy"), chunk_sources)
+    faiss.write_index(index, os.path.join(tmp_dir, INDEX_FILE))
+    LexicalIndex.build(chunks, ids).save(tmp_dir)
+    if manifest is not None:
+        with open(os.path.join(tmp_dir, MANIFEST_FILE), "w") as f:
+            json.dump(manifest, f)
+
+    meta = dict(meta)
+    meta.update({
+        "version": STORE_VERSION,
+        "count": len(chunks),
+        "dim": int(embeddings.shape[1]) if embeddings.ndim == 2 else 0,
+        "dtype": dtype,
+        "index": index_spec,
+        f"recall_at_{RECALL_K}": recall,
+    })
+    with open(os.path.join(tmp_dir, META_FILE), "w") as f:
+        json.dump(meta, f, indent=2)
+
+    old_dir = tmp_dir + ".old"
+    while True:
+        shutil.rmtree(old_dir, ignore_errors=True)
+        try:
+            os.rename(store_dir, old_dir)
+        except FileNotFoundError:
+            pass
+        try:
+            os.rename(tmp_dir, store_dir)
+            break
+        except OSError:
+            # Another writer swapped its store in between our two renames; replace it too
+            if not os.path.isdir(store_dir):
+                raise
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+
+def write_manifest(store_dir, manifest):
+    """Replace only the manifest of an existing store (e.g. refreshed file stats)."""
+    path = os.path.join(store_dir, MANIFEST_FILE)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f)
+    os.replace(path + ".tmp", path)
+
+
+def migrate_legacy_pickle(store_dir):
+    """Convert a legacy rag_store_*.pkl next to store_dir into the new format."""
+    pkl_path = store_dir + ".pkl"
+    with open(pkl_path, "rb") as f:
+        store = pickle.load(f)
+    write_store(store_dir, store["chunks"], store["chunk_sources"], store["embeddings"])
+    _log(f"Converted {pkl_path} to {store_dir}/ (the .pkl file can be deleted)")
+
+
+def load_store(store_dir):
+    """Open a store, converting a legacy pickle first if needed."""
+    if not os.path.exists(os.path.join(store_dir, META_FILE)) and os.path.exists(store_dir + ".pkl"):
+        migrate_legacy_pickle(store_dir)
+    return Store(store_dir)
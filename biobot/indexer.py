@@ -0,0 +1,238 @@
+"""
+Build and incrementally refresh handler stores for the BioBot RAG pipeline.
+
+Each store keeps a manifest of the documentation files it was built from:
+
+    {"chunk_size": 3000, "next_id": 812,
+     "files": {"v2/pipettes/loading.rst": {"sha256": ..., "size": ..., "mtime_ns": ...,
+                                          "ids": [17, 18, 19]}}}
+
+On refresh, only files that were added or whose content hash changed are
+re-parsed (doc_loader.load_and_chunk_file) and re-embedded. Chunks of edited
+or deleted files are removed from the ID-mapped FAISS index by chunk id, so
+refreshing a large docs tree costs roughly the size of the change. File
+size/mtime are checked first, so unchanged files are never even hashed.
+
+The index type comes from the handler's "index" spec (see
+index_store.resolve_index_spec). When the spec changes, the index is rebuilt
+from the stored embeddings; nothing is re-embedded.
+
+Usage:
+    store, stats = refresh_store(store_dir, docs_path, api_key, index_spec={"type": "hnsw"})
+    if docs_changed(store, docs_path): ...
+"""
+
+import os
+import sys
+import time
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+import numpy as np
+import faiss
+
+from doc_loader import iter_doc_files, load_and_chunk_file
+from embedder import embed_texts, EMBEDDING_MODEL
+from index_store import (
+    store_exists, load_store, write_store, write_manifest, build_faiss_index,
+    resolve_index_spec, index_spec_changed, update_faiss_index,
+)
+from rag_events import step
+
+
+def _log(msg):
+    print(msg, file=sys.stderr, flush=True)
+
+
+def file_digest(path):
+    """SHA-256 of a file's content."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def scan_docs(docs_path):
+    """Map each supported file (path relative to docs_path) to its full path, size and mtime."""
+    files = {}
+    for full_path in iter_doc_files(docs_path):
+        st = os.stat(full_path)
+        rel = os.path.relpath(full_path, docs_path)
+        files[rel] = {"path": full_path, "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+    return files
+
+
+def parse_files(paths, chunk_size, workers=1):
+    """
+    Parse and chunk files, in worker processes when workers > 1 (PDF and RST
+    parsing is CPU-bound). Returns one (chunks, sources) pair per path, in order.
+    """
+    if workers <= 1 or len(paths) <= 1:
+        return [load_and_chunk_file(path, chunk_size) for path in paths]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(load_and_chunk_file, paths, repeat(chunk_size), chunksize=4))
+
+
+def _same_stat(entry, info):
+    return entry.get("size") == info["size"] and entry.get("mtime_ns") == info["mtime_ns"]
+
+
+def docs_changed(store, docs_path):
+    """
+    Cheap check (stat only, no hashing) for files added, removed or touched
+    since the store was built. Stores without a manifest are never refreshed
+    automatically; rebuild them once to enable incremental updates.
+    """
+    if store.manifest is None:
+        return False
+    known = store.manifest["files"]
+    current = scan_docs(docs_path)
+    if current.keys() != known.keys():
+        return True
+    return any(not _same_stat(known[rel], info) for rel, info in current.items())
+
+
+def store_index_changed(store, index_spec):
+    """True if the store's index was built from a different spec than `index_spec`."""
+    return index_spec_changed(store.index_spec, index_spec, len(store), store.embeddings.shape[1])
+
+
+def refresh_store(store_dir, docs_path, api_key, chunk_size=3000, rebuild=False, embed_fn=embed_texts,
+                  index_spec=None, parse_workers=1):
+    """
+    Bring the store in line with the docs folder, embedding only new or changed files.
+    `index_spec` is the handler's "index" entry from handlers.json (None means auto).
+    Returns (store, stats); store is None if there is nothing to index.
+    stats = {"added": n, "changed": n, "removed": n, "unchanged": n, "chunks_embedded": n,
+             "timings": {"scan": s, "parse": s, "embed": s, "write": s}}
+    """
+    timings = {"scan": 0.0, "parse": 0.0, "embed": 0.0, "write": 0.0}
+    start = time.perf_counter()
+    old = load_store(store_dir) if store_exists(store_dir) and not rebuild else None
+    unchanged = False
+    try:
+        manifest = old.manifest if old is not None else None
+        if manifest is not None and manifest.get("chunk_size") != chunk_size:
+            _log(f"Chunk size changed ({manifest.get('chunk_size')} -> {chunk_size}), rebuilding {store_dir}")
+            manifest = None
+        if manifest is None and old is not None:
+            # No usable manifest: every file is treated as new
+            old.close()
+            old = None
+        if manifest is None:
+            manifest = {"files": {}, "next_id": 0}
+
+        old_files = manifest["files"]
+        next_id = manifest["next_id"]
+        current = scan_docs(docs_path)
+        stats = {"added": 0, "changed": 0, "removed": 0, "unchanged": 0, "chunks_embedded": 0,
+                 "timings": timings}
+
+        files = {}
+        to_index = []
+        stale_ids = []
+        for rel, info in current.items():
+            prev = old_files.get(rel)
+            if prev is not None and _same_stat(prev, info):
+                files[rel] = prev
+                stats["unchanged"] += 1
+                continue
+            digest = file_digest(info["path"])
+            if prev is not None and prev["sha256"] == digest:
+                # Touched but identical: only the recorded stat changes
+                files[rel] = dict(prev, size=info["size"], mtime_ns=info["mtime_ns"])
+                stats["unchanged"] += 1
+                continue
+            if prev is not None:
+                stale_ids.extend(prev["ids"])
+                stats["changed"] += 1
+            else:
+                stats["added"] += 1
+            to_index.append((rel, info, digest))
+
+        for rel, entry in old_files.items():
+            if rel not in current:
+                stale_ids.extend(entry["ids"])
+                stats["removed"] += 1
+
+        reindex = old is not None and store_index_changed(old, index_spec)
+        timings["scan"] = time.perf_counter() - start
+        if old is not None and not to_index and not stale_ids and not reindex:
+            if files != old_files:
+                write_manifest(store_dir, dict(manifest, files=files))
+            unchanged = True
+            return old, stats
+
+        # Parse and chunk only the new/changed files
+        start = time.perf_counter()
+        parsed = parse_files([info["path"] for _, info, _ in to_index], chunk_size, parse_workers)
+        new_chunks, new_sources, new_ids = [], [], []
+        for (rel, info, digest), (chunks, sources) in zip(to_index, parsed):
+            ids = list(range(next_id, next_id + len(chunks)))
+            next_id += len(chunks)
+            files[rel] = {"sha256": digest, "size": info["size"], "mtime_ns": info["mtime_ns"], "ids": ids}
+            new_chunks.extend(chunks)
+            new_sources.extend(sources)
+            new_ids.extend(ids)
+
+        timings["parse"] = time.perf_counter() - start
+        if old is None and not new_chunks:
+            return None, stats
+
+        start = time.perf_counter()
+        new_embeddings = embed_fn(new_chunks, api_key) if new_chunks else None
+        stats["chunks_embedded"] = len(new_chunks)
+        new_ids = np.array(new_ids, dtype=np.int64)
+        timings["embed"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+
+        if old is None:
+            texts, sources, ids, embeddings = new_chunks, new_sources, new_ids, new_embeddings
+        else:
+            # Keep every row whose file is unchanged; new ids are always larger, so order is preserved
+            keep = ~np.isin(np.asarray(old.ids), np.array(stale_ids, dtype=np.int64))
+            rows = np.nonzero(keep)[0]
+            texts = [old.texts[r] for r in rows] + new_chunks
+            sources = [old.sources[r] for r in rows] + new_sources
+            ids = np.concatenate([np.asarray(old.ids)[rows], new_ids])
+            parts = [np.asarray(old.embeddings[rows], dtype=np.float32)]
+            if new_embeddings is not None:
+                parts.append(new_embeddings)
+            embeddings = np.concatenate(parts)
+
+        spec = resolve_index_spec(index_spec, len(texts), embeddings.shape[1])
+        if old is not None and not reindex:
+            # Update the index in place instead of rebuilding (and retraining) it.
+            # Read without mmap: memory-mapped IVF lists are read-only.
+            spec = old.index_spec
+            index = update_faiss_index(faiss.read_index(old.index_path()), spec, stale_ids, new_embeddings, new_ids)
+            if index is None:
+                # HNSW can't delete vectors
+                index = build_faiss_index(embeddings, ids, spec)
+        else:
+            if reindex:
+                _log(f"Index spec changed, rebuilding {spec['type']} index for {store_dir}")
+            index = build_faiss_index(embeddings, ids, spec)
+
+    finally:
+        # Everything needed from the old store has been copied out by now;
+        # release its maps and files before they are overwritten
+        if old is not None and not unchanged:
+            old.close()
+
+    write_store(
+        store_dir, texts, sources, embeddings, ids=ids, index=index, index_spec=spec,
+        manifest={"files": files, "next_id": next_id, "chunk_size": chunk_size},
+        model=EMBEDDING_MODEL, chunk_size=chunk_size,
+    )
+
+    store = load_store(store_dir)
+    timings["write"] = time.perf_counter() - start
+    recall = store.meta.get("recall_at_5")
+    quality = f", recall@5 {recall:.2f}" if recall is not None else ""
+    step(f"Index ({spec['type']}) updated: {stats['added']} new, {stats['changed']} changed, "
+         f"{stats['removed']} removed files ({stats['chunks_embedded']} chunks embedded{quality})")
+    return store, stats
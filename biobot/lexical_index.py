@@ -0,0 +1,157 @@
+"""
+BM25 inverted index over chunk texts, used next to the FAISS index.
+
+Dense embeddings are weak on exact API identifiers (`pick_up_tip`,
+`load_labware`, `corning_96_wellplate_360ul_flat`), which protocol questions
+are full of. The lexical index matches them literally: identifiers are
+indexed whole and split into their parts, so both "pick_up_tip" and
+"pick up a tip" find the chunk.
+
+The index is saved inside the handler's store directory:
+    bm25.vocab.json        term -> [start, end) slice of the postings arrays
+    bm25.postings.npy      int32 row numbers, grouped by term
+    bm25.tf.npy            uint16 term frequency of each posting
+    bm25.doclen.npy        int32 token count of each row
+Arrays are memory-mapped; a query only touches the postings of its terms.
+
+Usage:
+    lexical = LexicalIndex.build(chunks, ids)
+    lexical.save(store_dir); lexical = LexicalIndex.load(store_dir, ids)
+    ids = lexical.search(question, k=20)
+    fused = reciprocal_rank_fusion(vector_ids, ids)   # [(chunk_id, score), ...]
+"""
+
+import os
+import re
+import json
+from collections import Counter, defaultdict
+
+import numpy as np
+
+
+VOCAB_FILE = "bm25.vocab.json"
+POSTINGS_FILE = "bm25.postings.npy"
+TF_FILE = "bm25.tf.npy"
+DOCLEN_FILE = "bm25.doclen.npy"
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+RRF_K = 60  # Reciprocal rank fusion: score = sum(1 / (RRF_K + rank))
+
+_WORD_RE = re.compile(r"[A-Za-z0-9_]+")
+_CAMEL_RE = re.compile(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+|[0-9]+")
+STOPWORDS = frozenset(
+    "a an and are as at be by can do for from how i in is it me my of on or "
+    "please should that the this to use using what when which with you".split()
+)
+
+
+def tokenize(text):
+    """
+    Lowercased word tokens. Identifiers are kept whole and also split on
+    underscores and camelCase: "loadLabware" -> loadlabware, load, labware.
+    """
+    tokens = []
+    for word in _WORD_RE.findall(text):
+        parts = [p for chunk in word.split("_") for p in _CAMEL_RE.findall(chunk)]
+        whole = word.lower().strip("_")
+        if whole and whole not in STOPWORDS:
+            tokens.append(whole)
+        if len(parts) > 1:
+            tokens.extend(p.lower() for p in parts if p.lower() not in STOPWORDS)
+    return tokens
+
+
+class LexicalIndex:
+    """BM25 over a store's rows; search returns chunk ids like the FAISS index."""
+
+    def __init__(self, vocab, postings, tf, doclen, ids):
+        self.vocab = vocab
+        self.postings = postings
+        self.tf = tf
+        self.doclen = doclen
+        self.ids = ids
+        self.avg_doclen = float(doclen.mean()) if len(doclen) else 0.0
+
+    @classmethod
+    def build(cls, texts, ids=None):
+        """Index texts in memory. `ids` gives the chunk id of each row (defaults to row numbers)."""
+        by_term = defaultdict(list)
+        doclen = np.zeros(len(texts), dtype=np.int32)
+        for row, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            doclen[row] = sum(counts.values())
+            for term, n in counts.items():
+                by_term[term].append((row, min(n, 65535)))
+
+        vocab, postings, tf = {}, [], []
+        for term in sorted(by_term):
+            start = len(postings)
+            for row, n in by_term[term]:
+                postings.append(row)
+                tf.append(n)
+            vocab[term] = [start, len(postings)]
+
+        ids = np.arange(len(texts), dtype=np.int64) if ids is None else np.asarray(ids, dtype=np.int64)
+        return cls(vocab, np.array(postings, dtype=np.int32), np.array(tf, dtype=np.uint16), doclen, ids)
+
+    def save(self, store_dir):
+        with open(os.path.join(store_dir, VOCAB_FILE), "w") as f:
+            json.dump(self.vocab, f)
+        np.save(os.path.join(store_dir, POSTINGS_FILE), self.postings)
+        np.save(os.path.join(store_dir, TF_FILE), self.tf)
+        np.save(os.path.join(store_dir, DOCLEN_FILE), self.doclen)
+
+    @staticmethod
+    def exists(store_dir):
+        return os.path.exists(os.path.join(store_dir, VOCAB_FILE))
+
+    @classmethod
+    def load(cls, store_dir, ids):
+        with open(os.path.join(store_dir, VOCAB_FILE), "r") as f:
+            vocab = json.load(f)
+        return cls(
+            vocab,
+            np.load(os.path.join(store_dir, POSTINGS_FILE), mmap_mode="r"),
+            np.load(os.path.join(store_dir, TF_FILE), mmap_mode="r"),
+            np.load(os.path.join(store_dir, DOCLEN_FILE)),
+            ids,
+        )
+
+    def __len__(self):
+        return len(self.doclen)
+
+    def search(self, query, k=20):
+        """Chunk ids of the k best BM25 matches for the query, best first."""
+        n_docs = len(self.doclen)
+        if not n_docs:
+            return []
+        scores = np.zeros(n_docs, dtype=np.float32)
+        for term in set(tokenize(query)):
+            span = self.vocab.get(term)
+            if span is None:
+                continue
+            rows = np.asarray(self.postings[span[0]:span[1]])
+            tf = np.asarray(self.tf[span[0]:span[1]], dtype=np.float32)
+            df = len(rows)
+            idf = np.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doclen[rows] / max(self.avg_doclen, 1e-9))
+            scores[rows] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+
+        matched = np.nonzero(scores)[0]
+        if not len(matched):
+            return []
+        top = matched[np.argsort(-scores[matched], kind="stable")[:k]]
+        return [int(self.ids[row]) for row in top]
+
+
+def reciprocal_rank_fusion(*rankings, k=RRF_K):
+    """
+    Merge ranked id lists: each id scores sum(1 / (k + rank)).
+    Returns (id, score) pairs, best first.
+    """
+    scores = defaultdict(float)
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking, start=1):
+            scores[chunk_id] += 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: -item[1])
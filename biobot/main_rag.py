@@ -1,51 +1,93 @@
+"""
+BioBot RAG pipeline.
+
+Importing this module has no side effects: every stage is a plain function
+taking the user's API key explicitly, so stages can be called (and profiled)
+individually. The whole pipeline runs through:
+
+- run_pipeline(query, history, api_key): reports progress through
+  rag_events (printed as STEP:/FORMAT:/FAILED_CODE: lines by default).
+- iter_pipeline(query, history, api_key): runs it on a thread and yields
+  the typed events (StepEvent, ReplyEvent, ResultEvent, FailedEvent, and a
+  TimingEvent for every timed stage and model call).
+
+Usage as a script (one-shot, used as a fallback by engine.py):
+    python3 main_rag.py '<question>' '<chat_history_json>' ['<triage_json>']
+"""
+
 import os
 import re
 import subprocess
+import tempfile
+import threading
+import queue
+import contextvars
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
-import faiss
 from datetime import datetime
 import time
 import json
-from openai import OpenAI
 import sys
-import pickle
 from config import get_api_key
 from doc_loader import load_and_chunk_docs
 from doc_fetcher import fetch_documentation
+from embedder import embed_texts, EMBEDDING_MODEL
+from embedding_cache import get_query_cache
+from index_store import (
+    store_dir_for, store_exists, store_mtime, load_store, build_faiss_index, resolve_index_spec,
+)
+from indexer import refresh_store, docs_changed, store_index_changed
+from lexical_index import LexicalIndex
+from context_packer import pack_context, DEFAULT_CONTEXT_TOKEN_BUDGET
+from retrieval import retrieve
+from index_manager import INDEX_MANAGER
+from handler_registry import load_handlers_config, register_handler
+from openai_clients import get_openai_client
+from triage import Triage
+from response_cache import cache_scope, cached_call
+from rag_events import (
+    step, emit, event_sink, current_sink, timed, timed_call,
+    StepEvent, ReplyEvent, ResultEvent, FailedEvent,
+)
 
-# ----------- ARGS & AUTH -------------
-if len(sys.argv) > 1:
-    user_query = sys.argv[1]
-    chat_history = json.loads(sys.argv[2]) if len(sys.argv) > 2 else []
-else:
-    raise ValueError("Usage: python3 main_rag.py '<question>' '<chat_history_json>'")
 
-user_api_key = get_api_key()
-if not user_api_key:
-    raise ValueError("API_KEY environment variable not set")
+# ----------- HANDLER DETECTION -------------
+def _keyword_pattern(keyword):
+    """Whole-word, case-insensitive pattern; 'ot-2' also matches 'OT 2' and 'ot2'."""
+    parts = [re.escape(part) for part in re.split(r"[\s\-]+", keyword.strip()) if part]
+    return re.compile(r"(?<!\w)" + r"[\s\-]?".join(parts) + r"(?!\w)", re.IGNORECASE)
 
 
-def get_openai_client(api_key):
-    return OpenAI(api_key=api_key)
+def _strong_keyword(handler_id, keyword):
+    """The handler id or a model number ('ot-2') names the platform; words like 'star' or 'flex' may not."""
+    return keyword.lower() == handler_id.lower() or any(c.isdigit() for c in keyword)
 
 
-# ----------- HANDLER DETECTION -------------
-HANDLERS_CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "handlers.json")
-
-def load_handlers_config():
-    """Load the handler registry from handlers.json."""
-    if not os.path.exists(HANDLERS_CONFIG_PATH):
-        return {
-            "opentrons": {
-                "name": "Opentrons",
-                "docs_path": "docs/opentrons",
-                "store_path": "rag_store_opentrons.pkl",
-                "simulate_cmd": ["opentrons_simulate"],
-                "keywords": ["opentrons", "ot-2", "ot2", "ot-3", "ot3", "flex"]
-            }
-        }
-    with open(HANDLERS_CONFIG_PATH, "r") as f:
-        return json.load(f)
+def match_handler_keywords(query, history, handlers):
+    """
+    Find the handler from the "keywords" of handlers.json, without a model call.
+    The latest message is searched first, then the user's recent messages.
+    Returns (handler_id, confident): handler_id is set when exactly one handler
+    matches, and confident when the match is also strong enough to skip LLM
+    detection (a strong keyword, or two different keywords of the handler).
+    Returns (None, False) when nothing or several handlers match.
+    """
+    recent = [m["content"] for m in history if m["role"] == "user"][-8:]
+    for texts in ([query], recent[::-1]):
+        matched = {}
+        for handler_id, cfg in handlers.items():
+            keywords = {kw for kw in cfg.get("keywords", []) + [handler_id]
+                        if any(_keyword_pattern(kw).search(text) for text in texts)}
+            if keywords:
+                matched[handler_id] = keywords
+        if len(matched) > 1:
+            return None, False
+        if matched:
+            (handler_id, keywords), = matched.items()
+            confident = len(keywords) > 1 or any(_strong_keyword(handler_id, kw) for kw in keywords)
+            return handler_id, confident
+    return None, False
 
 
 def detect_handler(query, history, api_key):
@@ -55,6 +97,15 @@ def detect_handler(query, history, api_key):
     the doc fetcher can find and download its documentation.
     """
     handlers = load_handlers_config()
+    return resolve_platform(detect_platform(query, history, api_key, handlers), handlers, api_key)
+
+
+def detect_platform(query, history, api_key, handlers):
+    """
+    Ask the LLM which platform the conversation is about. Returns a handler id
+    from `handlers`, a new lowercase platform id, or "unknown"; nothing is
+    registered (see resolve_platform).
+    """
     available_ids = list(handlers.keys())
     client = get_openai_client(api_key)
 
@@ -74,7 +125,7 @@ def detect_handler(query, history, api_key):
     else:
         known_list = "  (none configured)"
 
-    response = client.responses.create(
+    answer = cached_call("detect", client.responses.create,
         model="gpt-5.4",
         input=[
             {
@@ -107,7 +158,21 @@ Return ONLY the platform ID. One word, lowercase, no quotes, no explanation."""
         ]
     )
 
-    detected = response.output_text.strip().lower().strip('"').replace(" ", "_")
+    return answer.lower().strip('"').replace(" ", "_")
+
+
+def is_new_platform(detected, handlers):
+    """Whether resolve_platform() would register `detected` as a new handler."""
+    return detected not in handlers and (detected != "unknown" or not handlers)
+
+
+def resolve_platform(detected, handlers, api_key):
+    """
+    Turn a detected platform id into (handler_id, handlers). "unknown" falls
+    back to the first configured handler; a platform not in handlers.json
+    gets a dynamic entry so the doc fetcher can find its documentation.
+    """
+    available_ids = list(handlers.keys())
 
     # Known handler — return directly
     if detected in available_ids:
@@ -120,7 +185,8 @@ Return ONLY the platform ID. One word, lowercase, no quotes, no explanation."""
         detected = "opentrons"
 
     # New handler — ask the LLM for the proper display name
-    name_response = client.responses.create(
+    client = get_openai_client(api_key)
+    name_response = timed_call("platform_name", client.responses.create,
         model="gpt-5.4",
         input=[
             {
@@ -135,32 +201,37 @@ Return ONLY the platform ID. One word, lowercase, no quotes, no explanation."""
     )
     handler_name = name_response.output_text.strip().strip("'\"")
 
-    print(f"STEP:Detected new platform: {handler_name} (not in config — will search for docs)...", flush=True)
-    time.sleep(2)
+    step(f"Detected new platform: {handler_name} (not in config — will search for docs)...")
 
-    handlers[detected] = {
+    handler_config = {
         "name": handler_name,
         "docs_path": f"docs/{detected}",
-        "store_path": f"rag_store_{detected}.pkl",
+        "store_path": f"rag_store_{detected}",
         "simulate_cmd": None,
         "validation_strategy": "llm_review",
         "output_type": "file",
-        "keywords": [detected]
+        "keywords": [detected],
+        "index": {"type": "auto"},
+        "context_token_budget": DEFAULT_CONTEXT_TOKEN_BUDGET
     }
 
     # Save to handlers.json so it persists across sessions
     try:
-        with open(HANDLERS_CONFIG_PATH, "w") as f:
-            json.dump(handlers, f, indent=4)
-        print(f"STEP:Added {handler_name} to handlers config", flush=True)
+        handlers = register_handler(detected, handler_config)
+        step(f"Added {handler_name} to handlers config")
     except Exception as e:
-        print(f"WARNING: Could not save to handlers.json: {e}", flush=True)
+        print(f"WARNING: Could not save to handlers.json: {e}", file=sys.stderr, flush=True)
+        handlers[detected] = handler_config
 
     return detected, handlers
 
 
 # ----------- SUFFICIENCY CHECK -------------
 def check_sufficient_info(query, history, api_key):
+    """
+    Ask the LLM whether the conversation holds enough detail to write the protocol.
+    Returns None if it does, otherwise the follow-up question for the user.
+    """
     client = get_openai_client(api_key)
 
     recent = [m for m in history if m["role"] != "system"][-8:]
@@ -169,7 +240,7 @@ def check_sufficient_info(query, history, api_key):
         for m in recent
     )
 
-    response = client.responses.create(
+    response = timed_call("sufficiency", client.responses.create,
         model="gpt-4o-mini",
         input=[
             {
@@ -192,8 +263,8 @@ If the user asks you to use a default set up, complete a setup, choose some para
 
     answer = response.output_text.strip()
     if answer != "SUFFICIENT":
-        print(answer, flush=True)
-        sys.exit(0)
+        return answer
+    return None
 
 
 def consolidate_request(query, history, api_key):
@@ -205,7 +276,7 @@ def consolidate_request(query, history, api_key):
         for m in recent
     )
 
-    response = client.responses.create(
+    return cached_call("consolidate", client.responses.create,
         model="gpt-4o-mini",
         input=[
             {
@@ -224,16 +295,15 @@ Return ONLY the consolidated request. No preamble, no explanation."""
             }
         ]
     )
-    return response.output_text.strip()
 
 
 # ----------- EMBEDDINGS -------------
-def get_text_embedding_with_retry(text, retries=5, delay=2):
-    client = get_openai_client(user_api_key)
+def get_text_embedding_with_retry(text, api_key, retries=5, delay=2):
+    client = get_openai_client(api_key)
     for i in range(retries):
         try:
-            response = client.embeddings.create(
-                model="text-embedding-3-small",
+            response = timed_call("query_embedding", client.embeddings.create,
+                model=EMBEDDING_MODEL,
                 input=text
             )
             return response.data[0].embedding
@@ -247,9 +317,25 @@ def get_text_embedding_with_retry(text, retries=5, delay=2):
     raise RuntimeError("Failed to get embedding after retries.")
 
 
+def get_question_embedding(question, api_key):
+    """
+    Embedding of the retrieval question, served from the query cache when the
+    same (normalized) question was embedded recently, e.g. on a retry.
+    """
+    cache = get_query_cache()
+    if cache is not None:
+        vector = cache.get(EMBEDDING_MODEL, question)
+        if vector is not None:
+            return vector
+    vector = get_text_embedding_with_retry(question, api_key)
+    if cache is not None:
+        cache.put(EMBEDDING_MODEL, question, vector)
+    return vector
+
+
 # ----------- COMPLETION -------------
-def run_gpt(user_message, model="gpt-5.4"):
-    client = get_openai_client(user_api_key)
+def run_gpt(user_message, api_key, model="gpt-5.4", stage="generate"):
+    client = get_openai_client(api_key)
     messages = [
         {
             "role": "system",
@@ -260,7 +346,7 @@ def run_gpt(user_message, model="gpt-5.4"):
             "content": user_message
         }
     ]
-    response = client.responses.create(
+    response = timed_call(stage, client.responses.create,
         model=model,
         input=messages
     )
@@ -269,20 +355,32 @@ def run_gpt(user_message, model="gpt-5.4"):
 
 # ----------- VALIDATION STRATEGIES -------------
 
-def validate_simulation(code, handler_config, save_path="generated_script.py"):
+def validate_simulation(code, handler_config, save_path=None):
     """
     Strategy: SIMULATION
     Run the handler's simulator tool against the generated code.
+    Without a save_path the code goes to a private temp file, so concurrent
+    in-process pipelines never overwrite each other's script.
     Returns (passed: bool, feedback: str)
     """
     simulate_cmd = handler_config.get("simulate_cmd")
     if not simulate_cmd:
         return True, ""
 
-    with open(save_path, "w") as f:
-        f.write(code)
-
-    result = subprocess.run(simulate_cmd + [save_path], capture_output=True, text=True)
+    if save_path:
+        with open(save_path, "w") as f:
+            f.write(code)
+        with timed("simulate"):
+            result = subprocess.run(simulate_cmd + [save_path], capture_output=True, text=True)
+    else:
+        with tempfile.NamedTemporaryFile("w", suffix=".py", prefix="generated_script_", delete=False) as f:
+            f.write(code)
+            tmp_path = f.name
+        try:
+            with timed("simulate"):
+                result = subprocess.run(simulate_cmd + [tmp_path], capture_output=True, text=True)
+        finally:
+            os.unlink(tmp_path)
     stdout, stderr = result.stdout, result.stderr
 
     if "Error" not in stderr and "Traceback" not in stderr and stdout.strip():
@@ -291,7 +389,7 @@ def validate_simulation(code, handler_config, save_path="generated_script.py"):
         return False, stderr.strip()
 
 
-def validate_llm_review(code, handler_config, context_chunks, question):
+def validate_llm_review(code, handler_config, context_chunks, question, api_key):
     """
     Strategy: LLM_REVIEW
     Ask the LLM to review the generated code against the handler's documentation,
@@ -302,8 +400,8 @@ def validate_llm_review(code, handler_config, context_chunks, question):
     output_type = handler_config.get("output_type", "script")
 
 
-    client = get_openai_client(user_api_key)
-    response = client.responses.create(
+    client = get_openai_client(api_key)
+    response = timed_call("review", client.responses.create,
         model="gpt-5.4",
         tools=[{"type": "web_search"}],
         input=[
@@ -341,7 +439,7 @@ Don't be strict and accurate. Minor issues are not failures. Focus on big issues
         return False, feedback
 
 
-def validate_code(code, handler_config, context_chunks, question, save_path="generated_script.py"):
+def validate_code(code, handler_config, context_chunks, question, api_key, save_path=None):
     """
     Unified validation dispatcher.
     Routes to the correct strategy based on handler_config["validation_strategy"].
@@ -352,15 +450,15 @@ def validate_code(code, handler_config, context_chunks, question, save_path="gen
     if strategy == "simulation":
         return validate_simulation(code, handler_config, save_path)
     elif strategy == "llm_review":
-        return validate_llm_review(code, handler_config, context_chunks, question)
+        return validate_llm_review(code, handler_config, context_chunks, question, api_key)
     else:
         # Unknown strategy — fall back to LLM review
-        print(f"WARNING: Unknown validation strategy '{strategy}', using llm_review", flush=True)
-        return validate_llm_review(code, handler_config, context_chunks, question)
+        print(f"WARNING: Unknown validation strategy '{strategy}', using llm_review", file=sys.stderr, flush=True)
+        return validate_llm_review(code, handler_config, context_chunks, question, api_key)
 
 
 # ----------- REVERSE CHECK -------------
-def reverse_check(user_query, generated_code, handler_name):
+def reverse_check(user_query, generated_code, handler_name, api_key):
     """
     Verify if the generated code actually matches the user's intention.
     """
@@ -378,7 +476,7 @@ def reverse_check(user_query, generated_code, handler_name):
     Answer strictly with "Yes" or "No", followed by a short explanation.
     If the answer is no, ALWAYS suggest a corrected script right after.
     """
-    verdict = run_gpt(reverse_prompt).strip()
+    verdict = run_gpt(reverse_prompt, api_key, stage="reverse_check").strip()
     return verdict
 
 
@@ -386,22 +484,72 @@ def reverse_check(user_query, generated_code, handler_name):
 # Resolve all paths relative to this script's directory
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 
-def load_or_build_index(handler_id, handler_config, chunk_size=3000):
+# What retrieval needs for one handler; all per-chunk fields are addressed by chunk id
+HandlerIndex = namedtuple("HandlerIndex", "chunks chunk_sources index lexical vectors")
+NO_INDEX = HandlerIndex([], [], None, None, None)
+
+
+def load_or_build_index(handler_id, handler_config, api_key, chunk_size=3000):
     """
-    Load the FAISS index for a handler from its pickle store,
-    or build it from the docs folder if it doesn't exist.
+    Retrieval index for a handler. Stores already opened by this process are
+    reused from INDEX_MANAGER (index_manager.py), which loads them on first
+    use and evicts the least recently used under the memory budget. Only
+    useful for long-lived processes (rag_worker.py, the web app running the
+    pipeline in-process); a one-shot script run starts empty.
+    """
+    return INDEX_MANAGER.get(
+        handler_id, lambda cached: _load_handler_index(handler_config, api_key, chunk_size, cached)
+    )
+
+
+def acquire_index(handler_id, handler_config, api_key, chunk_size=3000):
+    """
+    load_or_build_index() for a request: returns (HandlerIndex, release).
+    The store stays open, even if evicted meanwhile, until release() is called.
+    """
+    return INDEX_MANAGER.acquire(
+        handler_id, lambda cached: _load_handler_index(handler_config, api_key, chunk_size, cached)
+    )
+
+
+def _load_handler_index(handler_config, api_key, chunk_size, cached):
+    """
+    Open the persisted FAISS index for a handler from its memory-mapped store
+    (see index_store.py), or build it from the docs folder if it doesn't exist.
+    If files in the docs folder were added, edited or removed since the store
+    was built, only those are re-indexed (see indexer.py). The index type
+    follows the handler's "index" spec; editing it rebuilds the index only.
+    Chunk texts, sources and vectors are lazy views addressed by the chunk
+    ids both the FAISS index and the BM25 index (lexical_index.py) return:
+    only the items accessed are read.
+    `cached` is the store this process loaded before, reused unless it changed.
+    Returns (HandlerIndex, store to keep loaded or None).
     """
     docs_path = os.path.join(SCRIPT_DIR, handler_config["docs_path"])
-    store_path = os.path.join(docs_path, handler_config["store_path"])
-
-    if os.path.exists(store_path):
-        print(f"STEP:Loading {handler_config['name']} documentation index...", flush=True)
-        time.sleep(1)
-        with open(store_path, "rb") as f:
-            store = pickle.load(f)
-        chunks = store["chunks"]
-        chunk_sources = store["chunk_sources"]
-        text_embeddings = store["embeddings"]
+    store_dir = store_dir_for(docs_path, handler_config["store_path"])
+    index_spec = handler_config.get("index")
+
+    store = None
+    if cached is not None and store_exists(store_dir) and store_mtime(store_dir) == cached.mtime:
+        store = cached
+    elif store_exists(store_dir):
+        step(f"Loading {handler_config['name']} documentation index...")
+        store = load_store(store_dir)
+        cached = None
+
+    if store is not None:
+        if docs_changed(store, docs_path):
+            step(f"{handler_config['name']} documentation changed — updating index...")
+            store, _ = refresh_store(store_dir, docs_path, api_key, chunk_size, index_spec=index_spec)
+            if store is None:
+                return NO_INDEX, None
+        elif store_index_changed(store, index_spec):
+            step(f"Rebuilding {handler_config['name']} index for the new index settings...")
+            store, _ = refresh_store(store_dir, docs_path, api_key, chunk_size, index_spec=index_spec)
+            if store is None:
+                return NO_INDEX, None
+        elif cached is not None:
+            step(f"Using loaded {handler_config['name']} documentation index...")
     else:
         # Check if docs folder exists and has content (including subfolders)
         has_local_docs = False
@@ -418,54 +566,105 @@ def load_or_build_index(handler_id, handler_config, chunk_size=3000):
             # No local docs — try to fetch from the web
             handler_name = handler_config["name"]
             handler_keywords = handler_config.get("keywords", [])
-            fetched = fetch_documentation(handler_name, handler_keywords, docs_path, user_api_key)
+            with timed("doc_fetch"):
+                fetched = fetch_documentation(handler_name, handler_keywords, docs_path, api_key)
 
             if not fetched:
-                print(f"STEP:Could not obtain documentation for {handler_name}", flush=True)
-                time.sleep(2)
-                return [], [], None
+                step(f"Could not obtain documentation for {handler_name}")
+                return NO_INDEX, None
 
-        print(f"STEP:Building {handler_config['name']} documentation index...", flush=True)
-        chunks, chunk_sources = load_and_chunk_docs(docs_path, chunk_size)
+        step(f"Building {handler_config['name']} documentation index...")
+        try:
+            store, _ = refresh_store(store_dir, docs_path, api_key, chunk_size, index_spec=index_spec)
+        except OSError as e:
+            # Read-only docs folder: index in memory for this request only
+            print(f"WARNING: Could not save index: {e}", file=sys.stderr, flush=True)
+            chunks, chunk_sources = load_and_chunk_docs(docs_path, chunk_size)
+            if not chunks:
+                step(f"No parseable documents found in {docs_path}")
+                return NO_INDEX, None
+            embeddings = embed_texts(chunks, api_key)
+            spec = resolve_index_spec(index_spec, len(chunks), embeddings.shape[1])
+            return HandlerIndex(chunks, chunk_sources, build_faiss_index(embeddings, spec=spec),
+                                LexicalIndex.build(chunks), embeddings), None
+
+        if store is None or not len(store):
+            step(f"No parseable documents found in {docs_path}")
+            return NO_INDEX, None
+        step(f"Index saved to {store_dir}")
+
+    return HandlerIndex(store.chunks, store.chunk_sources, store.index, store.lexical, store.vectors), store
+
+
+def preload_indexes(api_key=None):
+    """
+    Load every configured handler index that already has a store on disk, so
+    processes forked afterwards (rag_worker.py children, gunicorn --preload
+    workers) share its pages instead of each loading its own copy. Missing
+    stores are left to be built lazily by the first request that needs them.
+    Returns the ids of the handlers loaded.
+    """
+    loaded = []
+    for handler_id, handler_config in load_handlers_config().items():
+        docs_path = os.path.join(SCRIPT_DIR, handler_config["docs_path"])
+        if not store_exists(store_dir_for(docs_path, handler_config["store_path"])):
+            continue
+        try:
+            # Progress events have no client to go to
+            with event_sink(lambda event: None):
+                load_or_build_index(handler_id, handler_config, api_key)
+            loaded.append(handler_id)
+        except Exception as e:
+            print(f"WARNING: Could not preload {handler_id}: {e}", file=sys.stderr, flush=True)
+    return loaded
 
-        if not chunks:
-            print(f"STEP:No parseable documents found in {docs_path}", flush=True)
-            time.sleep(2)
-            return [], [], None
 
-        text_embeddings = np.array([get_text_embedding_with_retry(chunk) for chunk in chunks])
+def prefetch_index(handler_id, handler_config):
+    """
+    Start opening a handler's index on a background thread, when a guess at
+    the handler can be made before it is confirmed. Only a store already on
+    disk is opened, as it is: checking it against the docs folder, and any
+    building (embedding, doc fetching), is left to the request that actually
+    needs the index. A request for the same handler waits for this load in
+    INDEX_MANAGER and then reuses the store, after checking it.
+    """
+    docs_path = os.path.join(SCRIPT_DIR, handler_config["docs_path"])
+    store_dir = store_dir_for(docs_path, handler_config["store_path"])
+    if not store_exists(store_dir):
+        return
 
-        # Save the index for future use
-        os.makedirs(os.path.dirname(store_path), exist_ok=True)
+    def _load():
         try:
-            with open(store_path, "wb") as f:
-                pickle.dump({
-                    "chunks": chunks,
-                    "chunk_sources": chunk_sources,
-                    "embeddings": text_embeddings
-                }, f)
-            print(f"STEP:Index saved to {store_path}", flush=True)
+            INDEX_MANAGER.preload(handler_id, lambda: load_store(store_dir))
         except Exception as e:
-            print(f"WARNING: Could not save index: {e}", flush=True)
-
-    d = text_embeddings.shape[1]
-    index = faiss.IndexFlatL2(d)
-    index.add(text_embeddings)
+            print(f"WARNING: Could not prefetch {handler_id} index: {e}", file=sys.stderr, flush=True)
 
-    return chunks, chunk_sources, index
+    threading.Thread(target=_load, name=f"prefetch-{handler_id}", daemon=True).start()
 
 
 # ----------- MAIN PIPELINE -------------
-def run_query_and_fix(question, chunks, chunk_sources, index, handler_config, max_attempts=3):
-    print("STEP:Analyzing your request...", flush=True)
-    question_embedding = np.array([get_text_embedding_with_retry(question)])
-
-    print("STEP:Searching documentation for relevant context...", flush=True)
-    D, I = index.search(question_embedding, k=5)
-    retrieved_chunks = [chunks[i] for i in I.tolist()[0]]
-    retrieved_sources = [chunk_sources[i] for i in I.tolist()[0]]
+def run_query_and_fix(question, chunks, chunk_sources, index, handler_config, api_key, max_attempts=3,
+                      lexical=None, vectors=None):
+    step("Analyzing your request...")
+    question_embedding = np.array([get_question_embedding(question, api_key)], dtype=np.float32)
+
+    step("Searching documentation for relevant context...")
+    with timed("retrieval"):
+        hits = retrieve(question, question_embedding, index, lexical, chunks, vectors)
+    packed = pack_context(
+        [chunks[i] for i, _ in hits],
+        [chunk_sources[i] for i, _ in hits],
+        [score for _, score in hits],
+        budget=handler_config.get("context_token_budget", DEFAULT_CONTEXT_TOKEN_BUDGET),
+        min_score_ratio=handler_config.get("context_min_score_ratio", 0.0),
+    )
+    retrieved_chunks = packed.chunks
+    retrieved_sources = packed.sources
+    step(f"Using {len(packed.chunks)} documentation passages ({packed.tokens} tokens"
+         + (f", {packed.dropped} dropped" if packed.dropped else "")
+         + (", last one trimmed" if packed.trimmed else "") + ")")
 
-    context = "\n\n".join(retrieved_chunks)
+    context = packed.text
     handler_name = handler_config["name"]
     strategy = handler_config.get("validation_strategy", "llm_review")
     output_type = handler_config.get("output_type", "script")
@@ -485,7 +684,7 @@ Given the context information and/or prior knowledge, answer the query.
 Generate a complete, functional {output_type} script for the {handler_name} platform.
 Query: {question}
 """
-    print("STEP:Generating protocol...", flush=True)
+    step("Generating protocol...")
     last_error = ""
     last_code = ""
 
@@ -494,12 +693,12 @@ Query: {question}
     for attempt in range(1, max_attempts + 1):
         
         if attempt == 1:
-            response = run_gpt(prompt_nodoc)
+            response = run_gpt(prompt_nodoc, api_key, stage="generate")
             code = response
         
         else:
             
-            response = run_gpt(prompt)
+            response = run_gpt(prompt, api_key, stage="fix")
             code = response
             
         if not code:
@@ -507,31 +706,28 @@ Query: {question}
 
         last_code = code
 
-        print(f"STEP:Attempt {attempt} — validating via {strategy_label}...", flush=True)
-        time.sleep(1)
-        passed, feedback = validate_code(code, handler_config, retrieved_chunks, question)
+        step(f"Attempt {attempt} — validating via {strategy_label}...")
+        passed, feedback = validate_code(code, handler_config, retrieved_chunks, question, api_key)
 
         if passed and strategy_label == "simulation":
-            print("STEP:Validation passed — verifying semantic intent...", flush=True)
-            verdict = reverse_check(question, code, handler_name)
+            step("Validation passed — verifying semantic intent...")
+            verdict = reverse_check(question, code, handler_name, api_key)
             blocks = re.findall(r"```(?:\w*)\n(.*?)```", verdict, re.DOTALL)
             if blocks:
                 suggested_code = blocks[0].strip()
                 # Re-validate the suggested code too
-                passed2, _ = validate_code(suggested_code, handler_config, retrieved_chunks, question)
+                passed2, _ = validate_code(suggested_code, handler_config, retrieved_chunks, question, api_key)
                 if passed2:
                     code = suggested_code
-            print("STEP:All checks passed! Returning final code...", flush=True)
-            time.sleep(2)
+            step("All checks passed! Returning final code...")
             return code, retrieved_chunks, retrieved_sources, attempt, "", code
         
         if passed:
-            print("STEP:All checks passed! Returning final code...", flush=True)
-            time.sleep(2)
+            step("All checks passed! Returning final code...")
             return code, retrieved_chunks, retrieved_sources, attempt, "", code
             
 
-        print(f"STEP:Validation failed on attempt {attempt} — correcting errors...", flush=True)
+        step(f"Validation failed on attempt {attempt} — correcting errors...")
         prompt = f"""
 The following {output_type} output for the {handler_name} platform has issues:
 
@@ -550,42 +746,13 @@ Do not ask me to complete anything — return the complete, working output file.
     return None, retrieved_chunks, retrieved_sources, attempt, last_error, last_code
 
 
-# ============================================================
-# EXECUTION
-# ============================================================
-
-# 1. Check if we have enough info (skip for one-shot mode)
-if not os.environ.get("BIOBOT_SKIP_SUFFICIENT_CHECK"):
-    check_sufficient_info(user_query, chat_history, user_api_key)
-
-# 2. Consolidate the request
-consolidated_query = consolidate_request(user_query, chat_history, user_api_key)
-
-# 3. Detect which handler the user needs
-handler_id, handlers = detect_handler(user_query, chat_history, user_api_key)
-handler_config = handlers[handler_id]
-print(f"STEP:Detected platform: {handler_config['name']}", flush=True)
-time.sleep(1)
-
-# 4. Load or build the index for this handler
-chunks, chunk_sources, index = load_or_build_index(handler_id, handler_config)
-
-if index is None or not chunks:
-    print(f"STEP:No documentation available for {handler_config['name']}. "
-          f"Please add documents to {handler_config['docs_path']}/", flush=True)
-    # Give the user a friendly message as the final output
-    print(f"I couldn't find any documentation for {handler_config['name']}. "
-          f"To generate accurate protocols, please add documentation files "
-          f"(PDF, RST, or TXT) to the {handler_config['docs_path']}/ folder.", flush=True)
-    sys.exit(0)
-
-# 5. Run the RAG pipeline
-final_code, sources_used, file_refs, attempts, last_error, last_code = \
-    run_query_and_fix(consolidated_query, chunks, chunk_sources, index, handler_config)
-
-if final_code:
-    # Detect the output format from the content
-    content = final_code.strip()
+# ----------- OUTPUT FORMAT -------------
+def detect_output_format(code):
+    """
+    Detect the format of a generated artifact and strip markdown fences.
+    Returns (fmt, content).
+    """
+    content = code.strip()
 
     # Priority 1: Check if the LLM wrapped the output in markdown fences (```format ... ```)
     fence_match = re.match(r'^```(\w+)\s*\n([\s\S]*?)```\s*$', content)
@@ -609,14 +776,256 @@ if final_code:
         else:
             fmt = "text"
 
-    print(f"FORMAT:{fmt}", flush=True)
-    print(content)
-else:
-    print("STEP:Generation failed — preparing last attempt for review...", flush=True)
-    time.sleep(2)
-    fail_msg = (
-        "I wasn't able to generate a fully functional script after several attempts. "
-        "The simulation kept returning errors that I couldn't resolve automatically. "
-        "Here is the latest version of the script I generated — it may need some manual adjustments:"
-    )
-    print("FAILED_CODE:" + fail_msg + "___CODE_SEP___" + (last_code or "# No code was generated."), flush=True)
\ No newline at end of file
+    return fmt, content
+
+
+# ============================================================
+# EXECUTION
+# ============================================================
+
+class _StageGate:
+    """
+    Event sink for the stages run speculatively next to the sufficiency check.
+    Their progress steps are held back until the check passes (open), so a
+    follow-up question isn't preceded by "Loading index..." noise; once the
+    request is abandoned (close) nothing gets through, so late events can't
+    leak into whatever the output stream carries next. Timing events pass
+    while the gate is pending. Stages check `closed` before anything with
+    side effects, and wait_open() before what must only happen for a request
+    that goes ahead.
+    """
+
+    def __init__(self, sink):
+        self._sink = sink
+        self._lock = threading.Lock()
+        self._held = []
+        self._state = "pending"
+        self._settled = threading.Event()
+
+    def emit(self, event):
+        with self._lock:
+            if self._state == "closed":
+                return
+            if self._state == "pending" and isinstance(event, StepEvent):
+                self._held.append(event)
+                return
+            self._sink(event)
+
+    def open(self):
+        with self._lock:
+            self._state = "open"
+            for event in self._held:
+                self._sink(event)
+            self._held = []
+        self._settled.set()
+
+    def close(self):
+        with self._lock:
+            self._state = "closed"
+            self._held = []
+        self._settled.set()
+
+    @property
+    def closed(self):
+        return self._state == "closed"
+
+    def wait_open(self):
+        """Block until the gate is opened or closed; True if the request goes ahead."""
+        self._settled.wait()
+        return self._state == "open"
+
+    def run(self, fn, *args):
+        """Call fn(*args) with this gate as the event sink (on a pool thread)."""
+        with event_sink(self.emit):
+            return fn(*args)
+
+    def submit(self, pool, fn, *args):
+        """Run fn(*args) on the pool, in a copy of the caller's context (cache scope) behind this gate."""
+        return pool.submit(contextvars.copy_context().run, self.run, fn, *args)
+
+
+def _detect_and_load_index(user_query, chat_history, api_key, gate, platform=None):
+    """
+    Detect the handler, then load its index unless the request was abandoned
+    meanwhile. A confident keyword match skips LLM detection; a weaker one
+    still goes to the LLM, but its index is prefetched in the meantime.
+    `platform` is the id already detected by the triage call, if any.
+    A platform not configured yet is only registered (a model call for its
+    name, a handlers.json write) once the sufficiency check has passed.
+    Returns (handler_config, HandlerIndex, release) where release() gives the
+    index back to INDEX_MANAGER, or None if the request was abandoned.
+    """
+    handlers = load_handlers_config()
+    handler_id, confident = match_handler_keywords(user_query, chat_history, handlers)
+    if platform is None and not confident:
+        if gate.closed:
+            return None
+        if handler_id:
+            prefetch_index(handler_id, handlers[handler_id])
+        platform = detect_platform(user_query, chat_history, api_key, handlers)
+    # A confident keyword match wins over the triage call's platform; a weaker one only when it found none
+    if platform is not None and not confident and (platform != "unknown" or not handler_id):
+        if is_new_platform(platform, handlers) and not gate.wait_open():
+            return None
+        if gate.closed:
+            return None
+        handler_id, handlers = resolve_platform(platform, handlers, api_key)
+
+    handler_config = handlers[handler_id]
+    if gate.closed:
+        return None
+    step(f"Detected platform: {handler_config['name']}")
+    with timed("index_load"):
+        return (handler_config,) + acquire_index(handler_id, handler_config, api_key)
+
+
+def _release_abandoned_index(future):
+    """Done-callback of a detection stage whose index the pipeline never took over."""
+    if future.cancelled() or future.exception() is not None:
+        return
+    detected = future.result()
+    if detected is not None:
+        detected[2]()
+
+
+def run_pipeline(user_query, chat_history, api_key, skip_sufficient_check=None, triage=None, enc_key=None):
+    """
+    Run the whole pipeline for one request. Progress and the final artifact
+    are reported through rag_events (printed as the stdout line protocol
+    unless an event_sink is active).
+
+    The sufficiency check, request consolidation and handler detection only
+    read the query and history, so they run concurrently, and the handler's
+    index is loaded as soon as detection returns, overlapping the other model
+    calls. If the sufficiency check asks for more information, the other
+    stages are abandoned: their events are dropped, and the steps with side
+    effects that have not started yet are skipped (registering a new
+    platform, prefetching or loading an index, fetching docs, building a
+    store). Model calls already in flight can't be cancelled: they finish in
+    the background and are still billed.
+
+    `triage` is the triage.Triage of the combined call made by engine.py: its
+    sufficiency verdict, consolidated request and platform replace those
+    three model calls. `enc_key` is the user's session key, which encrypts
+    their entries in the response cache (see response_cache.py).
+    """
+    if skip_sufficient_check is None:
+        skip_sufficient_check = bool(os.environ.get("BIOBOT_SKIP_SUFFICIENT_CHECK"))
+
+    if triage is not None and triage.follow_up:
+        if not skip_sufficient_check:
+            emit(ReplyEvent(triage.follow_up))
+            return
+        # One-shot mode generates anyway; the triage has no consolidated request for it
+        triage = None
+
+    gate = _StageGate(current_sink())
+    pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="rag-stage")
+    detected = release_index = None
+    try:
+        with cache_scope(enc_key):
+            # 1. Consolidate the request, detect the handler and load its index in the background
+            consolidated = None
+            if triage is None:
+                consolidated = gate.submit(pool, consolidate_request, user_query, chat_history, api_key)
+            detected = gate.submit(pool, _detect_and_load_index, user_query, chat_history, api_key, gate,
+                                   triage.platform if triage is not None else None)
+
+        # 2. Meanwhile, check if we have enough info (skip for one-shot mode)
+        if not skip_sufficient_check and triage is None:
+            follow_up = check_sufficient_info(user_query, chat_history, api_key)
+            if follow_up:
+                gate.close()
+                emit(ReplyEvent(follow_up))
+                return
+        gate.open()
+
+        consolidated_query = consolidated.result() if consolidated else triage.consolidated_request
+        handler_config, handler_index, release_index = detected.result()
+    finally:
+        gate.close()
+        if detected is not None and release_index is None:
+            # Give back the index of an abandoned request once its stage is done with it
+            detected.add_done_callback(_release_abandoned_index)
+        # Abandoned model calls can't be interrupted; let them finish on their own
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    try:
+        _generate(consolidated_query, handler_config, handler_index, api_key)
+    finally:
+        release_index()
+
+
+def _generate(consolidated_query, handler_config, handler_index, api_key):
+    """Generate and validate the protocol from the retrieved docs, and emit the outcome."""
+    chunks, chunk_sources, index, lexical, vectors = handler_index
+
+    if index is None or not chunks:
+        step(f"No documentation available for {handler_config['name']}. "
+             f"Please add documents to {handler_config['docs_path']}/")
+        # Give the user a friendly message as the final output
+        emit(ReplyEvent(f"I couldn't find any documentation for {handler_config['name']}. "
+                        f"To generate accurate protocols, please add documentation files "
+                        f"(PDF, RST, or TXT) to the {handler_config['docs_path']}/ folder."))
+        return
+
+    # 5. Run the RAG pipeline
+    final_code, sources_used, file_refs, attempts, last_error, last_code = \
+        run_query_and_fix(consolidated_query, chunks, chunk_sources, index, handler_config, api_key,
+                          lexical=lexical, vectors=vectors)
+
+    if final_code:
+        fmt, content = detect_output_format(final_code)
+        emit(ResultEvent(fmt, content))
+    else:
+        step("Generation failed — preparing last attempt for review...")
+        fail_msg = (
+            "I wasn't able to generate a fully functional script after several attempts. "
+            "The simulation kept returning errors that I couldn't resolve automatically. "
+            "Here is the latest version of the script I generated — it may need some manual adjustments:"
+        )
+        emit(FailedEvent(fail_msg, last_code or "# No code was generated."))
+
+
+def iter_pipeline(user_query, chat_history, api_key, skip_sufficient_check=None, triage=None, enc_key=None):
+    """
+    Run run_pipeline() on a background thread and yield its typed events
+    (StepEvent, ReplyEvent, ResultEvent, FailedEvent, TimingEvent) as they are emitted.
+    Exceptions raised by the pipeline are re-raised in the consumer.
+    """
+    events = queue.Queue()
+    done = object()
+
+    def _worker():
+        try:
+            with event_sink(events.put):
+                run_pipeline(user_query, chat_history, api_key, skip_sufficient_check, triage, enc_key)
+        except Exception as e:
+            events.put(e)
+        finally:
+            events.put(done)
+
+    threading.Thread(target=_worker, name="rag-pipeline", daemon=True).start()
+
+    while True:
+        item = events.get()
+        if item is done:
+            return
+        if isinstance(item, Exception):
+            raise item
+        yield item
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        user_query = sys.argv[1]
+        chat_history = json.loads(sys.argv[2]) if len(sys.argv) > 2 else []
+        triage = Triage.from_dict(json.loads(sys.argv[3])) if len(sys.argv) > 3 else None
+    else:
+        raise ValueError("Usage: python3 main_rag.py '<question>' '<chat_history_json>' ['<triage_json>']")
+
+    api_key = get_api_key()
+    if not api_key:
+        raise ValueError("API_KEY environment variable not set")
+
+    run_pipeline(user_query, chat_history, api_key, triage=triage)
@@ -0,0 +1,93 @@
+"""
+Process-wide registry of OpenAI clients, one per API key.
+
+Every model and embeddings call used to build its own OpenAI(...) client, and
+with it a new HTTP connection pool, so each call paid a TCP + TLS handshake.
+get_openai_client() hands out one shared client per API key instead, whose
+connections are kept alive between calls (for $BIOBOT_OPENAI_KEEPALIVE
+seconds, well above httpx's 5 s default, which expires between pipeline
+stages). OpenAI clients are thread-safe, so concurrent requests and stages
+share them.
+
+At most $BIOBOT_OPENAI_CLIENTS clients are kept; the least recently used is
+dropped when another key comes in. Calls still running on a dropped client
+finish normally: its connection pool is closed once the client is garbage
+collected. Keys are stored hashed, and the registry is emptied in forked
+children (gunicorn --preload, rag_worker.py) so processes never share sockets.
+
+Usage:
+    client = get_openai_client(api_key)
+    response = client.responses.create(...)
+"""
+
+import os
+import weakref
+import hashlib
+import threading
+from collections import OrderedDict
+
+import httpx
+from openai import OpenAI, DefaultHttpxClient
+
+
+MAX_CLIENTS = int(os.environ.get("BIOBOT_OPENAI_CLIENTS", "64"))
+KEEPALIVE_SECONDS = float(os.environ.get("BIOBOT_OPENAI_KEEPALIVE", "60"))
+CONNECTION_LIMITS = httpx.Limits(
+    max_connections=50,
+    max_keepalive_connections=20,
+    keepalive_expiry=KEEPALIVE_SECONDS,
+)
+
+
+class ClientRegistry:
+    """LRU of OpenAI clients keyed by a hash of the API key."""
+
+    def __init__(self, max_clients=MAX_CLIENTS):
+        self.max_clients = max_clients
+        self._clients = OrderedDict()  # sha256(api_key) -> OpenAI
+        self._lock = threading.Lock()
+        self.created = 0
+        self.evicted = 0
+
+    def get(self, api_key):
+        key = hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()
+        with self._lock:
+            client = self._clients.get(key)
+            if client is not None:
+                self._clients.move_to_end(key)
+                return client
+
+            http_client = DefaultHttpxClient(limits=CONNECTION_LIMITS)
+            client = OpenAI(api_key=api_key, http_client=http_client)
+            # Close the pool when the last user of the client lets go of it
+            weakref.finalize(client, http_client.close)
+            self._clients[key] = client
+            self.created += 1
+            while len(self._clients) > self.max_clients:
+                self._clients.popitem(last=False)
+                self.evicted += 1
+            return client
+
+    def _after_fork(self):
+        # The parent's lock may have been held at fork time, and closing its
+        # clients here would act on sockets the parent still uses: start
+        # over, keeping the inherited clients referenced but untouched
+        self._inherited = list(self._clients.values())
+        self._clients = OrderedDict()
+        self._lock = threading.Lock()
+
+    def stats(self):
+        with self._lock:
+            return {"clients": len(self._clients), "created": self.created, "evicted": self.evicted}
+
+
+CLIENTS = ClientRegistry()
+
+# A forked child must not reuse the parent's open connections
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=CLIENTS._after_fork)
+
+
+def get_openai_client(api_key):
+    """Shared OpenAI client for this API key."""
+    return CLIENTS.get(api_key)
@@ -0,0 +1,161 @@
+"""
+Typed progress events for the BioBot RAG pipeline.
+
+Pipeline stages (main_rag.py, doc_fetcher.py) report progress by calling
+`step()` / `emit()` instead of printing. Where the events go depends on the
+active sink:
+
+- By default they are printed as the historical stdout line protocol
+  (STEP:/FORMAT:/FAILED_CODE:, plus TIMING: lines carrying a JSON
+  TimingEvent), which is what `python3 main_rag.py` and rag_worker.py stream
+  back to engine.py.
+- `event_sink(callback)` redirects them, e.g. into a queue when the pipeline
+  runs in-process on a thread (see main_rag.iter_pipeline).
+
+The sink is held in a ContextVar, so concurrent pipelines on different
+threads never see each other's events.
+
+Stages and model calls are timed with `timed()`, which emits a TimingEvent
+(stage, wall time, and for model calls the model and token usage):
+
+    with timed("simulate"):
+        result = subprocess.run(...)
+
+    # Model calls: same, with model and token usage filled in from the response
+    response = timed_call("consolidate", client.responses.create, model="gpt-4o-mini", input=[...])
+"""
+
+import json
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, asdict
+
+
+RAG_STEP_PREFIX = "STEP:"
+RAG_FORMAT_PREFIX = "FORMAT:"
+RAG_FAILED_PREFIX = "FAILED_CODE:"
+RAG_TIMING_PREFIX = "TIMING:"
+CODE_SEPARATOR = "___CODE_SEP___"
+
+
+@dataclass
+class StepEvent:
+    """Human-readable progress message shown while the pipeline runs."""
+    message: str
+
+
+@dataclass
+class ReplyEvent:
+    """Plain-text answer instead of an artifact (follow-up question, missing docs)."""
+    text: str
+
+
+@dataclass
+class ResultEvent:
+    """Final generated artifact and its detected format (python, csv, json...)."""
+    format: str
+    content: str
+
+
+@dataclass
+class FailedEvent:
+    """Generation failed validation; carries an explanation and the last attempt."""
+    message: str
+    code: str
+
+
+@dataclass
+class TimingEvent:
+    """Wall time of one pipeline stage or model call; model and tokens are set for model calls."""
+    stage: str
+    seconds: float = 0.0
+    model: str = None
+    input_tokens: int = None
+    output_tokens: int = None
+
+    def add_usage(self, usage):
+        """Take token counts from a Responses (input/output_tokens) or Embeddings (prompt_tokens) usage."""
+        if usage is None:
+            return
+        input_tokens = getattr(usage, "input_tokens", None)
+        if input_tokens is None:
+            input_tokens = getattr(usage, "prompt_tokens", None)
+        self.input_tokens = (self.input_tokens or 0) + (input_tokens or 0)
+        self.output_tokens = (self.output_tokens or 0) + (getattr(usage, "output_tokens", None) or 0)
+
+    def to_json(self):
+        return json.dumps(asdict(self))
+
+    @classmethod
+    def from_json(cls, payload):
+        return cls(**json.loads(payload))
+
+
+def print_event(event):
+    """Default sink: write an event using the stdout line protocol."""
+    if isinstance(event, StepEvent):
+        print(RAG_STEP_PREFIX + event.message, flush=True)
+    elif isinstance(event, ResultEvent):
+        print(RAG_FORMAT_PREFIX + event.format, flush=True)
+        print(event.content, flush=True)
+    elif isinstance(event, FailedEvent):
+        print(RAG_FAILED_PREFIX + event.message + CODE_SEPARATOR + event.code, flush=True)
+    elif isinstance(event, ReplyEvent):
+        print(event.text, flush=True)
+    elif isinstance(event, TimingEvent):
+        print(RAG_TIMING_PREFIX + event.to_json(), flush=True)
+
+
+_sink = ContextVar("rag_event_sink", default=print_event)
+
+
+def emit(event):
+    """Send an event to the current sink."""
+    _sink.get()(event)
+
+
+def current_sink():
+    """The callback events emitted in this context go to, e.g. to hand to worker threads."""
+    return _sink.get()
+
+
+def step(message):
+    """Shortcut for emit(StepEvent(message))."""
+    emit(StepEvent(message))
+
+
+@contextmanager
+def timed(stage, model=None):
+    """
+    Time the block and emit a TimingEvent when it ends (also on error).
+    Yields the event, so token usage can be added with `add_usage`.
+    """
+    event = TimingEvent(stage, model=model)
+    start = time.perf_counter()
+    try:
+        yield event
+    finally:
+        event.seconds = round(time.perf_counter() - start, 4)
+        emit(event)
+
+
+def timed_call(stage, create, **kwargs):
+    """
+    Call an OpenAI SDK method (client.responses.create, client.embeddings.create)
+    with kwargs and emit its TimingEvent, including model and token usage.
+    """
+    with timed(stage, model=kwargs.get("model")) as timing:
+        response = create(**kwargs)
+        timing.add_usage(getattr(response, "usage", None))
+    return response
+
+
+@contextmanager
+def event_sink(callback):
+    """Route every event emitted in this context to `callback`."""
+    token = _sink.set(callback)
+    try:
+        yield
+    finally:
+        _sink.reset(token)
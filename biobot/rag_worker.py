@@ -0,0 +1,172 @@
+"""
+Persistent RAG worker for BioBot.
+
+Spawning `python3 main_rag.py` for every code request re-imports faiss, numpy
+and openai, re-reads handlers.json and reloads the handler store before doing
+any work. This daemon imports the pipeline once, keeps the handler indexes
+resident and serves jobs over a local Unix socket.
+
+Each job is a single JSON line:
+    {"query": ..., "history": [...], "api_key": ..., "skip_sufficient_check": false, "triage": {...} or null}
+
+The worker answers with exactly what `python3 main_rag.py` would print on
+stdout (STEP:/FORMAT:/FAILED_CODE:/TIMING: lines), then closes the connection, so
+engine._rag_generator parses both sources the same way.
+
+The worker is optional (BIOBOT_RAG_MODE=worker); the web app runs the
+pipeline in-process by default. It respawns children that die, but nothing
+restarts the parent: run it under a supervisor. Each child serves one job at
+a time, so --workers bounds the concurrent code requests; further jobs wait
+in the socket backlog until a child is free.
+
+Usage:
+    python3 rag_worker.py                      # 2 worker processes
+    python3 rag_worker.py --workers 4
+    python3 rag_worker.py --socket /tmp/biobot_rag.sock
+"""
+
+import os
+import sys
+import json
+import signal
+import socket
+import argparse
+import traceback
+from contextlib import redirect_stdout
+
+import main_rag
+from triage import Triage
+from response_cache import get_response_cache
+
+
+DEFAULT_SOCKET_PATH = os.environ.get("BIOBOT_RAG_SOCKET", "/tmp/biobot_rag.sock")
+DEFAULT_WORKERS = int(os.environ.get("BIOBOT_RAG_WORKERS", "2"))
+
+
+def _log(msg):
+    print(f"[rag_worker {os.getpid()}] {msg}", file=sys.stderr, flush=True)
+
+
+def disable_response_cache():
+    """
+    Jobs carry no session key (it never leaves the web process), so cached
+    answers couldn't be scoped to their user: keep none between jobs.
+    """
+    get_response_cache().max_entries = 0
+
+
+def preload_indexes():
+    """Load existing handler stores before forking, so workers share them."""
+    for handler_id in main_rag.preload_indexes():
+        _log(f"Preloaded {handler_id} index")
+
+
+def handle_connection(conn):
+    """Read one job from the socket and stream the pipeline output back."""
+    with conn, conn.makefile("r", encoding="utf-8") as rfile, \
+            conn.makefile("w", encoding="utf-8") as wfile:
+        line = rfile.readline()
+        if not line.strip():
+            return
+        try:
+            job = json.loads(line)
+        except json.JSONDecodeError:
+            _log("Ignoring malformed job")
+            return
+
+        try:
+            with redirect_stdout(wfile):
+                main_rag.run_pipeline(
+                    job["query"],
+                    job.get("history", []),
+                    job.get("api_key"),
+                    skip_sufficient_check=job.get("skip_sufficient_check", False),
+                    triage=Triage.from_dict(job.get("triage")),
+                )
+        except (BrokenPipeError, ConnectionResetError):
+            _log("Client disconnected before the job finished")
+            return
+        except Exception:
+            traceback.print_exc(file=sys.stderr)
+
+        try:
+            wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+def worker_loop(server):
+    """Accept and serve jobs one at a time, forever. Runs in each forked child."""
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    while True:
+        conn, _ = server.accept()
+        handle_connection(conn)
+
+
+def serve(socket_path=DEFAULT_SOCKET_PATH, workers=DEFAULT_WORKERS):
+    """
+    Bind the socket, preload indexes, then fork `workers` children that share
+    the listening socket (pre-fork model). Dead children are respawned.
+    """
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    os.chmod(socket_path, 0o600)
+    server.listen(64)
+
+    disable_response_cache()
+    preload_indexes()
+
+    children = set()
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            try:
+                worker_loop(server)
+            finally:
+                os._exit(0)
+        children.add(pid)
+
+    def shutdown(signum, frame):
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        server.close()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    for _ in range(max(1, workers)):
+        spawn()
+    _log(f"Serving {len(children)} worker(s) on {socket_path}")
+
+    while True:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        if pid in children:
+            children.discard(pid)
+            _log(f"Worker {pid} exited with status {status}, respawning")
+            spawn()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="BioBot persistent RAG worker")
+    parser.add_argument("--socket", default=DEFAULT_SOCKET_PATH, help="Unix socket path to listen on")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Number of worker processes")
+    args = parser.parse_args()
+    serve(args.socket, args.workers)
+
+
+if __name__ == "__main__":
+    main()
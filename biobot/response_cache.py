@@ -0,0 +1,224 @@
+"""
+Cache of model answers for the deterministic pre-generation stages.
+
+Triage, classification, handler detection and request consolidation only
+read the recent conversation, so a regenerated or resubmitted message asks
+them the exact same thing again. cached_call() answers such a repeated call
+from the cache instead of the API.
+
+Entries are keyed by the stage and a hash of the model, the full prompt
+(system instructions and conversation window) and the output format. They
+expire after $BIOBOT_LLM_CACHE_TTL seconds (default one day) and live in two
+tiers:
+- an in-process LRU of $BIOBOT_LLM_CACHE_SIZE entries;
+- with $BIOBOT_CACHE_PG set, the llm_cache table in Postgres (created by
+  config.init_db), shared by the web processes.
+
+Answers are derived from the user's chats, so they are protected like the
+chats themselves: within a cache_scope(enc_key), the key is an HMAC under the
+user's session key and the answer is encrypted with it (crypt.encrypt). Users
+never share entries, and the table holds nothing readable without the key.
+Outside a scope (CLI, scripts), entries stay in memory and are never written
+to Postgres. The session key never leaves the web process: pipelines run by
+rag_worker.py or a main_rag.py subprocess get no scope, and the worker keeps
+no entries at all, since its jobs come from every user. Hit/miss counters are
+kept per stage and per process.
+
+Usage:
+    with cache_scope(enc_key):
+        text = cached_call("consolidate", client.responses.create, model="gpt-4o-mini", input=[...])
+    get_response_cache().stats()   # {"consolidate": {"memory_hits": ..., "db_hits": ..., "misses": ..., "hit_rate": ...}}
+"""
+
+import os
+import sys
+import hmac
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from cryptography.fernet import InvalidToken
+
+from crypt import encrypt, decrypt
+from rag_events import timed_call
+
+
+LLM_CACHE_TTL = int(os.environ.get("BIOBOT_LLM_CACHE_TTL", str(24 * 3600)))
+LLM_CACHE_SIZE = int(os.environ.get("BIOBOT_LLM_CACHE_SIZE", "1024"))  # In-memory entries
+LLM_CACHE_PG = bool(os.environ.get("BIOBOT_CACHE_PG"))
+
+
+def _log(msg):
+    print(msg, file=sys.stderr, flush=True)
+
+
+_scope_key = ContextVar("response_cache_key", default=None)
+
+
+@contextmanager
+def cache_scope(enc_key):
+    """Encrypt and key the cache entries of calls made in this context with the user's session key."""
+    if isinstance(enc_key, str):
+        enc_key = enc_key.encode("utf-8")
+    token = _scope_key.set(enc_key or None)
+    try:
+        yield
+    finally:
+        _scope_key.reset(token)
+
+
+class ResponseCache:
+    """
+    (stage, prompt hash) -> answer text: an in-memory LRU, optionally backed
+    by the llm_cache table in Postgres. Entries older than `ttl` seconds are
+    ignored and purged.
+    """
+
+    def __init__(self, ttl=LLM_CACHE_TTL, max_entries=LLM_CACHE_SIZE, use_db=LLM_CACHE_PG):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.use_db = use_db
+        self._memory = OrderedDict()  # key -> (created, stored value)
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._purged = False
+
+    @staticmethod
+    def _key(stage, material, enc_key):
+        payload = f"{stage}\n{material}".encode("utf-8")
+        if enc_key:
+            return stage + ":" + hmac.new(enc_key, payload, hashlib.sha256).hexdigest()
+        return stage + ":" + hashlib.sha256(payload).hexdigest()
+
+    def _count(self, stage, outcome):
+        counters = self._counters.setdefault(stage, {"memory_hits": 0, "db_hits": 0, "misses": 0})
+        counters[outcome] += 1
+
+    def _remember(self, key, created, value):
+        self._memory[key] = (created, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, stage, material):
+        """Cached answer for this stage and prompt material, or None."""
+        enc_key = _scope_key.get()
+        key = self._key(stage, material, enc_key)
+        expired_before = time.time() - self.ttl
+
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and entry[0] < expired_before:
+                self._memory.pop(key)
+                entry = None
+        outcome = "memory_hits"
+        if entry is None and self.use_db and enc_key:
+            entry = self._db_get(key, expired_before)
+            outcome = "db_hits"
+
+        text = None
+        if entry is not None:
+            try:
+                text = decrypt(entry[1], enc_key) if enc_key else entry[1]
+            except InvalidToken:
+                text = None
+        with self._lock:
+            if text is None:
+                self._count(stage, "misses")
+                return None
+            self._remember(key, *entry)
+            self._count(stage, outcome)
+        return text
+
+    def put(self, stage, material, text):
+        enc_key = _scope_key.get()
+        key = self._key(stage, material, enc_key)
+        value = encrypt(text, enc_key) if enc_key else text
+        now = time.time()
+        with self._lock:
+            self._remember(key, now, value)
+        # Never store unencrypted answers outside this process
+        if self.use_db and enc_key:
+            self._db_put(key, stage, value)
+
+    def _db_get(self, key, expired_before):
+        from config import get_db_connection
+        conn = None
+        try:
+            conn = get_db_connection()
+            cur = conn.cursor()
+            cur.execute(
+                "SELECT EXTRACT(EPOCH FROM created_at), value FROM llm_cache "
+                "WHERE key = %s AND created_at >= TO_TIMESTAMP(%s)",
+                (key, expired_before),
+            )
+            row = cur.fetchone()
+            return (float(row[0]), row[1]) if row else None
+        except Exception as e:
+            _log(f"WARNING: LLM cache read failed: {e}")
+            return None
+        finally:
+            if conn:
+                conn.close()
+
+    def _db_put(self, key, stage, value):
+        from config import get_db_connection
+        conn = None
+        try:
+            conn = get_db_connection()
+            cur = conn.cursor()
+            if not self._purged:
+                cur.execute("DELETE FROM llm_cache WHERE created_at < TO_TIMESTAMP(%s)", (time.time() - self.ttl,))
+                self._purged = True
+            cur.execute(
+                "INSERT INTO llm_cache (key, stage, value, created_at) VALUES (%s, %s, %s, CURRENT_TIMESTAMP) "
+                "ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value, created_at = EXCLUDED.created_at",
+                (key, stage, value),
+            )
+            conn.commit()
+        except Exception as e:
+            _log(f"WARNING: LLM cache write failed: {e}")
+        finally:
+            if conn:
+                conn.close()
+
+    def stats(self):
+        """Per-stage hit/miss counters and hit rate, as a JSON-serializable dict."""
+        with self._lock:
+            stages = {}
+            for stage, counters in self._counters.items():
+                lookups = sum(counters.values())
+                hits = counters["memory_hits"] + counters["db_hits"]
+                stages[stage] = dict(counters, hit_rate=hits / lookups if lookups else 0.0)
+            return {"entries": len(self._memory), "ttl": self.ttl, "postgres": self.use_db, "stages": stages}
+
+
+_cache = ResponseCache()
+
+
+def get_response_cache():
+    return _cache
+
+
+def cached_call(stage, create, validate=None, **kwargs):
+    """
+    timed_call() for a deterministic stage, returning the answer's stripped
+    output_text. A call with the same model, input and output format made
+    before in this cache scope is answered from the cache, without a model
+    call or TimingEvent. Answers for which validate(text) is false are
+    returned but not cached.
+    """
+    material = json.dumps(
+        {"model": kwargs.get("model"), "input": kwargs.get("input"), "text": kwargs.get("text")},
+        sort_keys=True,
+    )
+    text = _cache.get(stage, material)
+    if text is None:
+        text = timed_call(stage, create, **kwargs).output_text.strip()
+        if validate is None or validate(text):
+            _cache.put(stage, material, text)
+    return text
@@ -0,0 +1,49 @@
+"""
+Retrieval of documentation chunks for a question, shared by the pipeline
+(main_rag.run_query_and_fix) and the offline benchmark (bench/retrieval_bench.py).
+
+1. Vector search over the handler's FAISS index
+2. BM25 search over its lexical index, fused by reciprocal rank
+3. Near-duplicate removal and MMR over the over-fetched candidates (diversify.py)
+
+Usage:
+    hits = retrieve(question, question_embedding, index, lexical, chunks, vectors)
+    # [(chunk_id, score), ...], best first
+"""
+
+import faiss
+
+from diversify import diversify
+from lexical_index import reciprocal_rank_fusion
+
+
+RETRIEVAL_K = 5              # Chunks given to the model as context
+RETRIEVAL_CANDIDATES = 20    # Per-retriever candidates fused into the top RETRIEVAL_K
+
+
+def retrieve_chunk_ids(question, question_embedding, index, lexical=None, k=RETRIEVAL_K):
+    """
+    Top-k (chunk id, score) pairs for the question, best first: vector search
+    results, fused with BM25 results by reciprocal rank when a lexical index
+    is available.
+    """
+    _, I = index.search(question_embedding, RETRIEVAL_CANDIDATES if lexical is not None else k)
+    # FAISS pads with -1 when the index holds fewer than k vectors
+    vector_ids = [i for i in I.tolist()[0] if i >= 0]
+    rankings = [vector_ids]
+    if lexical is not None:
+        rankings.append(lexical.search(question, RETRIEVAL_CANDIDATES))
+    return reciprocal_rank_fusion(*rankings)[:k]
+
+
+def retrieve(question, question_embedding, index, lexical, chunks, vectors, k=RETRIEVAL_K):
+    """
+    Over-fetch candidates, then keep k distinct passages (doc versions often
+    repeat each other). `question_embedding` is a (1, dim) float32 array.
+    """
+    # Inner-product (compact) indexes expect unit vectors. For L2 indexes, rescaling the query only
+    # keeps the ranking if the stored vectors all have the same norm: true of OpenAI embeddings,
+    # which are unit-length, but not of arbitrary vectors
+    faiss.normalize_L2(question_embedding)
+    candidates = retrieve_chunk_ids(question, question_embedding, index, lexical, k=RETRIEVAL_CANDIDATES)
+    return diversify(candidates, chunks, vectors, k)
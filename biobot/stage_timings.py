@@ -0,0 +1,79 @@
+"""
+Process-wide aggregate of pipeline stage and model-call timings.
+
+The web app records every TimingEvent that comes back from a request
+(classification, each RAG stage, each model call with its tokens) plus the
+wall time of the whole request, and serves the aggregate at /ops/timings.
+Percentiles are computed over the last SAMPLE_SIZE samples of each stage.
+
+Usage:
+    TIMINGS.record(TimingEvent("retrieval", 0.012))
+    TIMINGS.stats()   # {"since": ..., "stages": {"retrieval": {"count": ..., "p50": ...}}}
+"""
+
+import threading
+from collections import deque
+from datetime import datetime
+
+
+SAMPLE_SIZE = 1000
+
+
+def _percentile(ordered, q):
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+
+class StageTimings:
+    """Per-stage counters and a window of recent durations, safe to update from request threads."""
+
+    def __init__(self, sample_size=SAMPLE_SIZE):
+        self.sample_size = sample_size
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._stages = {}
+            self.since = datetime.now().isoformat(timespec="seconds")
+
+    def record(self, event):
+        with self._lock:
+            stage = self._stages.get(event.stage)
+            if stage is None:
+                stage = self._stages[event.stage] = {
+                    "count": 0, "total_seconds": 0.0, "max": 0.0,
+                    "input_tokens": 0, "output_tokens": 0, "models": {},
+                    "samples": deque(maxlen=self.sample_size),
+                }
+            stage["count"] += 1
+            stage["total_seconds"] += event.seconds
+            stage["max"] = max(stage["max"], event.seconds)
+            stage["samples"].append(event.seconds)
+            stage["input_tokens"] += event.input_tokens or 0
+            stage["output_tokens"] += event.output_tokens or 0
+            if event.model:
+                stage["models"][event.model] = stage["models"].get(event.model, 0) + 1
+
+    def stats(self):
+        """Per-stage count, total/mean/p50/p95/max seconds, tokens and models, as a JSON-serializable dict."""
+        with self._lock:
+            stages = {}
+            for name, stage in self._stages.items():
+                ordered = sorted(stage["samples"])
+                stages[name] = {
+                    "count": stage["count"],
+                    "total_seconds": round(stage["total_seconds"], 3),
+                    "mean": round(stage["total_seconds"] / stage["count"], 4),
+                    "p50": _percentile(ordered, 50),
+                    "p95": _percentile(ordered, 95),
+                    "max": stage["max"],
+                    "input_tokens": stage["input_tokens"],
+                    "output_tokens": stage["output_tokens"],
+                    "models": dict(stage["models"]),
+                }
+            return {"since": self.since, "stages": stages}
+
+
+TIMINGS = StageTimings()
@@ -525,6 +525,71 @@ function typewriterAppend(div, text, delay = 18) {
   next();
 }
 
+// --- Paced RAG status line ---
+// The server streams pipeline steps as soon as they happen, so several can
+// arrive within a few milliseconds. Each one stays on screen at least
+// STATUS_MIN_DISPLAY_MS; when steps pile up, only the latest few are kept.
+const STATUS_MIN_DISPLAY_MS = 800;
+const MAX_QUEUED_STATUSES = 3;
+
+function createStatusPacer() {
+  let statusDiv = null;
+  let queue = [];
+  let shownAt = 0;
+  let timer = null;
+  let drainWaiters = [];
+
+  function show(text) {
+    if (!statusDiv) {
+      statusDiv = document.createElement("div");
+      statusDiv.className = "chat-message chat-bot rag-status";
+      chatHistoryElem.appendChild(statusDiv);
+    }
+    statusDiv.innerHTML = `<span class="rag-spinner"></span>${text}`;
+    shownAt = Date.now();
+    scrollToBottom();
+  }
+
+  function pump() {
+    timer = null;
+    const wait = shownAt + STATUS_MIN_DISPLAY_MS - Date.now();
+    if (queue.length || drainWaiters.length) {
+      if (wait > 0) {
+        timer = setTimeout(pump, wait);
+        return;
+      }
+    }
+    if (queue.length) {
+      show(queue.shift());
+      pump();
+      return;
+    }
+    drainWaiters.forEach((resolve) => resolve());
+    drainWaiters = [];
+  }
+
+  return {
+    push(text) {
+      queue.push(text);
+      if (queue.length > MAX_QUEUED_STATUSES) queue.shift();
+      if (!timer) pump();
+    },
+    // Resolves once every queued status has been shown for its minimum time
+    drain() {
+      return new Promise((resolve) => {
+        drainWaiters.push(resolve);
+        if (!timer) pump();
+      });
+    },
+    remove() {
+      if (timer) clearTimeout(timer);
+      timer = null;
+      queue = [];
+      if (statusDiv) { statusDiv.remove(); statusDiv = null; }
+    },
+  };
+}
+
 // --- Send message ---
 async function sendMessage() {
   const input = document.getElementById("user-input");
@@ -543,7 +608,7 @@ async function sendMessage() {
   let apiKey = localStorage.getItem("userApiKey") || "";
   let botDiv = null;
   let firstChunkReceived = false;
-  let statusDiv = null;
+  const statusPacer = createStatusPacer();
   let isRagResponse = false;
 
   try {
@@ -593,13 +658,7 @@ async function sendMessage() {
         const thinkingElem = document.getElementById("thinking-message");
         if (thinkingElem) thinkingElem.remove();
 
-        if (!statusDiv) {
-          statusDiv = document.createElement("div");
-          statusDiv.className = "chat-message chat-bot rag-status";
-          chatHistoryElem.appendChild(statusDiv);
-        }
-        statusDiv.innerHTML = `<span class="rag-spinner"></span>${statusText.trim()}`;
-        scrollToBottom();
+        statusPacer.push(statusText.trim());
       }
 
       if (contentPart) {
@@ -608,7 +667,9 @@ async function sendMessage() {
           clearInterval(thinkingInterval);
           const thinkingElem = document.getElementById("thinking-message");
           if (thinkingElem) thinkingElem.remove();
-          if (statusDiv) { statusDiv.remove(); statusDiv = null; }
+          // Let the last steps be read before the answer replaces them
+          await statusPacer.drain();
+          statusPacer.remove();
           botDiv = addMessage("", "bot");
         }
 
@@ -652,6 +713,7 @@ async function sendMessage() {
     clearInterval(thinkingInterval);
     const thinkingElem = document.getElementById("thinking-message");
     if (thinkingElem) thinkingElem.remove();
+    statusPacer.remove();
 
     const errorDiv = addMessage("", "bot");
     appendChunkToBotMessage(errorDiv, "Error: Unable to get a response. Please try again.");
@@ -0,0 +1,131 @@
+"""
+Single structured-output call that triages a user message.
+
+A code request used to cost three model calls after classification, each
+one re-sending the recent conversation: the sufficiency check, request
+consolidation and platform detection (main_rag.py). triage_request() asks
+for the three answers at once, as JSON constrained by TRIAGE_SCHEMA:
+
+    {"sufficient": true, "follow_up_question": null,
+     "consolidated_request": "The user wants to ...", "platform": "opentrons"}
+
+It is only made for messages engine.classify_prompt already classified as
+code, so general and out-of-scope messages still cost a single cheap call.
+If the call fails or its answer doesn't validate, it returns None and the
+pipeline falls back to the per-step calls. The Triage result travels with
+the request to the pipeline in every RAG mode (as a dict in the worker job
+and on the main_rag.py command line), where it replaces those steps.
+
+Platform detection moves from gpt-5.4 (main_rag.detect_platform) to
+TRIAGE_MODEL, the model of the sufficiency and consolidation calls. A
+confident keyword match on handlers.json (main_rag.match_handler_keywords)
+still takes precedence over the platform it names.
+
+Usage:
+    if classify_prompt(query, history, api_key=api_key) == "code":
+        triage = triage_request(query, history, api_key)   # None: per-step calls
+"""
+
+import sys
+import json
+from dataclasses import dataclass, asdict
+
+from openai import APIError
+
+from handler_registry import load_handlers_config
+from openai_clients import get_openai_client
+from response_cache import cached_call
+
+
+TRIAGE_MODEL = "gpt-4o-mini"
+
+TRIAGE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "sufficient": {"type": "boolean"},
+        "follow_up_question": {"type": ["string", "null"]},
+        "consolidated_request": {"type": ["string", "null"]},
+        "platform": {"type": ["string", "null"]},
+    },
+    "required": ["sufficient", "follow_up_question", "consolidated_request", "platform"],
+    "additionalProperties": False,
+}
+
+TRIAGE_PROMPT = """You are BioBot, an expert assistant in lab automation and liquid handling robots. You will be given the recent conversation and the user's LATEST message, which asks for a protocol script or automation. DO NOT GENERATE CODE: fill in every field of the JSON answer as follows.
+
+- sufficient: true if the whole conversation holds enough information to generate a working script. If the user asks you to use a default set-up, complete a set-up, or choose parameters along with the information they gave, it is sufficient.
+- follow_up_question: when not sufficient, kindly ask for the missing information. You are specialized, you know what to ask depending on the request. Always kindly suggest a default set-up to help the user. Null when sufficient.
+- consolidated_request: when sufficient, a structured, complete, self-contained protocol description consolidating ALL the information given across the conversation, in natural language in the third person ("the user wants to..."), as if everything had been provided upfront. Mention the output file type if the user asked for one (txt, csv, python script, HSL...). Null when not sufficient.
+- platform: the liquid handling PLATFORM (robot/instrument brand, not reagents, software or techniques) the request is for, looking at the ENTIRE conversation. Use the exact ID of a configured platform when it matches one:
+{known_list}
+  Otherwise a new short lowercase ID of the brand, no spaces (e.g. "beckman", "agilent", "eppendorf", "gilson", "biomek"), or "unknown" if no platform is mentioned or implied."""
+
+
+@dataclass
+class Triage:
+    """Answers of the combined call: follow-up question or consolidated request, and platform id."""
+    follow_up: str = None
+    consolidated_request: str = None
+    platform: str = None
+
+    def to_dict(self):
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data) if data else None
+
+
+def _parse_triage(payload):
+    """Validate the model's JSON answer; returns a Triage or None if it is unusable."""
+    data = json.loads(payload)
+    if not data["sufficient"]:
+        follow_up = (data["follow_up_question"] or "").strip()
+        return Triage(follow_up=follow_up) if follow_up else None
+    consolidated = (data["consolidated_request"] or "").strip()
+    platform = (data["platform"] or "unknown").strip().lower().strip('"').replace(" ", "_")
+    if not consolidated:
+        return None
+    return Triage(consolidated_request=consolidated, platform=platform)
+
+
+def _usable(payload):
+    try:
+        return _parse_triage(payload) is not None
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return False
+
+
+def triage_request(query, history, api_key, model=TRIAGE_MODEL):
+    """
+    Check sufficiency, consolidate the request and detect the platform of a
+    code request in one model call. Returns a Triage, or None if the
+    per-step calls should be used instead (including on any API error).
+    """
+    handlers = load_handlers_config()
+    known_list = "\n".join(f'  - "{hid}" → {cfg["name"]}' for hid, cfg in handlers.items()) \
+        or "  (none configured)"
+
+    recent = [m for m in history if m["role"] != "system"][-8:]
+    conversation = "\n".join(
+        f"{'User' if m['role'] == 'user' else 'Assistant'}: {m['content'][:500]}"
+        for m in recent
+    )
+
+    client = get_openai_client(api_key)
+    try:
+        output = cached_call("triage", client.responses.create, validate=_usable,
+            model=model,
+            input=[
+                {"role": "system", "content": TRIAGE_PROMPT.format(known_list=known_list)},
+                {"role": "user", "content": f"Conversation so far:\n{conversation}\n\nLatest message: {query}"},
+            ],
+            text={"format": {"type": "json_schema", "name": "triage", "schema": TRIAGE_SCHEMA, "strict": True}},
+        )
+        triage = _parse_triage(output)
+    except (APIError, ValueError, KeyError, TypeError, AttributeError) as e:
+        print(f"WARNING: Triage call failed, using per-step calls: {e!r}", file=sys.stderr, flush=True)
+        return None
+    if triage is None:
+        print("WARNING: Incomplete triage answer, using per-step calls", file=sys.stderr, flush=True)
+    return triage
@@ -10,6 +10,8 @@ Usage:
     biobot --new               Start a fresh chat directly
     biobot --list              List your saved chats
     biobot --init-db           Initialize database tables
+    biobot index build [handler|all] [--rebuild]
+                               Pre-build or refresh documentation indexes
 """
 
 # ── Bootstrap: resolve paths and load env BEFORE any project imports ──
@@ -49,6 +51,7 @@ os.chdir(BIOBOT_DIR)
 import argparse
 import getpass
 import re
+import time
 import uuid
 from datetime import datetime
 
@@ -57,7 +60,7 @@ import psycopg2.extras
 from werkzeug.security import check_password_hash, generate_password_hash
 
 from config import get_db_connection, get_api_key, init_db, wait_for_postgres
-from engine import process_user_query, RAG_STATUS_PREFIX, FAILED_CODE_MARKER
+from engine import process_user_query, RAG_STATUS_PREFIX, FAILED_CODE_MARKER, TIMING_MARKER
 
 try:
     from crypt import generate_salt, derive_key, encrypt, decrypt
@@ -412,15 +415,29 @@ def _banner():
     print()
 
 
+# Pipeline steps arrive as fast as they run; each one stays on the status
+# line at least this long so quick steps can still be read
+STATUS_MIN_DISPLAY = 0.8
+_status_shown_at = 0.0
+
+def _pace_status():
+    remaining = _status_shown_at + STATUS_MIN_DISPLAY - time.monotonic()
+    if remaining > 0:
+        time.sleep(remaining)
+
 def _print_status(text):
+    global _status_shown_at
     if sys.stdout.isatty():
+        _pace_status()
         sys.stdout.write(f"\r  {C.DIM}⏳ {text}{C.RESET}\033[K")
         sys.stdout.flush()
+        _status_shown_at = time.monotonic()
     else:
         print(f"  [{text}]")
 
 def _clear_status():
     if sys.stdout.isatty():
+        _pace_status()
         sys.stdout.write("\r\033[K")
         sys.stdout.flush()
 
@@ -612,6 +629,9 @@ def interactive(session: Session, chat_id: str):
         try:
             for chunk in process_user_query(user_input, messages, MODEL_NAME, api_key=session.api_key):
 
+                if chunk.startswith(TIMING_MARKER):
+                    continue  # Stage timings are for the web app's /ops/timings
+
                 if chunk.startswith(RAG_STATUS_PREFIX):
                     had_status = True
                     is_rag = True
@@ -677,9 +697,110 @@ def interactive(session: Session, chat_id: str):
         print()
 
 
+# ── Index building ───────────────────────────────────────────
+
+def _format_seconds(seconds):
+    return f"{seconds:.1f}s" if seconds < 60 else f"{int(seconds // 60)}m{seconds % 60:02.0f}s"
+
+
+def build_indexes(handler="all", rebuild=False, workers=None, embed_workers=None, chunk_size=3000):
+    """
+    Build or refresh handler stores ahead of time, so no user request waits
+    for indexing. Returns False if any handler failed.
+    """
+    from functools import partial
+
+    import main_rag
+    from doc_loader import iter_doc_files
+    from embedder import embed_texts, EMBEDDING_WORKERS
+    from index_store import store_dir_for
+    from indexer import refresh_store
+    from rag_events import event_sink, StepEvent
+
+    try:
+        api_key = get_api_key()
+    except ValueError as e:
+        print(_c(f"  Error: {e} (set API_KEY in .env)", C.RED))
+        return False
+
+    handlers = main_rag.load_handlers_config()
+    if handler != "all" and handler not in handlers:
+        print(_c(f"  Unknown handler '{handler}'. Available: {', '.join(handlers)}", C.RED))
+        return False
+    selected = handlers if handler == "all" else {handler: handlers[handler]}
+
+    workers = workers or os.cpu_count() or 1
+    embed_fn = partial(embed_texts, workers=embed_workers or EMBEDDING_WORKERS)
+
+    def show_step(event):
+        if isinstance(event, StepEvent):
+            print(_c(f"    {event.message}", C.DIM))
+
+    ok = True
+    total_start = time.perf_counter()
+    for handler_id, cfg in selected.items():
+        docs_path = os.path.join(main_rag.SCRIPT_DIR, cfg["docs_path"])
+        store_dir = store_dir_for(docs_path, cfg["store_path"])
+        print(_c(f"  {cfg['name']} ({handler_id})", C.BOLD + C.CYAN))
+        has_docs = os.path.isdir(docs_path) and next(iter_doc_files(docs_path), None) is not None
+        if not has_docs:
+            print(_c(f"    No local documents in {cfg['docs_path']}/, skipped", C.YELLOW))
+            continue
+
+        start = time.perf_counter()
+        try:
+            with event_sink(show_step):
+                store, stats = refresh_store(
+                    store_dir, docs_path, api_key,
+                    chunk_size=chunk_size, rebuild=rebuild, embed_fn=embed_fn,
+                    index_spec=cfg.get("index"), parse_workers=workers,
+                )
+        except Exception as e:
+            print(_c(f"    Failed: {e}", C.RED))
+            ok = False
+            continue
+
+        t = stats["timings"]
+        chunks = len(store) if store is not None else 0
+        print(_c(f"    {chunks} chunks, {stats['added']} new / {stats['changed']} changed / "
+                 f"{stats['removed']} removed / {stats['unchanged']} unchanged files", C.GREEN))
+        print(_c(f"    scan {_format_seconds(t['scan'])} · parse {_format_seconds(t['parse'])} "
+                 f"({workers} procs) · embed {_format_seconds(t['embed'])} · "
+                 f"index+write {_format_seconds(t['write'])} · "
+                 f"total {_format_seconds(time.perf_counter() - start)}", C.DIM))
+
+    print(_c(f"  Done in {_format_seconds(time.perf_counter() - total_start)}",
+             C.GREEN if ok else C.YELLOW))
+    return ok
+
+
+def index_command(argv):
+    parser = argparse.ArgumentParser(
+        prog="biobot index",
+        description="Manage BioBot documentation indexes",
+    )
+    sub = parser.add_subparsers(dest="action", required=True)
+    build = sub.add_parser("build", help="Build or refresh handler indexes")
+    build.add_argument("handler", nargs="?", default="all", help="Handler id from handlers.json, or 'all'")
+    build.add_argument("--rebuild", action="store_true", help="Re-index everything instead of only changed files")
+    build.add_argument("--workers", type=int, default=None, help="Processes for document parsing (default: CPU count)")
+    build.add_argument("--embed-workers", type=int, default=None, help="Concurrent embedding requests")
+    build.add_argument("--chunk-size", type=int, default=3000, help="Chunk size in characters")
+    args = parser.parse_args(argv)
+
+    if args.action == "build":
+        ok = build_indexes(args.handler, args.rebuild, args.workers, args.embed_workers, args.chunk_size)
+        sys.exit(0 if ok else 1)
+
+
 # ── Entry point ──────────────────────────────────────────────
 
 def main():
+    # Subcommands that don't need a database or a login
+    if len(sys.argv) > 1 and sys.argv[1] == "index":
+        index_command(sys.argv[2:])
+        return
+
     parser = argparse.ArgumentParser(
         prog="biobot",
         description="BioBot CLI — lab automation code generator",
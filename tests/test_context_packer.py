@@ -0,0 +1,83 @@
+import re
+
+import pytest
+
+import context_packer
+from context_packer import pack_context, MIN_TRIMMED_TOKENS
+
+
+class WordEncoding:
+    """Words and whitespace runs as tokens, so the tests don't need tiktoken's downloaded tables."""
+
+    def encode(self, text, disallowed_special=()):
+        return re.findall(r"\S+|\s+", text)
+
+    def decode(self, tokens):
+        return "".join(tokens)
+
+
+@pytest.fixture(autouse=True)
+def word_tokens(monkeypatch):
+    monkeypatch.setattr(context_packer, "_encoding", lambda: WordEncoding())
+
+
+def words(n, word="step"):
+    """A chunk of exactly 2n - 1 tokens."""
+    return " ".join([word] * n)
+
+
+def test_everything_fits():
+    chunks = ["aspirate 50 uL", "dispense into B1"]
+
+    packed = pack_context(chunks, ["a.rst", "b.rst"], [0.9, 0.8], budget=100)
+
+    assert packed.chunks == chunks
+    assert packed.sources == ["a.rst", "b.rst"]
+    assert packed.text == "aspirate 50 uL\n\ndispense into B1"
+    assert packed.tokens == 5 + 1 + 5
+    assert (packed.dropped, packed.trimmed) == (0, False)
+
+
+def test_duplicates_are_skipped():
+    packed = pack_context(["mix  three times", "mix three\ntimes", "touch tip"],
+                          ["a", "b", "c"], [0.9, 0.8, 0.7], budget=100)
+
+    assert packed.chunks == ["mix  three times", "touch tip"]
+    assert packed.dropped == 1
+
+
+def test_low_scores_are_dropped():
+    packed = pack_context(["best", "close", "far"], ["a", "b", "c"], [1.0, 0.6, 0.2],
+                          budget=100, min_score_ratio=0.5)
+
+    assert packed.chunks == ["best", "close"]
+    assert packed.dropped == 1
+
+
+def test_first_chunk_over_budget_is_trimmed():
+    budget = MIN_TRIMMED_TOKENS * 3
+    first = words(MIN_TRIMMED_TOKENS, "first")
+    second = words(MIN_TRIMMED_TOKENS * 2, "second")
+
+    packed = pack_context([first, second, "never reached"], ["a", "b", "c"], [0.9, 0.8, 0.7], budget=budget)
+
+    assert packed.trimmed
+    assert packed.tokens == budget
+    assert packed.chunks[0] == first
+    assert second.startswith(packed.chunks[1]) and packed.chunks[1] != second
+    assert packed.dropped == 1
+
+
+def test_short_remainder_is_not_trimmed_in():
+    first = words(40, "first")
+    packed = pack_context([first, words(200)], ["a", "b"], [0.9, 0.8], budget=100)
+
+    assert packed.chunks == [first]
+    assert packed.tokens == 79
+    assert (packed.dropped, packed.trimmed) == (1, False)
+
+
+def test_no_chunks():
+    packed = pack_context([], [], [], budget=100)
+
+    assert (packed.text, packed.tokens, packed.chunks) == ("", 0, [])
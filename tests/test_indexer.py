@@ -0,0 +1,132 @@
+import os
+import zlib
+
+import numpy as np
+import pytest
+
+from indexer import refresh_store, docs_changed
+
+
+DIM = 16
+
+
+def stub_embed(texts, api_key=None):
+    """Deterministic unit vectors, one per text, without the API."""
+    vectors = np.stack([
+        np.random.default_rng(zlib.crc32(text.encode("utf-8"))).standard_normal(DIM) for text in texts
+    ]).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def write_doc(docs, name, text, bump=0):
+    path = os.path.join(docs, name)
+    with open(path, "w") as f:
+        f.write(text)
+    # Edits within the same mtime tick must still be seen as changes
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + bump * 1_000_000_000))
+
+
+def texts_of(store):
+    return sorted(store.chunks[int(i)] for i in store.ids)
+
+
+def search_ids(store, text):
+    _, ids = store.index.search(stub_embed([text]), 1)
+    return int(ids[0][0])
+
+
+@pytest.fixture
+def docs(tmp_path):
+    path = tmp_path / "docs"
+    path.mkdir()
+    write_doc(path, "pipettes.txt", "Load a P300 pipette on the left mount.")
+    write_doc(path, "labware.txt", "Load a 96-well plate in slot 1.")
+    return str(path)
+
+
+@pytest.fixture
+def store_dir(tmp_path):
+    return str(tmp_path / "store")
+
+
+def refresh(store_dir, docs):
+    return refresh_store(store_dir, docs, None, embed_fn=stub_embed)
+
+
+def test_first_build_indexes_every_file(docs, store_dir):
+    store, stats = refresh(store_dir, docs)
+
+    assert stats["added"] == 2 and stats["chunks_embedded"] == len(store) == 2
+    assert any("P300" in text for text in texts_of(store))
+
+
+def test_unchanged_docs_embed_nothing(docs, store_dir):
+    refresh(store_dir, docs)
+    store, stats = refresh(store_dir, docs)
+
+    assert stats["unchanged"] == 2
+    assert stats["chunks_embedded"] == 0
+    assert not docs_changed(store, docs)
+
+
+def test_added_file_is_embedded_alone(docs, store_dir):
+    refresh(store_dir, docs)
+    write_doc(docs, "tips.txt", "Pick up a tip from the tip rack in slot 2.")
+
+    store, stats = refresh(store_dir, docs)
+
+    assert (stats["added"], stats["unchanged"], stats["chunks_embedded"]) == (1, 2, 1)
+    assert len(store) == 3
+    chunk_id = search_ids(store, store.chunks[int(store.ids[-1])])
+    assert "tip rack" in store.chunks[chunk_id]
+
+
+def test_edited_file_replaces_its_chunks(docs, store_dir):
+    refresh(store_dir, docs)
+    write_doc(docs, "labware.txt", "Load a 384-well plate in slot 3.", bump=1)
+
+    store, stats = refresh(store_dir, docs)
+
+    assert (stats["changed"], stats["unchanged"], stats["chunks_embedded"]) == (1, 1, 1)
+    assert len(store) == store.index.ntotal == 2
+    texts = texts_of(store)
+    assert any("384-well" in text for text in texts)
+    assert not any("96-well" in text for text in texts)
+
+
+def test_removed_file_leaves_the_index(docs, store_dir):
+    store, _ = refresh(store_dir, docs)
+    removed_ids = {int(i) for i in store.ids if "P300" in store.chunks[int(i)]}
+    os.remove(os.path.join(docs, "pipettes.txt"))
+
+    store, stats = refresh(store_dir, docs)
+
+    assert (stats["removed"], stats["chunks_embedded"]) == (1, 0)
+    assert len(store) == store.index.ntotal == 1
+    assert not removed_ids & {int(i) for i in store.ids}
+    _, ids = store.index.search(stub_embed(["Load a P300 pipette on the left mount."]), 1)
+    assert int(ids[0][0]) not in removed_ids
+
+
+def test_replaced_store_is_closed(docs, store_dir, monkeypatch):
+    import indexer
+    load_store = indexer.load_store
+    opened = []
+
+    def tracking_load_store(path):
+        opened.append(load_store(path))
+        return opened[-1]
+
+    monkeypatch.setattr(indexer, "load_store", tracking_load_store)
+    refresh(store_dir, docs)
+
+    unchanged, _ = refresh(store_dir, docs)
+    assert unchanged is opened[1] and unchanged.embeddings is not None
+
+    write_doc(docs, "labware.txt", "Load a 384-well plate in slot 3.", bump=1)
+    store, _ = refresh(store_dir, docs)
+
+    previous = opened[2]
+    assert store is opened[-1] and store is not previous
+    assert previous.embeddings is None and len(store) == 2
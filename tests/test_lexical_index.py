@@ -0,0 +1,91 @@
+import pytest
+
+from lexical_index import LexicalIndex, tokenize, reciprocal_rank_fusion, RRF_K
+
+
+CHUNKS = [
+    "Use pipette.pick_up_tip() before aspirating, then drop_tip() when done.",
+    "protocol.load_labware('corning_96_wellplate_360ul_flat', 1) loads a plate in slot 1.",
+    "A tip rack holds the tips; load it like any other labware.",
+    "Set the flow rate of the pipette to aspirate slowly from the reservoir.",
+]
+IDS = [10, 11, 12, 13]
+
+
+@pytest.fixture
+def lexical():
+    return LexicalIndex.build(CHUNKS, IDS)
+
+
+def test_identifiers_are_kept_whole_and_split():
+    assert tokenize("pipette.pick_up_tip()") == ["pipette", "pick_up_tip", "pick", "up", "tip"]
+    assert tokenize("loadLabware") == ["loadlabware", "load", "labware"]
+
+
+def test_tokens_are_lowercased_without_stopwords():
+    assert tokenize("How do I Load the Plate?") == ["load", "plate"]
+
+
+def test_exact_api_name_ranks_its_chunk_first(lexical):
+    assert lexical.search("load_labware")[0] == 11
+    assert lexical.search("how to call pick_up_tip")[0] == 10
+
+
+def test_split_words_find_identifiers(lexical):
+    assert lexical.search("pick up a tip")[0] == 10
+
+
+def test_unknown_terms_match_nothing(lexical):
+    assert lexical.search("thermocycler") == []
+    assert LexicalIndex.build([]).search("tip") == []
+
+
+def test_search_returns_at_most_k_ids(lexical):
+    assert len(lexical.search("tip labware pipette", k=2)) == 2
+
+
+def test_save_load_round_trip(lexical, tmp_path):
+    lexical.save(str(tmp_path))
+
+    assert LexicalIndex.exists(str(tmp_path))
+    loaded = LexicalIndex.load(str(tmp_path), lexical.ids)
+    for query in ["load_labware", "pick up a tip", "aspirate", "tip labware pipette"]:
+        assert loaded.search(query) == lexical.search(query)
+
+
+def test_single_ranking_keeps_its_order():
+    fused = reciprocal_rank_fusion([7, 3, 5])
+
+    assert [chunk_id for chunk_id, _ in fused] == [7, 3, 5]
+    assert fused[0][1] == pytest.approx(1 / (RRF_K + 1))
+
+
+def test_ids_ranked_by_both_lists_come_first():
+    vector = [1, 2, 3, 4]
+    lexical = [4, 9, 1]
+
+    fused = dict(reciprocal_rank_fusion(vector, lexical))
+
+    assert fused[1] == pytest.approx(1 / (RRF_K + 1) + 1 / (RRF_K + 3))
+    assert fused[4] == pytest.approx(1 / (RRF_K + 4) + 1 / (RRF_K + 1))
+    assert min(fused[1], fused[4]) > max(fused[2], fused[3], fused[9])
+
+
+def test_results_are_sorted_best_first():
+    fused = reciprocal_rank_fusion([5, 6, 7], [7, 6, 5], [6])
+
+    scores = [score for _, score in fused]
+    assert scores == sorted(scores, reverse=True)
+    assert fused[0][0] == 6
+
+
+def test_k_flattens_rank_differences():
+    steep = dict(reciprocal_rank_fusion([1, 2], k=1))
+    flat = dict(reciprocal_rank_fusion([1, 2], k=1000))
+
+    assert steep[1] / steep[2] > flat[1] / flat[2]
+
+
+def test_no_rankings():
+    assert reciprocal_rank_fusion() == []
+    assert reciprocal_rank_fusion([], []) == []
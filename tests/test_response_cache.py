@@ -0,0 +1,98 @@
+from types import SimpleNamespace
+
+import pytest
+from cryptography.fernet import Fernet
+
+import response_cache
+from rag_events import event_sink
+from response_cache import ResponseCache, cache_scope, cached_call
+
+
+ALICE = Fernet.generate_key()
+BOB = Fernet.generate_key()
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = ResponseCache(ttl=3600, max_entries=16, use_db=False)
+    monkeypatch.setattr(response_cache, "_cache", cache)
+    return cache
+
+
+def test_hit_within_the_same_scope(cache):
+    with cache_scope(ALICE):
+        cache.put("detect", "prompt", "opentrons")
+        assert cache.get("detect", "prompt") == "opentrons"
+
+
+def test_users_never_share_entries(cache):
+    with cache_scope(ALICE):
+        cache.put("detect", "prompt", "opentrons")
+    with cache_scope(BOB):
+        assert cache.get("detect", "prompt") is None
+    assert cache.get("detect", "prompt") is None
+
+
+def test_unscoped_entries_stay_unscoped(cache):
+    cache.put("detect", "prompt", "tecan")
+
+    assert cache.get("detect", "prompt") == "tecan"
+    with cache_scope(ALICE):
+        assert cache.get("detect", "prompt") is None
+
+
+def test_keys_are_scoped_by_stage(cache):
+    with cache_scope(ALICE):
+        cache.put("detect", "prompt", "opentrons")
+        assert cache.get("consolidate", "prompt") is None
+
+
+def test_keys_and_values_are_keyed_by_the_session_key(cache):
+    with cache_scope(ALICE):
+        cache.put("consolidate", "prompt", "The user wants to transfer 50 uL.")
+
+    (key, (_, value)), = cache._memory.items()
+    assert key.startswith("consolidate:")
+    assert key != ResponseCache._key("consolidate", "prompt", None)
+    assert key != ResponseCache._key("consolidate", "prompt", BOB)
+    assert "50 uL" not in value
+
+
+def test_str_and_bytes_keys_scope_alike(cache):
+    with cache_scope(ALICE):
+        cache.put("detect", "prompt", "opentrons")
+    with cache_scope(ALICE.decode("utf-8")):
+        assert cache.get("detect", "prompt") == "opentrons"
+
+
+def test_cached_call_reuses_answers_per_scope(cache):
+    calls = []
+
+    def create(**kwargs):
+        calls.append(kwargs)
+        return SimpleNamespace(output_text=" opentrons \n", usage=None)
+
+    request = {"model": "gpt-4o-mini", "input": [{"role": "user", "content": "Which robot?"}]}
+    with event_sink(lambda event: None):
+        with cache_scope(ALICE):
+            assert cached_call("detect", create, **request) == "opentrons"
+            assert cached_call("detect", create, **request) == "opentrons"
+        with cache_scope(BOB):
+            assert cached_call("detect", create, **request) == "opentrons"
+
+    assert len(calls) == 2
+    assert cache.stats()["stages"]["detect"]["memory_hits"] == 1
+
+
+def test_cached_call_skips_invalid_answers(cache):
+    calls = []
+
+    def create(**kwargs):
+        calls.append(kwargs)
+        return SimpleNamespace(output_text="", usage=None)
+
+    with event_sink(lambda event: None), cache_scope(ALICE):
+        cached_call("triage", create, validate=bool, model="gpt-4o-mini", input=[])
+        cached_call("triage", create, validate=bool, model="gpt-4o-mini", input=[])
+
+    assert len(calls) == 2
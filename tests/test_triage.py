@@ -0,0 +1,58 @@
+import json
+
+import pytest
+
+from triage import Triage, _parse_triage, _usable
+
+
+def answer(**fields):
+    data = {"sufficient": True, "follow_up_question": None, "consolidated_request": None, "platform": None}
+    data.update(fields)
+    return json.dumps(data)
+
+
+def test_sufficient_request():
+    triage = _parse_triage(answer(consolidated_request="  The user wants to transfer 50 uL.  ",
+                                  platform="opentrons"))
+
+    assert triage == Triage(consolidated_request="The user wants to transfer 50 uL.", platform="opentrons")
+
+
+def test_platform_is_normalized_to_an_id():
+    triage = _parse_triage(answer(consolidated_request="The user wants ...", platform=' "Beckman Coulter" '))
+
+    assert triage.platform == "beckman_coulter"
+
+
+def test_missing_platform_is_unknown():
+    assert _parse_triage(answer(consolidated_request="The user wants ...")).platform == "unknown"
+
+
+def test_follow_up_question():
+    triage = _parse_triage(answer(sufficient=False, follow_up_question="Which pipette do you use? ",
+                                  consolidated_request="ignored"))
+
+    assert triage == Triage(follow_up="Which pipette do you use?")
+
+
+@pytest.mark.parametrize("payload", [
+    answer(sufficient=False, follow_up_question="  "),
+    answer(sufficient=False),
+    answer(consolidated_request="", platform="opentrons"),
+    answer(platform="opentrons"),
+])
+def test_incomplete_answers_are_rejected(payload):
+    assert _parse_triage(payload) is None
+    assert not _usable(payload)
+
+
+@pytest.mark.parametrize("payload", ["not json", "{}", json.dumps({"sufficient": True}), "[]"])
+def test_malformed_answers_are_not_usable(payload):
+    assert not _usable(payload)
+
+
+def test_round_trip_through_a_job():
+    triage = Triage(consolidated_request="The user wants ...", platform="tecan")
+
+    assert Triage.from_dict(json.loads(json.dumps(triage.to_dict()))) == triage
+    assert Triage.from_dict(None) is None